@@ -1,31 +1,434 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from datetime import datetime, timedelta
+import asyncio
+import base64
+import heapq
+from functools import lru_cache, wraps
 import os
-from models import User, Room, Appliance, UsageLog, ThresholdLevels, ThresholdAlerts
+import numpy as np
+from models import User, Room, Appliance, UsageLog, ThresholdLevels, ThresholdAlerts, ApplianceLatestReading
+from models import UsageRollupDaily, UsageRollupMonthly, UserMonthlyUsage, DEFAULT_WARNING_KWH, DEFAULT_CRITICAL_KWH
+from sqlalchemy import func, case, select, text, bindparam, DateTime, and_, or_
 from werkzeug.security import generate_password_hash, check_password_hash
-from database import get_session, remove_session, initialize_database
-import random
+from database import get_session, get_read_session, remove_session, initialize_database, AsyncReadSession, async_read_engine, run_async
+from database import begin_request_pool_stats, end_request_pool_stats, pool_status, engine, read_engine
+from ingest import NDJSON_CONTENT_TYPES, iter_ndjson, ingest_readings, bulk_load_usage_logs, parse_timestamp
+from export import EXPORT_FORMATS, export_usage_logs
+from purge import purge_pending, exceeds_sync_limit, delete_appliances, start_purge
+from rollups import evaluate_thresholds
+from user_cache import UserRecord, user_cache
+from response_cache import cached_response, invalidates_response_cache, response_cache, uncacheable
+from realtime import socketio, push_to_user
+from simulator import simulate_usage_arrays, format_timestamps, simulation_slots, appliance_chunks
+from simulator import RESOLUTIONS, PROFILES, MAX_SIMULATION_DAYS, MAX_SIMULATION_SLOTS
+from columnar_store import load_series
+import query_debug
+import profiler
+from profiler import admin_required
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, request_metrics, instrument_engine, metric_lines
 
-app = Flask(__name__)
+class SmartHomeApp(Flask):
+    def async_to_sync(self, func):
+        """Run async views on the shared async loop instead of a new event loop per call, so
+        async_read_engine's pooled connections are reused across requests"""
+        @wraps(func)
+        def run(*args, **kwargs):
+            return run_async(profiler.followed(func(*args, **kwargs)))
+        return run
+
+app = SmartHomeApp(__name__)
 app.config['SECRET_KEY'] = os.urandom(24)
 
+# Most recent alerts returned by /api/dashboard-stats
+DASHBOARD_ALERT_LIMIT = 10
+
+# Page sizes for /api/usage-logs
+USAGE_LOG_PAGE_SIZE = 100
+MAX_USAGE_LOG_PAGE_SIZE = 1000
+# Appliance seeks per /api/usage-logs statement; SQLite allows 500 SELECTs in a compound
+MAX_UNION_SEEKS = 500
+
 # Initialize login manager
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+socketio.init_app(app)
+
+# The async views' SQL runs on the async engine's sync core
+instrumented_engines = (engine, read_engine, async_read_engine.sync_engine)
+for instrumented_engine in instrumented_engines:
+    instrument_engine(instrumented_engine)
+query_debug.init_app(app, instrumented_engines)
+profiler.init_app(app, instrumented_engines)
+
+@app.before_request
+def start_request_metrics():
+    request_metrics.begin()
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed bodies are still being generated; their time is not included
+    request_metrics.end(request.url_rule.rule if request.url_rule else 'unmatched', request.method, response.status_code)
+    return response
+
+@app.teardown_request
+def record_failed_request_metrics(exception=None):
+    # Only still pending if the view raised and after_request never ran
+    request_metrics.end(request.url_rule.rule if request.url_rule else 'unmatched', request.method, 500)
+
+@app.before_request
+def start_pool_stats():
+    begin_request_pool_stats()
+
+@app.after_request
+def add_pool_stats_headers(response):
+    """Report this request's connection checkouts so the pools can be sized per worker"""
+    stats = end_request_pool_stats()
+    if stats is not None:
+        response.headers['X-DB-Checkouts'] = str(stats.checkouts)
+        response.headers['X-DB-Overflow-Checkouts'] = str(stats.overflow_checkouts)
+        response.headers['X-DB-Pool-Wait-Ms'] = f'{stats.wait_seconds * 1000:.3f}'
+    return response
+
 @app.teardown_appcontext
 def shutdown_session(exception=None):
+    # The only place a request's sessions are closed
     remove_session()
 
+def user_appliance_ids(session, user_id):
+    """Subquery of a user's appliance ids, so rollup reads seek by appliance first"""
+    return session.query(Appliance.appliance_id).join(Room).filter(Room.user_id == user_id)
+
+def user_appliance_ids_select(user_id):
+    """user_appliance_ids() as a select(), for statements that also run on the async engine"""
+    return select(Appliance.appliance_id).join(Room).where(Room.user_id == user_id)
+
+# The dashboard reads are built as select() statements, so the sync views
+# and the async ones (on AsyncReadSession) share them
+def home_readings_query(user_id):
+    """(room, appliance, latest reading) rows of a user's home, room by room"""
+    return select(Room, Appliance, ApplianceLatestReading)\
+        .outerjoin(Appliance, Appliance.room_id == Room.room_id)\
+        .outerjoin(ApplianceLatestReading, ApplianceLatestReading.appliance_id == Appliance.appliance_id)\
+        .where(Room.user_id == user_id)\
+        .order_by(Room.room_id, Appliance.appliance_id)
+
+def group_home_readings(rows):
+    """Group home_readings_query() rows into [(room, [(appliance, latest_reading), ...]), ...]"""
+    home = []
+    for room, appliance, latest in rows:
+        if not home or home[-1][0] is not room:
+            home.append((room, []))
+        if appliance is not None:
+            home[-1][1].append((appliance, latest))
+    return home
+
+def load_home_readings(session, user_id):
+    """Return [(room, [(appliance, latest_reading), ...]), ...] for a user in one query"""
+    return group_home_readings(session.execute(home_readings_query(user_id)).all())
+
+def usage_totals_query(user_id):
+    """One row of (today's kWh, this month's kWh) for a user from the daily rollups"""
+    now = datetime.utcnow()
+    today_start = datetime(now.year, now.month, now.day)
+    month_start = datetime(now.year, now.month, 1)
+    # One pass over this month's daily rollups yields both totals
+    return select(
+            func.sum(case((UsageRollupDaily.period_start >= today_start, UsageRollupDaily.energy_consumed), else_=0)),
+            func.sum(UsageRollupDaily.energy_consumed)
+        )\
+        .where(
+            UsageRollupDaily.appliance_id.in_(user_appliance_ids_select(user_id)),
+            UsageRollupDaily.period_start >= month_start
+        )
+
+def round_usage_totals(row):
+    current_usage, monthly_usage = row
+    return round(current_usage or 0, 2), round(monthly_usage or 0, 2)
+
+def usage_totals(session, user_id):
+    """Return (today's kWh, this month's kWh) for a user from the daily rollups"""
+    return round_usage_totals(session.execute(usage_totals_query(user_id)).one())
+
+def reading_json(appliance, latest_log):
+    """An /api/energy-readings item"""
+    return {
+        'appliance_id': appliance.appliance_id,
+        'appliance_name': appliance.appliance_name,
+        'current_power': latest_log.energy_consumed if latest_log else 0,
+        'status': 'Active' if latest_log else 'Inactive',
+        'timestamp': latest_log.timestamp.strftime('%Y-%m-%d %H:%M:%S') if latest_log else 'N/A'
+    }
+
+def alert_json(alert):
+    """An /api/alerts item"""
+    return {
+        'type': 'warning' if alert.level_id == 'Warning' else 'danger',
+        'message': f'Energy usage reached {alert.level_id} level ({alert.current_kwh} kWh)',
+        'timestamp': alert.alert_date.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+def recent_alerts_query(user_id):
+    """A user's most recent threshold alerts, newest first"""
+    return select(ThresholdAlerts)\
+        .where(ThresholdAlerts.user_id == user_id)\
+        .order_by(ThresholdAlerts.alert_date.desc())\
+        .limit(DASHBOARD_ALERT_LIMIT)
+
+def recent_alerts(session, user_id):
+    return session.execute(recent_alerts_query(user_id)).scalars().all()
+
+def dashboard_stats_payload(totals, alerts):
+    """The /api/dashboard-stats body, from usage_totals() and recent_alerts()"""
+    current_usage, monthly_usage = totals
+    return {
+        'current_usage': current_usage,
+        'monthly_usage': monthly_usage,
+        'alerts': [{'level': alert.level_id, 'date': alert.alert_date.strftime('%Y-%m-%d'), 'message': f"Energy usage exceeded {alert.level_id} threshold"} for alert in alerts]
+    }
+
+def usage_history_query(user_id, now):
+    """(period_start, kWh) rows summing the monthly rollups of all the user's appliances for the current year"""
+    return select(UsageRollupMonthly.period_start, func.sum(UsageRollupMonthly.energy_consumed))\
+        .where(
+            UsageRollupMonthly.appliance_id.in_(user_appliance_ids_select(user_id)),
+            UsageRollupMonthly.period_start >= datetime(now.year, 1, 1)
+        )\
+        .group_by(UsageRollupMonthly.period_start)
+
+def usage_history_payload(rows, now):
+    """The /api/usage-history body from usage_history_query(): this year's usage per month, up to the current month"""
+    current_year = now.year
+    monthly_usage = {period_start.strftime('%b %Y'): energy for period_start, energy in rows}
+
+    # Get months from January to current month
+    current_month = now.month
+    result = []
+    for month in range(1, current_month + 1):
+        month_str = datetime(current_year, month, 1).strftime('%b %Y')
+        result.append({
+            'month': month_str,
+            'energy_consumed': monthly_usage.get(month_str, 0),
+            'timestamp': datetime(current_year, month, 1).strftime('%Y-%m-%d %H:%M:%S')
+        })
+    return result
+
+def room_usage_payload(home):
+    """The /api/room-usage body, built from load_home_readings()"""
+    room_data = []
+    for room, appliances in home:
+        # Calculate total power for the room (with None handling)
+        total_power = sum(
+            ((appliance.min_power_rating_watt or 0) + (appliance.max_power_rating_watt or 0)) / 2 * (appliance.quantity or 1)
+            for appliance, _ in appliances
+        ) if appliances else 0
+
+        # Prepare appliance data
+        appliance_data = []
+        for appliance, latest_usage in appliances:
+            status = 'Active' if latest_usage else 'Inactive'
+            current_usage = latest_usage.energy_consumed if latest_usage else 0
+
+            appliance_data.append({
+                'appliance_id': appliance.appliance_id,
+                'appliance_name': appliance.appliance_name or 'Unknown',
+                'quantity': appliance.quantity or 1,
+                'min_power_rating_watt': appliance.min_power_rating_watt or 0,
+                'max_power_rating_watt': appliance.max_power_rating_watt or 0,
+                'current_usage': current_usage,
+                'status': status
+            })
+
+        room_data.append({
+            'room_id': room.room_id,
+            'room_name': room.room_name or 'Unknown Room',
+            'total_power': total_power,
+            'appliances': appliance_data
+        })
+    return room_data
+
+def energy_readings_payload(home):
+    """The /api/energy-readings body, built from load_home_readings()"""
+    return [reading_json(appliance, latest_log) for room, appliances in home for appliance, latest_log in appliances]
+
+def latest_log_ids(session, user_id):
+    """Map each of a user's appliances to the log_id of its latest reading"""
+    return dict(session.query(ApplianceLatestReading.appliance_id, ApplianceLatestReading.log_id)
+        .filter(ApplianceLatestReading.appliance_id.in_(user_appliance_ids(session, user_id)))
+        .all())
+
+def push_usage_delta(session, user_id, previous_log_ids):
+    """Push the readings that changed since `previous_log_ids`, and the new totals, to the user's sockets"""
+    rows = session.query(Appliance, ApplianceLatestReading)\
+        .join(ApplianceLatestReading, ApplianceLatestReading.appliance_id == Appliance.appliance_id)\
+        .filter(Appliance.appliance_id.in_(user_appliance_ids(session, user_id)))\
+        .all()
+    readings = [reading_json(appliance, latest) for appliance, latest in rows
+                if previous_log_ids.get(appliance.appliance_id) != latest.log_id]
+    if readings:
+        push_to_user(user_id, 'readings', readings)
+    # Backfilled readings change the totals without changing any latest reading
+    current_usage, monthly_usage = usage_totals(session, user_id)
+    push_to_user(user_id, 'totals', {
+        'current_usage': current_usage,
+        'monthly_usage': monthly_usage,
+        'month': datetime.now().strftime('%b %Y')
+    })
+
+def latest_alert_id(session, user_id):
+    """The user's newest alert_id, to tell which alerts a write raised"""
+    return session.query(func.max(ThresholdAlerts.alert_id)).filter_by(user_id=user_id).scalar() or 0
+
+def push_new_alerts(session, user_id, previous_alert_id):
+    """Push the alerts raised since `previous_alert_id` to the user's sockets and return them"""
+    alerts = session.query(ThresholdAlerts)\
+        .filter(ThresholdAlerts.user_id == user_id, ThresholdAlerts.alert_id > previous_alert_id)\
+        .order_by(ThresholdAlerts.alert_id)\
+        .all()
+    if alerts:
+        push_to_user(user_id, 'alerts', [alert_json(alert) for alert in alerts])
+    return alerts
+
+def date_arg(name):
+    """An optional ISO 8601 query argument as a naive UTC datetime, like the stored timestamps; ValueError if malformed"""
+    value = request.args.get(name)
+    return parse_timestamp(value) if value else None
+
+def encode_log_cursor(timestamp, log_id):
+    """An opaque /api/usage-logs cursor for the position just after (timestamp, log_id)"""
+    token = f'{timestamp.isoformat()}|{log_id}'.encode()
+    return base64.urlsafe_b64encode(token).decode().rstrip('=')
+
+def decode_log_cursor(cursor):
+    """Return (timestamp, log_id) from encode_log_cursor(); raise ValueError on a bad token"""
+    token = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    timestamp, log_id = token.split('|')
+    return datetime.fromisoformat(timestamp), int(log_id)
+
+# One appliance's keyset seek on the (appliance_id, timestamp) index; SQLite
+# only takes ORDER BY and LIMIT in a compound's arms inside subqueries
+USAGE_LOG_SEEK_SQL = """SELECT * FROM (
+    SELECT log_id, appliance_id, timestamp, energy_consumed, duration_hours FROM usage_logs
+    WHERE appliance_id = :appliance_{index} AND timestamp IS NOT NULL{conditions}
+    ORDER BY timestamp DESC, log_id DESC LIMIT :page_rows
+)"""
+
+@lru_cache(maxsize=64)
+def usage_log_page_statement(seeks, has_start, has_end, has_after):
+    """UNION ALL of `seeks` appliance seeks, merged newest first and limited to a page"""
+    conditions = ''
+    params = []
+    if has_start:
+        conditions += ' AND timestamp >= :start'
+        params.append(bindparam('start', type_=DateTime()))
+    if has_end:
+        conditions += ' AND timestamp < :end'
+        params.append(bindparam('end', type_=DateTime()))
+    if has_after:
+        conditions += (' AND timestamp <= :after_timestamp AND (timestamp < :after_timestamp'
+                       ' OR (timestamp = :after_timestamp AND log_id < :after_log_id))')
+        params.append(bindparam('after_timestamp', type_=DateTime()))
+    seek_sql = ' UNION ALL '.join(USAGE_LOG_SEEK_SQL.format(index=index, conditions=conditions) for index in range(seeks))
+    logs = UsageLog.__table__
+    return text(f'{seek_sql} ORDER BY timestamp DESC, log_id DESC LIMIT :page_rows')\
+        .bindparams(*params)\
+        .columns(logs.c.log_id, logs.c.appliance_id, logs.c.timestamp, logs.c.energy_consumed, logs.c.duration_hours)
+
+def usage_log_page(session, appliance_ids, start, end, after, limit):
+    """Up to `limit` + 1 usage_logs rows of some appliances, newest first, strictly after the `after` position.
+
+    Each appliance gets its own keyset seek on the (appliance_id, timestamp)
+    index, limited to `limit` + 1 rows, and the seeks are UNION ALLed into one
+    statement that merges and limits them. A page therefore sorts at most
+    appliances x (limit + 1) rows, however deep into the history it is and
+    however many other homes share the table.
+    """
+    params = {'page_rows': limit + 1, 'start': start, 'end': end}
+    if after is not None:
+        params['after_timestamp'], params['after_log_id'] = after
+    runs = []
+    for first in range(0, len(appliance_ids), MAX_UNION_SEEKS):
+        chunk = appliance_ids[first:first + MAX_UNION_SEEKS]
+        statement = usage_log_page_statement(len(chunk), start is not None, end is not None, after is not None)
+        params.update((f'appliance_{index}', appliance_id) for index, appliance_id in enumerate(chunk))
+        runs.append(session.execute(statement, params).all())
+    if len(runs) == 1:
+        return runs[0]
+    merged = heapq.merge(*runs, key=lambda row: (row.timestamp, row.log_id), reverse=True)
+    return [row for row, _ in zip(merged, range(limit + 1))]
+
+def purge_appliances(session, appliance_ids, room_id, message):
+    """Delete a room or appliance for the delete endpoints, in the background if it has many usage logs"""
+    user_id = current_user.user_id
+    if purge_pending(appliance_ids):
+        return jsonify({'success': True, 'pending': True, 'message': 'Deletion already in progress'}), 202
+    if exceeds_sync_limit(session.connection(), appliance_ids):
+        # Hand the writer connection back before the first chunk needs it
+        session.rollback()
+        start_purge(user_id, appliance_ids, room_id, chunked=True,
+                    on_done=lambda: response_cache.invalidate_user(user_id))
+        return jsonify({'success': True, 'pending': True, 'message': 'Deletion started'}), 202
+    delete_appliances(session.connection(), user_id, appliance_ids, room_id)
+    session.commit()
+    start_purge(user_id, appliance_ids)
+    return jsonify({'success': True, 'message': message})
+
+MICROSECONDS_PER_HOUR = 3600 * 10**6
+MICROSECONDS_PER_DAY = 24 * MICROSECONDS_PER_HOUR
+
+def appliance_analytics_payload(series, start, end):
+    """The /api/appliance/<id>/analytics body, computed on the columnar store's views"""
+    timestamps, energy = series.between(start, end)
+    payload = {'appliance_id': series.appliance_id, 'readings': len(energy)}
+    if not len(energy):
+        return dict(payload, total_kwh=0, mean_kwh=0, p50_kwh=0, p95_kwh=0, max_kwh=0,
+                    hourly_profile=[0] * 24, daily_totals=[])
+    energy = energy.astype(np.float64)
+    p50, p95 = np.percentile(energy, [50, 95])
+
+    # Average kWh per reading for each hour of the day (UTC)
+    hours = (timestamps // MICROSECONDS_PER_HOUR) % 24
+    hour_counts = np.bincount(hours, minlength=24)
+    hour_totals = np.bincount(hours, weights=energy, minlength=24)
+    hourly_profile = np.divide(hour_totals, hour_counts, out=np.zeros(24), where=hour_counts > 0)
+
+    days, day_index = np.unique(timestamps // MICROSECONDS_PER_DAY, return_inverse=True)
+    day_totals = np.bincount(day_index, weights=energy)
+    return dict(
+        payload,
+        total_kwh=float(energy.sum()),
+        mean_kwh=float(energy.mean()),
+        p50_kwh=float(p50),
+        p95_kwh=float(p95),
+        max_kwh=float(energy.max()),
+        hourly_profile=hourly_profile.tolist(),
+        daily_totals=[
+            {'date': str(np.datetime64(int(day), 'D')), 'energy_consumed': float(total)}
+            for day, total in zip(days, day_totals)
+        ]
+    )
+
 @login_manager.user_loader
 def load_user(user_id):
-    session = get_session()
     try:
-        return session.query(User).get(int(user_id))
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    record = user_cache.get(user_id)
+    if record is not None:
+        return record
+    session = get_read_session()
+    try:
+        user = session.query(User).get(user_id)
     except:
         return None
+    if user is None:
+        return None
+    record = UserRecord.from_user(user)
+    user_cache.put(record)
+    return record
 
 @app.route('/')
 def index():
@@ -78,15 +481,13 @@ def register():
             session.rollback()
             flash(f'Error during registration: {str(e)}')
             return redirect(url_for('register'))
-        finally:
-            remove_session()
     
     return render_template('register.html')
 
 @app.route('/forgot-password', methods=['GET', 'POST'])
 def forgot_password():
     if request.method == 'POST':
-        session = get_session()
+        session = get_read_session()
         try:
             email = request.form.get('email')
             user = session.query(User).filter_by(email=email).first()
@@ -99,15 +500,13 @@ def forgot_password():
         except Exception as e:
             flash(f'Error: {str(e)}')
             return redirect(url_for('forgot_password'))
-        finally:
-            remove_session()
     
     return render_template('forgot_password.html')
 
 @app.route('/verify-security', methods=['GET', 'POST'])
 def verify_security():
     if request.method == 'POST':
-        session = get_session()
+        session = get_read_session()
         try:
             email = request.form.get('email')
             security_answer = request.form.get('security_answer')
@@ -125,16 +524,13 @@ def verify_security():
         except Exception as e:
             flash(f'Error: {str(e)}')
             return redirect(url_for('verify_security', email=email))
-        finally:
-            remove_session()
     
     email = request.args.get('email')
     if not email:
         return redirect(url_for('forgot_password'))
     
-    session = get_session()
+    session = get_read_session()
     user = session.query(User).filter_by(email=email).first()
-    session.close()
     
     if not user:
         return redirect(url_for('forgot_password'))
@@ -161,6 +557,7 @@ def reset_password():
             
             user.password = generate_password_hash(new_password)
             session.commit()
+            user_cache.invalidate(user.user_id)
             
             flash('Password reset successful! Please login with your new password.')
             return redirect(url_for('login'))
@@ -168,8 +565,6 @@ def reset_password():
             session.rollback()
             flash(f'Error: {str(e)}')
             return redirect(url_for('reset_password', email=email))
-        finally:
-            remove_session()
     
     email = request.args.get('email')
     if not email:
@@ -180,7 +575,7 @@ def reset_password():
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
-        session = get_session()
+        session = get_read_session()
         try:
             email = request.form.get('email')
             password = request.form.get('password')
@@ -202,8 +597,6 @@ def login():
             print(f"Login error: {str(e)}")
             flash('An error occurred during login', 'error')
             return redirect(url_for('login'))
-        finally:
-            remove_session()
             
     return render_template('login.html')
 
@@ -216,75 +609,79 @@ def logout():
 
 @app.route('/api/simulate-data', methods=['POST'])
 @login_required
+@invalidates_response_cache
 def simulate_data():
     session = get_session()
     try:
+        params = request.get_json(silent=True) or request.values
+        try:
+            days = int(params.get('days', 7))
+            seed = params.get('seed')
+            seed = int(seed) if seed not in (None, '') else None
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'days and seed must be integers'}), 400
+        resolution = params.get('resolution', 'hourly')
+        profile = params.get('profile', 'peaks')
+        if not 1 <= days <= MAX_SIMULATION_DAYS:
+            return jsonify({'success': False, 'message': f'days must be between 1 and {MAX_SIMULATION_DAYS}'}), 400
+        if resolution not in RESOLUTIONS:
+            return jsonify({'success': False, 'message': f"resolution must be one of {', '.join(RESOLUTIONS)}"}), 400
+        if profile not in PROFILES:
+            return jsonify({'success': False, 'message': f"profile must be one of {', '.join(PROFILES)}"}), 400
+
         # Get user's rooms and appliances
-        rooms = session.query(Room).filter_by(user_id=current_user.user_id).all()
-        
-        if not rooms:
+        if not session.query(Room.room_id).filter_by(user_id=current_user.user_id).first():
             return jsonify({
                 'success': False,
                 'message': 'Please add at least one room first'
             }), 400
+        appliances = session.query(
+                Appliance.appliance_id, Appliance.appliance_name,
+                Appliance.min_power_rating_watt, Appliance.max_power_rating_watt
+            )\
+            .join(Room)\
+            .filter(Room.user_id == current_user.user_id)\
+            .all()
 
-        # Get current timestamp
-        now = datetime.now()
-        
-        # Generate data for the last 7 days
-        for room in rooms:
-            appliances = session.query(Appliance).filter_by(room_id=room.room_id).all()
-            
-            for appliance in appliances:
-                # Generate realistic usage patterns for each day
-                for day in range(7):
-                    date = now - timedelta(days=day)
-                    
-                    # Morning peak (7-9 AM)
-                    morning_usage = random.uniform(0.5, 1.5) * appliance.max_power_rating_watt / 1000  # Convert to kWh
-                    morning_time = date.replace(hour=random.randint(7, 9), minute=random.randint(0, 59))
-                    
-                    # Afternoon usage (12-2 PM)
-                    afternoon_usage = random.uniform(0.3, 0.8) * appliance.max_power_rating_watt / 1000
-                    afternoon_time = date.replace(hour=random.randint(12, 14), minute=random.randint(0, 59))
-                    
-                    # Evening peak (6-10 PM)
-                    evening_usage = random.uniform(0.7, 2.0) * appliance.max_power_rating_watt / 1000
-                    evening_time = date.replace(hour=random.randint(18, 22), minute=random.randint(0, 59))
-                    
-                    # Create usage logs
-                    usage_logs = [
-                        UsageLog(
-                            appliance_id=appliance.appliance_id,
-                            energy_consumed=morning_usage,
-                            duration_hours=2.0,
-                            timestamp=morning_time
-                        ),
-                        UsageLog(
-                            appliance_id=appliance.appliance_id,
-                            energy_consumed=afternoon_usage,
-                            duration_hours=2.0,
-                            timestamp=afternoon_time
-                        ),
-                        UsageLog(
-                            appliance_id=appliance.appliance_id,
-                            energy_consumed=evening_usage,
-                            duration_hours=4.0,
-                            timestamp=evening_time
-                        )
-                    ]
-                    
-                    session.add_all(usage_logs)
-        
-        session.commit()
-        return jsonify({'success': True, 'message': 'Simulation data generated successfully'})
+        if len(appliances) * simulation_slots(days, resolution) > MAX_SIMULATION_SLOTS:
+            return jsonify({
+                'success': False,
+                'message': f'{len(appliances)} appliances x {days} days at {resolution} resolution is more than '
+                           f'{MAX_SIMULATION_SLOTS} readings; simulate fewer days or a coarser resolution'
+            }), 400
+
+        inserted = 0
+        previous_log_ids = latest_log_ids(session, current_user.user_id)
+        previous_alert_id = latest_alert_id(session, current_user.user_id)
+        now = datetime.utcnow()
+        since = now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+        rng = np.random.default_rng(seed)
+        # Generate a group of appliances' readings as arrays and load them in
+        # bulk, one transaction per group, so neither memory nor the write
+        # lock grows with the whole simulation
+        for chunk in appliance_chunks(appliances, days, resolution):
+            appliance_ids, timestamps, energy, duration = simulate_usage_arrays(
+                chunk, now, days=days, resolution=resolution, profile=profile, seed=rng)
+            rows = list(zip(appliance_ids.tolist(), format_timestamps(timestamps).tolist(),
+                            energy.tolist(), duration.tolist()))
+            inserted += bulk_load_usage_logs(session, rows, [a.appliance_id for a in chunk], since)
+        if inserted:
+            push_usage_delta(session, current_user.user_id, previous_log_ids)
+            push_new_alerts(session, current_user.user_id, previous_alert_id)
+
+        return jsonify({
+            'success': True,
+            'message': 'Simulation data generated successfully',
+            'inserted': inserted,
+            'days': days,
+            'resolution': resolution,
+            'profile': profile
+        })
     
     except Exception as e:
         session.rollback()
         print(f"Error generating simulation data: {str(e)}")
         return jsonify({'success': False, 'message': 'Failed to generate simulation data'}), 500
-    finally:
-        session.close()
 
 @app.route('/dashboard')
 @login_required
@@ -293,213 +690,97 @@ def dashboard():
 
 @app.route('/api/usage-data')
 @login_required
+@cached_response
 def get_usage_data():
-    session = get_session()
-    try:
-        user_rooms = session.query(Room).filter_by(user_id=current_user.user_id).all()
-        data = []
-        for room in user_rooms:
-            room_data = {'room_name': room.room_name, 'appliances': []}
-            for appliance in room.appliances:
-                latest_log = session.query(UsageLog).filter_by(appliance_id=appliance.appliance_id).order_by(UsageLog.timestamp.desc()).first()
-                if latest_log:
-                    room_data['appliances'].append({
-                        'name': appliance.appliance_name,
-                        'energy_consumed': latest_log.energy_consumed,
-                        'timestamp': latest_log.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-                    })
-            data.append(room_data)
-        return jsonify(data)
-    finally:
-        session.close()
+    session = get_read_session()
+    data = []
+    for room, appliances in load_home_readings(session, current_user.user_id):
+        room_data = {'room_name': room.room_name, 'appliances': []}
+        for appliance, latest_log in appliances:
+            if latest_log:
+                room_data['appliances'].append({
+                    'name': appliance.appliance_name,
+                    'energy_consumed': latest_log.energy_consumed,
+                    'timestamp': latest_log.timestamp.strftime('%Y-%m-%d %H:%M:%S')
+                })
+        data.append(room_data)
+    return jsonify(data)
+
+async def read_rows(statement):
+    """Run one read on its own async session, so a view can gather several at once"""
+    async with AsyncReadSession() as session:
+        return (await session.execute(statement)).all()
 
 @app.route('/api/dashboard-stats')
 @login_required
-def get_dashboard_stats():
-    session = get_session()
+@cached_response
+async def get_dashboard_stats():
+    user_id = current_user.user_id
     try:
-        user_rooms = session.query(Room).filter_by(user_id=current_user.user_id).all()
-        all_logs = []
-        for room in user_rooms:
-            for appliance in room.appliances:
-                logs = session.query(UsageLog).filter_by(appliance_id=appliance.appliance_id).all()
-                all_logs.extend(logs)
-        now = datetime.utcnow()
-        today_start = datetime(now.year, now.month, now.day)
-        month_start = datetime(now.year, now.month, 1)
-        current_usage = sum(log.energy_consumed for log in all_logs if log.energy_consumed and log.timestamp >= today_start)
-        monthly_usage = sum(log.energy_consumed for log in all_logs if log.energy_consumed and log.timestamp >= month_start)
-        alerts = session.query(ThresholdAlerts).filter_by(user_id=current_user.user_id).order_by(ThresholdAlerts.alert_date.desc()).all()
-        return jsonify({
-            'current_usage': round(current_usage, 2),
-            'monthly_usage': round(monthly_usage, 2),
-            'alerts': [{'level': alert.level_id, 'date': alert.alert_date.strftime('%Y-%m-%d'), 'message': f"Energy usage exceeded {alert.level_id} threshold"} for alert in alerts]
-        })
+        # The totals and the alerts are independent reads; run them concurrently
+        (totals,), alerts = await asyncio.gather(read_rows(usage_totals_query(user_id)), read_rows(recent_alerts_query(user_id)))
+        return jsonify(dashboard_stats_payload(round_usage_totals(totals), [alert for alert, in alerts]))
     except Exception as e:
         print(f"Error in dashboard stats: {str(e)}")
-        return jsonify({'current_usage': 0, 'monthly_usage': 0, 'alerts': []})
-    finally:
-        session.close()
+        return uncacheable(jsonify({'current_usage': 0, 'monthly_usage': 0, 'alerts': []}))
 
 @app.route('/api/alerts')
 @login_required
-def get_alerts():
-    session = get_session()
+@cached_response
+async def get_alerts():
+    user_id = current_user.user_id
     try:
-        alerts = session.query(ThresholdAlerts).filter_by(user_id=current_user.user_id).order_by(ThresholdAlerts.alert_date.desc()).limit(10).all()
-        return jsonify([{
-            'type': 'warning' if alert.level_id == 'Warning' else 'danger',
-            'message': f'Energy usage reached {alert.level_id} level ({alert.current_kwh} kWh)',
-            'timestamp': alert.alert_date.strftime('%Y-%m-%d %H:%M:%S')
-        } for alert in alerts])
+        return jsonify([alert_json(alert) for alert, in await read_rows(recent_alerts_query(user_id))])
     except Exception as e:
         print(f"Error getting alerts: {e}")
-        return jsonify([])
-    finally:
-        session.close()
+        return uncacheable(jsonify([]))
 
 @app.route('/api/energy-readings')
 @login_required
-def get_energy_readings():
-    session = get_session()
+@cached_response
+async def get_energy_readings():
+    user_id = current_user.user_id
     try:
-        user_rooms = session.query(Room).filter_by(user_id=current_user.user_id).all()
-        appliances = []
-        for room in user_rooms:
-            appliances.extend(room.appliances)
-        readings = []
-        for appliance in appliances:
-            latest_log = session.query(UsageLog).filter_by(appliance_id=appliance.appliance_id).order_by(UsageLog.timestamp.desc()).first()
-            readings.append({
-                'appliance_name': appliance.appliance_name,
-                'current_power': latest_log.energy_consumed if latest_log else 0,
-                'status': 'Active' if latest_log else 'Inactive',
-                'timestamp': latest_log.timestamp.strftime('%Y-%m-%d %H:%M:%S') if latest_log else 'N/A'
-            })
-        return jsonify(readings)
+        return jsonify(energy_readings_payload(group_home_readings(await read_rows(home_readings_query(user_id)))))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    finally:
-        session.close()
 
 @app.route('/api/usage-history')
 @login_required
-def get_usage_history():
+@cached_response
+async def get_usage_history():
     """Get monthly usage history for the current user's appliances"""
-    session = get_session()
+    user_id = current_user.user_id
+    now = datetime.now()
     try:
-        # Get current year and month
-        now = datetime.now()
-        current_year = now.year
-        
-        # Get usage logs for the current year
-        logs = session.query(UsageLog)\
-            .join(Appliance)\
-            .join(Room)\
-            .filter(
-                Room.user_id == current_user.user_id,
-                UsageLog.timestamp >= datetime(current_year, 1, 1)
-            )\
-            .order_by(UsageLog.timestamp.asc())\
-            .all()
-            
-        # Group logs by month and sum energy consumption
-        monthly_usage = {}
-        for log in logs:
-            month_str = log.timestamp.strftime('%b %Y')  # Format: Jan 2025
-            if month_str not in monthly_usage:
-                monthly_usage[month_str] = 0
-            monthly_usage[month_str] += log.energy_consumed
-            
-        # Get months from January to current month
-        current_month = now.month
-        result = []
-        for month in range(1, current_month + 1):
-            month_str = datetime(current_year, month, 1).strftime('%b %Y')
-            result.append({
-                'month': month_str,
-                'energy_consumed': monthly_usage.get(month_str, 0),
-                'timestamp': datetime(current_year, month, 1).strftime('%Y-%m-%d %H:%M:%S')
-            })
-            
-        return jsonify(result)
+        return jsonify(usage_history_payload(await read_rows(usage_history_query(user_id, now)), now))
     except Exception as e:
         print(f"Error getting usage history: {e}")
-        return jsonify([])
-    finally:
-        remove_session()
+        return uncacheable(jsonify([]))
 
 @app.route('/api/rooms')
 @login_required
 def get_rooms():
     """Get all available rooms for the current user"""
-    session = get_session()
+    session = get_read_session()
     try:
         rooms = session.query(Room).filter_by(user_id=current_user.user_id).all()
         return jsonify([{'room_id': room.room_id, 'room_name': room.room_name} for room in rooms])
     except Exception as e:
         print(f"Error getting rooms: {e}")
         return jsonify([])
-    finally:
-        session.close()
 
 @app.route('/api/room-usage')
 @login_required
-def get_room_usage():
-    session = get_session()
+@cached_response
+async def get_room_usage():
+    user_id = current_user.user_id
     try:
-        # Get all rooms for current user
-        rooms = session.query(Room).filter_by(user_id=current_user.user_id).all()
-        
-        if not rooms:
-            return jsonify([])
-            
-        room_data = []
-        for room in rooms:
-            # Get all appliances in this room
-            appliances = session.query(Appliance).filter_by(room_id=room.room_id).all()
-            
-            # Calculate total power for the room (with None handling)
-            total_power = sum(
-                ((appliance.min_power_rating_watt or 0) + (appliance.max_power_rating_watt or 0)) / 2 * (appliance.quantity or 1)
-                for appliance in appliances
-            ) if appliances else 0
-            
-            # Prepare appliance data
-            appliance_data = []
-            for appliance in appliances:
-                # Get the latest usage log for this appliance
-                latest_usage = session.query(UsageLog).filter_by(
-                    appliance_id=appliance.appliance_id
-                ).order_by(UsageLog.timestamp.desc()).first()
-                
-                status = 'Active' if latest_usage else 'Inactive'
-                current_usage = latest_usage.energy_consumed if latest_usage else 0
-                
-                appliance_data.append({
-                    'appliance_id': appliance.appliance_id,
-                    'appliance_name': appliance.appliance_name or 'Unknown',
-                    'quantity': appliance.quantity or 1,
-                    'min_power_rating_watt': appliance.min_power_rating_watt or 0,
-                    'max_power_rating_watt': appliance.max_power_rating_watt or 0,
-                    'current_usage': current_usage,
-                    'status': status
-                })
-            
-            room_data.append({
-                'room_id': room.room_id,
-                'room_name': room.room_name or 'Unknown Room',
-                'total_power': total_power,
-                'appliances': appliance_data
-            })
-        
-        return jsonify(room_data)
+        # Get all rooms for current user with their appliances and latest readings
+        return jsonify(room_usage_payload(group_home_readings(await read_rows(home_readings_query(user_id)))))
     except Exception as e:
         print(f"Error getting room usage: {e}")
-        session.rollback()
         return jsonify([]), 500
-    finally:
-        session.close()
 
 @app.route('/api/room-wise-usage')
 @login_required
@@ -507,20 +788,39 @@ def get_room_wise_usage():
     """Alias for room-usage for frontend compatibility."""
     return get_room_usage()
 
+@app.route('/api/dashboard-bundle')
+@login_required
+@cached_response
+def get_dashboard_bundle():
+    """Everything the dashboard shows on load, from one home load and one alerts query"""
+    session = get_read_session()
+    try:
+        home = load_home_readings(session, current_user.user_id)
+        alerts = recent_alerts(session, current_user.user_id)
+        now = datetime.now()
+        return jsonify({
+            'dashboard_stats': dashboard_stats_payload(usage_totals(session, current_user.user_id), alerts),
+            'usage_history': usage_history_payload(session.execute(usage_history_query(current_user.user_id, now)).all(), now),
+            'room_usage': room_usage_payload(home),
+            'energy_readings': energy_readings_payload(home),
+            'alerts': [alert_json(alert) for alert in alerts]
+        })
+    except Exception as e:
+        print(f"Error getting dashboard bundle: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/room-usage/<int:room_id>')
 @login_required
 def get_room_by_id(room_id):
-    session = get_session()
-    try:
-        room = session.query(Room).filter_by(room_id=room_id, user_id=current_user.user_id).first()
-        if not room:
-            return jsonify({'error': 'Room not found'}), 404
-        return jsonify({'room_id': room.room_id, 'room_name': room.room_name})
-    finally:
-        session.close()
+    session = get_read_session()
+    room = session.query(Room).filter_by(room_id=room_id, user_id=current_user.user_id).first()
+    if not room:
+        return jsonify({'error': 'Room not found'}), 404
+    return jsonify({'room_id': room.room_id, 'room_name': room.room_name})
 
 @app.route('/api/edit-room/<int:room_id>', methods=['POST', 'PUT'])
 @login_required
+@invalidates_response_cache
 def edit_room(room_id):
     session = get_session()
     try:
@@ -537,32 +837,51 @@ def edit_room(room_id):
     except Exception as e:
         session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        session.close()
 
 @app.route('/api/appliance/<int:appliance_id>')
 @login_required
 def get_appliance_by_id(appliance_id):
-    session = get_session()
+    session = get_read_session()
+    app = session.query(Appliance).join(Room).filter(
+        Appliance.appliance_id == appliance_id,
+        Room.user_id == current_user.user_id
+    ).first()
+    if not app:
+        return jsonify({'error': 'Appliance not found'}), 404
+    return jsonify({
+        'appliance_id': app.appliance_id,
+        'appliance_name': app.appliance_name,
+        'quantity': app.quantity,
+        'min_power_rating_watt': app.min_power_rating_watt,
+        'max_power_rating_watt': app.max_power_rating_watt
+    })
+
+@app.route('/api/appliance/<int:appliance_id>/analytics')
+@login_required
+@cached_response
+def get_appliance_analytics(appliance_id):
+    session = get_read_session()
     try:
-        app = session.query(Appliance).join(Room).filter(
+        start = date_arg('start')
+        end = date_arg('end')
+    except ValueError:
+        return jsonify({'success': False, 'message': 'start and end must be ISO 8601 dates'}), 400
+    try:
+        owned = session.query(Appliance.appliance_id).join(Room).filter(
             Appliance.appliance_id == appliance_id,
             Room.user_id == current_user.user_id
         ).first()
-        if not app:
+        if not owned:
             return jsonify({'error': 'Appliance not found'}), 404
-        return jsonify({
-            'appliance_id': app.appliance_id,
-            'appliance_name': app.appliance_name,
-            'quantity': app.quantity,
-            'min_power_rating_watt': app.min_power_rating_watt,
-            'max_power_rating_watt': app.max_power_rating_watt
-        })
-    finally:
-        session.close()
+        return jsonify(appliance_analytics_payload(load_series(session, appliance_id), start, end))
+    except Exception as e:
+        session.rollback()
+        print(f"Error computing appliance analytics: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to compute appliance analytics'}), 500
 
 @app.route('/api/edit-appliance/<int:appliance_id>', methods=['POST', 'PUT'])
 @login_required
+@invalidates_response_cache
 def edit_appliance(appliance_id):
     session = get_session()
     try:
@@ -586,11 +905,10 @@ def edit_appliance(appliance_id):
     except Exception as e:
         session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        session.close()
 
 @app.route('/api/add-appliance', methods=['POST'])
 @login_required
+@invalidates_response_cache
 def add_appliance():
     session = get_session()
     try:
@@ -621,8 +939,6 @@ def add_appliance():
     except Exception as e:
         session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        remove_session()
 
 @app.route('/api/update-appliance', methods=['POST'])
 @login_required
@@ -632,44 +948,103 @@ def update_appliance_status():
 
 @app.route('/api/delete-room/<int:room_id>', methods=['DELETE'])
 @login_required
+@invalidates_response_cache
 def delete_room(room_id):
     session = get_session()
     try:
         room = session.query(Room).filter_by(room_id=room_id, user_id=current_user.user_id).first()
         if not room:
             return jsonify({'success': False, 'message': 'Room not found'}), 404
-        for appliance in room.appliances:
-            session.query(UsageLog).filter_by(appliance_id=appliance.appliance_id).delete()
-            session.delete(appliance)
-        session.delete(room)
-        session.commit()
-        return jsonify({'success': True, 'message': 'Room and associated items deleted'})
+        appliance_ids = [appliance_id for appliance_id, in session.query(Appliance.appliance_id).filter_by(room_id=room_id)]
+        return purge_appliances(session, appliance_ids, room_id, 'Room and associated items deleted')
     except Exception as e:
         session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        session.close()
 
 @app.route('/api/delete-appliance/<int:appliance_id>', methods=['DELETE'])
 @login_required
+@invalidates_response_cache
 def delete_appliance(appliance_id):
     session = get_session()
     try:
         appliance = session.query(Appliance).join(Room).filter(Appliance.appliance_id == appliance_id, Room.user_id == current_user.user_id).first()
         if not appliance:
             return jsonify({'success': False, 'message': 'Appliance not found'}), 404
-        session.query(UsageLog).filter_by(appliance_id=appliance_id).delete()
-        session.delete(appliance)
-        session.commit()
-        return jsonify({'success': True, 'message': 'Appliance and usage logs deleted'})
+        return purge_appliances(session, [appliance_id], None, 'Appliance and usage logs deleted')
     except Exception as e:
         session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        session.close()
+
+@app.route('/api/usage-logs')
+@login_required
+def get_usage_logs():
+    session = get_read_session()
+    try:
+        room_id = int(request.args['room_id']) if request.args.get('room_id') else None
+        appliance_id = int(request.args['appliance_id']) if request.args.get('appliance_id') else None
+        limit = min(max(int(request.args.get('limit', USAGE_LOG_PAGE_SIZE)), 1), MAX_USAGE_LOG_PAGE_SIZE)
+        start = date_arg('start')
+        end = date_arg('end')
+        after = decode_log_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'room_id, appliance_id and limit must be integers, start and end ISO 8601 dates, and cursor a value returned as next_cursor'}), 400
+    try:
+        appliances = session.query(Appliance.appliance_id, Appliance.appliance_name, Appliance.room_id)\
+            .join(Room)\
+            .filter(Room.user_id == current_user.user_id)
+        if room_id is not None:
+            appliances = appliances.filter(Appliance.room_id == room_id)
+        if appliance_id is not None:
+            appliances = appliances.filter(Appliance.appliance_id == appliance_id)
+        appliances = {appliance.appliance_id: appliance for appliance in appliances.all()}
+        if appliance_id is not None and not appliances:
+            return jsonify({'success': False, 'message': 'Appliance not found'}), 404
+
+        rows = usage_log_page(session, sorted(appliances), start, end, after, limit)
+        page = rows[:limit]
+        return jsonify({
+            'logs': [{
+                'log_id': row.log_id,
+                'appliance_id': row.appliance_id,
+                'appliance_name': appliances[row.appliance_id].appliance_name,
+                'room_id': appliances[row.appliance_id].room_id,
+                'timestamp': row.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+                'energy_consumed': row.energy_consumed,
+                'duration_hours': row.duration_hours
+            } for row in page],
+            'next_cursor': encode_log_cursor(page[-1].timestamp, page[-1].log_id) if len(rows) > limit else None
+        })
+    except Exception as e:
+        session.rollback()
+        print(f"Error listing usage logs: {str(e)}")
+        return jsonify({'success': False, 'message': 'Failed to list usage logs'}), 500
+
+@app.route('/api/export')
+@login_required
+def export_usage():
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400
+    try:
+        start = date_arg('start')
+        end = date_arg('end')
+    except ValueError:
+        return jsonify({'success': False, 'message': 'start and end must be ISO 8601 dates'}), 400
+
+    # The body is generated while the response is sent; stream_with_context
+    # keeps the request (and so the read session) open until it is done
+    compress = 'gzip' in request.accept_encodings
+    body = export_usage_logs(get_read_session(), current_user.user_id, export_format, start, end, compress)
+    response = Response(stream_with_context(body), mimetype=EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename=usage-{datetime.utcnow():%Y%m%d}.{export_format}'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 @app.route('/api/delete-usage-log/<int:log_id>', methods=['DELETE'])
 @login_required
+@invalidates_response_cache
 def delete_usage_log(log_id):
     session = get_session()
     try:
@@ -682,49 +1057,57 @@ def delete_usage_log(log_id):
     except Exception as e:
         session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        session.close()
+
+@app.route('/api/usage-logs/batch', methods=['POST'])
+@login_required
+@invalidates_response_cache
+def ingest_usage_logs():
+    """Bulk-load meter readings from a JSON array or a streamed NDJSON body"""
+    session = get_session()
+    try:
+        # Ownership is checked against this set instead of a query per reading
+        appliance_ids = {appliance_id for appliance_id, in user_appliance_ids(session, current_user.user_id)}
+        if request.mimetype in NDJSON_CONTENT_TYPES:
+            records = iter_ndjson(request.stream)
+        else:
+            payload = request.get_json(silent=True)
+            if not isinstance(payload, list):
+                return jsonify({'success': False, 'message': 'Expected a JSON array or NDJSON body'}), 400
+            records = enumerate(payload)
+        previous_log_ids = latest_log_ids(session, current_user.user_id)
+        previous_alert_id = latest_alert_id(session, current_user.user_id)
+        summary = ingest_readings(session, records, appliance_ids)
+        if summary['inserted']:
+            push_usage_delta(session, current_user.user_id, previous_log_ids)
+            push_new_alerts(session, current_user.user_id, previous_alert_id)
+        return jsonify({'success': True, **summary})
+    except Exception as e:
+        session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
 
 @app.route('/api/simulate-alerts', methods=['POST'])
 @login_required
+@invalidates_response_cache
 def simulate_alerts():
+    """Check this month's running total against the user's thresholds"""
     session = get_session()
     try:
-        end_time = datetime.utcnow()
-        start_time = end_time.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        total_usage = 0
-        user_rooms = session.query(Room).filter_by(user_id=current_user.user_id).all()
-        for room in user_rooms:
-            for appliance in room.appliances:
-                logs = session.query(UsageLog).filter(
-                    UsageLog.appliance_id == appliance.appliance_id,
-                    UsageLog.timestamp >= start_time,
-                    UsageLog.timestamp <= end_time
-                ).all()
-                total_usage += sum(log.energy_consumed or 0 for log in logs)
+        now = datetime.utcnow()
+        previous_alert_id = latest_alert_id(session, current_user.user_id)
         thresholds = session.query(ThresholdLevels).filter_by(user_id=current_user.user_id).first()
         if not thresholds:
-            thresholds = ThresholdLevels(user_id=current_user.user_id, warning_kwh=30, critical_kwh=35)
+            # Inserting thresholds evaluates them (threshold_levels trigger)
+            thresholds = ThresholdLevels(user_id=current_user.user_id, warning_kwh=DEFAULT_WARNING_KWH, critical_kwh=DEFAULT_CRITICAL_KWH)
             session.add(thresholds)
-            session.commit()
-        alerts = []
-        if total_usage >= thresholds.critical_kwh:
-            session.query(ThresholdAlerts).filter(
-                ThresholdAlerts.user_id == current_user.user_id,
-                ThresholdAlerts.level_id == 'Critical',
-                ThresholdAlerts.alert_date >= start_time
-            ).delete()
-            alerts.append(ThresholdAlerts(user_id=current_user.user_id, level_id='Critical', alert_date=end_time, current_kwh=total_usage))
-        elif total_usage >= thresholds.warning_kwh:
-            session.query(ThresholdAlerts).filter(
-                ThresholdAlerts.user_id == current_user.user_id,
-                ThresholdAlerts.level_id == 'Warning',
-                ThresholdAlerts.alert_date >= start_time
-            ).delete()
-            alerts.append(ThresholdAlerts(user_id=current_user.user_id, level_id='Warning', alert_date=end_time, current_kwh=total_usage))
-        if alerts:
-            session.add_all(alerts)
-            session.commit()
+        else:
+            # The triggers evaluate on every write already; this only matters
+            # for totals changed while they were paused
+            evaluate_thresholds(session.connection(), [current_user.user_id])
+        session.commit()
+        total_usage = session.query(UserMonthlyUsage.energy_consumed)\
+            .filter_by(user_id=current_user.user_id, period_start=datetime(now.year, now.month, 1))\
+            .scalar() or 0
+        alerts = push_new_alerts(session, current_user.user_id, previous_alert_id)
         return jsonify({
             'success': True,
             'message': f'Generated {len(alerts)} alerts',
@@ -737,11 +1120,10 @@ def simulate_alerts():
         session.rollback()
         print(f"Error simulating alerts: {str(e)}")
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        session.close()
 
 @app.route('/api/add-room', methods=['POST'])
 @login_required
+@invalidates_response_cache
 def add_room():
     session = get_session()
     try:
@@ -790,12 +1172,14 @@ def add_room():
 
 @app.route('/api/update-thresholds', methods=['POST'])
 @login_required
+@invalidates_response_cache
 def update_thresholds():
     session = get_session()
     try:
         data = request.get_json(silent=True) or request.form
         warning_kwh = float(data.get('warning_kwh', 30))
         critical_kwh = float(data.get('critical_kwh', 35))
+        previous_alert_id = latest_alert_id(session, current_user.user_id)
         thresholds = session.query(ThresholdLevels).filter_by(user_id=current_user.user_id).first()
         if not thresholds:
             thresholds = ThresholdLevels(user_id=current_user.user_id, warning_kwh=warning_kwh, critical_kwh=critical_kwh)
@@ -804,13 +1188,73 @@ def update_thresholds():
             thresholds.warning_kwh = warning_kwh
             thresholds.critical_kwh = critical_kwh
         session.commit()
+        push_new_alerts(session, current_user.user_id, previous_alert_id)
         return jsonify({'success': True, 'message': 'Thresholds updated'})
     except Exception as e:
         session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
-    finally:
-        session.close()
+
+@app.route('/admin/profiles/arm', methods=['POST'])
+@login_required
+@admin_required
+def arm_profiles():
+    """Profile a user's next requests to this worker, e.g. to see why their dashboard is slow"""
+    data = request.get_json(silent=True) or request.form
+    try:
+        user_id = int(data.get('user_id'))
+        requests = int(data.get('requests', 1))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'user_id and requests must be integers'}), 400
+    if requests < 1:
+        return jsonify({'success': False, 'message': 'requests must be at least 1'}), 400
+    profiler.arm(user_id, requests)
+    return jsonify({'success': True, 'message': f'Profiling the next {min(requests, profiler.PROFILE_MAX_ARMED)} requests of user {user_id}'})
+
+@app.route('/admin/profiles/<profile_id>')
+@login_required
+@admin_required
+def get_profile(profile_id):
+    """A stored request profile as JSON, or its folded stacks with ?format=collapsed"""
+    collapsed = request.args.get('format') == 'collapsed'
+    profile = profiler.load_profile(profile_id, collapsed)
+    if profile is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    if collapsed:
+        return Response(profile, mimetype='text/plain')
+    return jsonify(profile)
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint for this process: requests, SQL, connection pools and caches"""
+    pools = pool_status()
+    user_stats = user_cache.stats()
+    response_stats = response_cache.stats()
+    lines = []
+    for name, metric_type, help_text, samples in (
+        ('smart_home_db_pool_checkouts_total', 'counter', 'Connection checkouts.',
+         [({'pool': pool}, stats['checkouts']) for pool, stats in pools.items()]),
+        ('smart_home_db_pool_overflow_checkouts_total', 'counter', 'Checkouts beyond the pool size.',
+         [({'pool': pool}, stats['overflow_checkouts']) for pool, stats in pools.items()]),
+        ('smart_home_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection.',
+         [({'pool': pool}, stats['wait_ms'] / 1000) for pool, stats in pools.items()]),
+        ('smart_home_db_pool_checked_out', 'gauge', 'Connections currently checked out.',
+         [({'pool': pool}, stats['checked_out']) for pool, stats in pools.items()]),
+        ('smart_home_cache_hits_total', 'counter', 'Cache hits.',
+         [({'cache': 'user'}, user_stats['hits']), ({'cache': 'response'}, response_stats['hits'])]),
+        ('smart_home_cache_misses_total', 'counter', 'Cache misses.',
+         [({'cache': 'user'}, user_stats['misses']), ({'cache': 'response'}, response_stats['misses'])]),
+        ('smart_home_cache_evictions_total', 'counter', 'Cache evictions.',
+         [({'cache': 'user'}, user_stats['evictions']), ({'cache': 'response'}, response_stats['evictions'])]),
+        ('smart_home_cache_entries', 'gauge', 'Entries currently cached.',
+         [({'cache': 'user'}, user_stats['size']), ({'cache': 'response'}, response_stats['entries'])]),
+        ('smart_home_response_cache_not_modified_total', 'counter', 'Polls answered 304 from a matching ETag.',
+         [({}, response_stats['not_modified'])]),
+        ('smart_home_response_cache_bytes', 'gauge', 'Bytes of cached response bodies.',
+         [({}, response_stats['bytes'])]),
+    ):
+        lines.extend(metric_lines(name, metric_type, help_text, samples))
+    return Response(request_metrics.render(lines), content_type=METRICS_CONTENT_TYPE)
 
 if __name__ == '__main__':
     initialize_database()
-    app.run(debug=True)
+    socketio.run(app, debug=True)
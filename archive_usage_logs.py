@@ -0,0 +1,27 @@
+import argparse
+import sys
+from database import DB_PATH, create_sqlite_engine
+from models import Base
+from retention import RETENTION_RAW_DAYS, RETENTION_HOURLY_DAYS, ARCHIVE_DIR, apply_retention
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Move old usage logs to per-user monthly archive files and trim the hourly rollups')
+    parser.add_argument('--db', default=DB_PATH, help='SQLite database path')
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR, help='directory for the .npz archive files')
+    parser.add_argument('--raw-days', type=int, default=RETENTION_RAW_DAYS, help='days of raw usage logs to keep')
+    parser.add_argument('--hourly-days', type=int, default=RETENTION_HOURLY_DAYS, help='days of hourly rollups to keep')
+    args = parser.parse_args()
+
+    engine = create_sqlite_engine(1, 0, db_path=args.db)
+    try:
+        # create_all only adds missing tables, such as the archive watermark
+        Base.metadata.create_all(engine)
+        stats = apply_retention(engine, raw_days=args.raw_days, hourly_days=args.hourly_days,
+                                archive_dir=args.archive_dir)
+        print(f"Archived {stats['archived_rows']} rows from {stats['months']} user-months "
+              f"in {stats['seconds']:.2f}s")
+    except Exception as e:
+        print(f"Error applying retention: {e}")
+        sys.exit(1)
+    finally:
+        engine.dispose()
@@ -0,0 +1,358 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(PROJECT_DIR, 'benchmark_results')
+
+# users x rooms per user x appliances per room x usage logs per appliance
+DEFAULT_SIZES = ('1x3x5x100', '5x10x50x100')
+DEFAULT_ITERATIONS = 20
+# A p95 or query count this many times the baseline's is reported as a regression
+DEFAULT_REGRESSION_RATIO = 1.2
+
+BENCHMARK_PASSWORD = 'benchmark'
+INGEST_BATCH_SIZE = 100
+
+def parse_size(spec):
+    """'UxRxAxL' -> dict of users, rooms, appliances (per room) and logs (per appliance)"""
+    try:
+        users, rooms, appliances, logs = (int(part) for part in spec.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'size must look like USERSxROOMSxAPPLIANCESxLOGS, got {spec!r}')
+    if min(users, rooms, appliances) < 1 or logs < 0:
+        raise argparse.ArgumentTypeError(f'size {spec!r} needs at least one user, room and appliance')
+    return {'label': spec, 'users': users, 'rooms': rooms, 'appliances': appliances, 'logs': logs}
+
+def build_database(size, seed=0):
+    """Fill the (empty) benchmark database with size['users'] identical synthetic homes.
+
+    Logs are hourly readings ending at the current hour, loaded through
+    bulk_load_usage_logs() so the rollups and totals are built the same way
+    as for simulated data.
+    """
+    from database import engine, get_session
+    from models import Base
+    from ingest import bulk_load_usage_logs
+    from simulator import format_timestamps
+    from werkzeug.security import generate_password_hash
+
+    Base.metadata.create_all(engine)
+    password = generate_password_hash(BENCHMARK_PASSWORD)
+    rng = np.random.default_rng(seed)
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    since = now - timedelta(hours=size['logs'])
+    hours = np.datetime64(now, 'us') - np.arange(size['logs'])[::-1].astype('timedelta64[h]')
+    timestamps = format_timestamps(hours).tolist()
+
+    session = get_session()
+    try:
+        connection = session.connection()
+        for user_id in range(1, size['users'] + 1):
+            connection.exec_driver_sql("""
+                INSERT INTO users (user_id, first_name, last_name, email, password, security_question, security_answer)
+                VALUES (?, 'Bench', 'User', ?, ?, 'q', ?)
+            """, (user_id, f'bench{user_id}@example.com', password, password))
+            room_ids = []
+            for room in range(size['rooms']):
+                room_ids.append(connection.exec_driver_sql(
+                    'INSERT INTO rooms (user_id, room_name) VALUES (?, ?)', (user_id, f'Room {room + 1}')).lastrowid)
+            appliance_ids = []
+            for room_id in room_ids:
+                for appliance in range(size['appliances']):
+                    appliance_ids.append(connection.exec_driver_sql("""
+                        INSERT INTO appliances (room_id, appliance_name, min_power_rating_watt, max_power_rating_watt, quantity)
+                        VALUES (?, ?, 100, 2000, 1)
+                    """, (room_id, f'Appliance {appliance + 1}')).lastrowid)
+            if size['logs']:
+                energy = rng.uniform(0.05, 2.0, (len(appliance_ids), size['logs'])).round(4)
+                rows = [(appliance_id, timestamp, float(kwh), 1.0)
+                        for appliance_id, readings in zip(appliance_ids, energy.tolist())
+                        for timestamp, kwh in zip(timestamps, readings)]
+                bulk_load_usage_logs(session, rows, appliance_ids, since)
+                connection = session.connection()
+        session.commit()
+    finally:
+        session.close()
+
+def endpoint_cases(ids):
+    """(name, method, path, request kwargs, setup) for every /api/* route.
+
+    Reads come first so the writes' changes do not skew them. `setup`, if
+    given, runs untimed before each request and returns the path (and so
+    fresh ids for the deletes). Writes are made repeatable: names cycle,
+    readings get new timestamps and the deleted rows are created by setup.
+    """
+    room_id, appliance_id = ids['room_id'], ids['appliance_id']
+    counter = itertools.count()
+
+    def batch_readings():
+        step = next(counter)
+        start = ids['future'] + timedelta(hours=step * INGEST_BATCH_SIZE)
+        return {'json': [{'appliance_id': appliance_id, 'timestamp': (start + timedelta(hours=i)).isoformat(),
+                          'energy_consumed': 0.5, 'duration_hours': 1} for i in range(INGEST_BATCH_SIZE)]}
+
+    return [
+        ('usage-data', 'GET', '/api/usage-data', {}, None),
+        ('dashboard-stats', 'GET', '/api/dashboard-stats', {}, None),
+        ('alerts', 'GET', '/api/alerts', {}, None),
+        ('energy-readings', 'GET', '/api/energy-readings', {}, None),
+        ('usage-history', 'GET', '/api/usage-history', {}, None),
+        ('rooms', 'GET', '/api/rooms', {}, None),
+        ('room-usage', 'GET', '/api/room-usage', {}, None),
+        ('room-wise-usage', 'GET', '/api/room-wise-usage', {}, None),
+        ('dashboard-bundle', 'GET', '/api/dashboard-bundle', {}, None),
+        ('room-usage/<id>', 'GET', f'/api/room-usage/{room_id}', {}, None),
+        ('appliance/<id>', 'GET', f'/api/appliance/{appliance_id}', {}, None),
+        ('appliance/<id>/analytics', 'GET', f'/api/appliance/{appliance_id}/analytics', {}, None),
+        ('usage-logs', 'GET', '/api/usage-logs', {}, None),
+        ('usage-logs?room_id', 'GET', f'/api/usage-logs?room_id={room_id}', {}, None),
+        ('export csv', 'GET', '/api/export?format=csv', {}, None),
+        ('export ndjson gzip', 'GET', '/api/export?format=ndjson', {'headers': {'Accept-Encoding': 'gzip'}}, None),
+        ('edit-room/<id>', 'PUT', f'/api/edit-room/{room_id}',
+         lambda: {'json': {'room_name': f'Room 1 ({next(counter) % 2})'}}, None),
+        ('edit-appliance/<id>', 'PUT', f'/api/edit-appliance/{appliance_id}',
+         lambda: {'json': {'quantity': next(counter) % 2 + 1}}, None),
+        ('update-appliance', 'POST', '/api/update-appliance', {}, None),
+        ('update-thresholds', 'POST', '/api/update-thresholds', {'json': {'warning_kwh': 30, 'critical_kwh': 35}}, None),
+        ('simulate-alerts', 'POST', '/api/simulate-alerts', {}, None),
+        ('add-room', 'POST', '/api/add-room', lambda: {'data': {'room_name': f'Bench room {next(counter)}'}}, None),
+        ('add-appliance', 'POST', '/api/add-appliance',
+         {'data': {'appliance_name': 'Bench appliance', 'room_id': room_id, 'max_power_rating_watt': 1000}}, None),
+        ('usage-logs/batch', 'POST', '/api/usage-logs/batch', batch_readings, None),
+        ('simulate-data', 'POST', '/api/simulate-data', {'json': {'days': 1, 'seed': 1}}, None),
+        ('delete-usage-log/<id>', 'DELETE', None, {}, ids['new_usage_log']),
+        ('delete-appliance/<id>', 'DELETE', None, {}, ids['new_appliance']),
+        ('delete-room/<id>', 'DELETE', None, {}, ids['new_room']),
+    ]
+
+def percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+def run_size(size, scratch, iterations, warm_cache, seed):
+    """Build a synthetic database of one size in `scratch` and benchmark every endpoint on it.
+
+    Runs in its own process: database.py opens DATABASE_PATH when first
+    imported, so the environment has to point at the scratch files before
+    anything from the app is imported.
+    """
+    os.environ['DATABASE_PATH'] = os.path.join(scratch, 'bench.db')
+    os.environ['ARCHIVE_DIR'] = os.path.join(scratch, 'archives')
+    os.environ['COLUMNAR_STORE_DIR'] = os.path.join(scratch, 'columnar_store')
+    sys.path.insert(0, PROJECT_DIR)
+
+    started = time.perf_counter()
+    build_database(size, seed)
+    build_seconds = time.perf_counter() - started
+
+    from sqlalchemy import event
+    from database import engine, read_engine, async_read_engine
+    from app import app
+    from response_cache import response_cache
+    import query_debug
+
+    queries = [0]
+
+    def count_query(*args):
+        queries[0] += 1
+
+    for counted_engine in (engine, read_engine, async_read_engine.sync_engine):
+        event.listen(counted_engine, 'before_cursor_execute', count_query)
+
+    def new_room():
+        with engine.begin() as connection:
+            room_id = connection.exec_driver_sql(
+                "INSERT INTO rooms (user_id, room_name) VALUES (1, 'Doomed room')").lastrowid
+            connection.exec_driver_sql("""
+                INSERT INTO appliances (room_id, appliance_name, max_power_rating_watt, quantity)
+                VALUES (?, 'Doomed appliance', 1000, 1)
+            """, (room_id,))
+        return f'/api/delete-room/{room_id}'
+
+    def new_appliance():
+        with engine.begin() as connection:
+            appliance_id = connection.exec_driver_sql("""
+                INSERT INTO appliances (room_id, appliance_name, max_power_rating_watt, quantity)
+                VALUES (?, 'Doomed appliance', 1000, 1)
+            """, (ids['room_id'],)).lastrowid
+        return f'/api/delete-appliance/{appliance_id}'
+
+    doomed_logs = itertools.count(1)
+
+    def new_usage_log():
+        with engine.begin() as connection:
+            log_id = connection.exec_driver_sql("""
+                INSERT INTO usage_logs (appliance_id, energy_consumed, duration_hours, timestamp)
+                VALUES (?, 0.5, 1, ?)
+            """, (ids['appliance_id'], (ids['future'] - timedelta(minutes=next(doomed_logs))).isoformat(sep=' '))).lastrowid
+        return f'/api/delete-usage-log/{log_id}'
+
+    with engine.connect() as connection:
+        room_id = connection.exec_driver_sql('SELECT MIN(room_id) FROM rooms WHERE user_id = 1').scalar()
+        appliance_id = connection.exec_driver_sql('SELECT MIN(appliance_id) FROM appliances WHERE room_id = ?', (room_id,)).scalar()
+    ids = {
+        'room_id': room_id,
+        'appliance_id': appliance_id,
+        # Batch ingests and doomed logs go past every generated reading
+        'future': datetime.utcnow().replace(minute=0, second=0, microsecond=0) + timedelta(days=1),
+        'new_room': new_room,
+        'new_appliance': new_appliance,
+        'new_usage_log': new_usage_log,
+    }
+
+    app.config['TESTING'] = True
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['_user_id'] = '1'
+        flask_session['_fresh'] = True
+
+    urls = app.url_map.bind('localhost')
+    covered = set()
+    endpoints = {}
+    for name, method, path, kwargs, setup in endpoint_cases(ids):
+        samples = []
+
+        def call():
+            request_path = setup() if setup else path
+            request_kwargs = kwargs() if callable(kwargs) else kwargs
+            if not warm_cache:
+                response_cache.invalidate_user(1)
+            queries[0] = 0
+            started = time.perf_counter()
+            response = client.open(request_path, method=method, **request_kwargs)
+            # Streamed bodies are generated while they are read
+            body = response.get_data()
+            elapsed = time.perf_counter() - started
+            response.close()
+            covered.add(urls.match(request_path.split('?')[0], method=method)[0])
+            return response.status_code, len(body), elapsed
+
+        status, body_bytes, _ = call()  # warm-up
+        for _ in range(iterations):
+            status, body_bytes, elapsed = call()
+            samples.append(elapsed)
+        query_count = queries[0]
+
+        # A separate, untimed-for-latency run, as tracing slows every allocation
+        tracemalloc.start()
+        call()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        endpoints[name] = {
+            'method': method,
+            'status': status,
+            'response_bytes': body_bytes,
+            'p50_ms': percentile_ms(samples, 50),
+            'p95_ms': percentile_ms(samples, 95),
+            'p99_ms': percentile_ms(samples, 99),
+            'mean_ms': round(float(np.mean(samples)) * 1000, 3),
+            'queries': query_count,
+            'peak_kib': round(peak / 1024, 1),
+        }
+    for rule in app.url_map.iter_rules():
+        if rule.rule.startswith('/api/') and rule.endpoint not in covered:
+            print(f"  warning: {rule.rule} has no benchmark case")
+    # Only filled in when the app runs with QUERY_DEBUG set
+    n_plus_one = {(v['method'], v['path'], v['statement']): v for v in query_debug.violations}
+    return {'size': size, 'build_seconds': round(build_seconds, 2), 'endpoints': endpoints,
+            'n_plus_one': list(n_plus_one.values())}
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PROJECT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(result):
+    print(f"\n{result['size']['label']} (built in {result['build_seconds']}s)")
+    print(f"  {'endpoint':<28} {'status':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'peak KiB':>9}")
+    for name, stats in result['endpoints'].items():
+        print(f"  {name:<28} {stats['status']:>6} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} "
+              f"{stats['p99_ms']:>9.2f} {stats['queries']:>8} {stats['peak_kib']:>9.1f}")
+
+def compare(report, baseline, ratio):
+    """Print endpoints whose p95 or query count grew by more than `ratio` against the baseline; return how many"""
+    previous = {(run['size']['label'], name): stats
+                for run in baseline['results'] for name, stats in run['endpoints'].items()}
+    regressions = 0
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    for run in report['results']:
+        for name, stats in run['endpoints'].items():
+            old = previous.get((run['size']['label'], name))
+            if old is None:
+                continue
+            for metric in ('p95_ms', 'queries'):
+                if stats[metric] > old[metric] * ratio and stats[metric] - old[metric] >= 1:
+                    regressions += 1
+                    print(f"  REGRESSION {run['size']['label']} {name}: {metric} {old[metric]} -> {stats[metric]}")
+    if not regressions:
+        print("  no regressions")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every /api/* endpoint over synthetic homes')
+    parser.add_argument('--size', dest='sizes', action='append', type=parse_size,
+                        help=f"USERSxROOMSxAPPLIANCESxLOGS, repeatable (default: {' '.join(DEFAULT_SIZES)})")
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS, help='timed requests per endpoint')
+    parser.add_argument('--warm-cache', action='store_true', help='keep the response cache between requests')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='results file (default: benchmark_results/<commit>.json)')
+    parser.add_argument('--compare', metavar='BASELINE', help='results file to check for regressions against')
+    parser.add_argument('--ratio', type=float, default=DEFAULT_REGRESSION_RATIO,
+                        help='how many times the baseline p95/query count counts as a regression')
+    args = parser.parse_args()
+    sizes = args.sizes or [parse_size(spec) for spec in DEFAULT_SIZES]
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'iterations': args.iterations,
+        'warm_cache': args.warm_cache,
+        'results': [],
+    }
+    for size in sizes:
+        print(f"Benchmarking {size['label']} ...", flush=True)
+        # A fresh process per size, so each gets its own database and module state
+        with tempfile.TemporaryDirectory(prefix='smart-home-bench-') as scratch, \
+                ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            result = executor.submit(run_size, size, scratch, args.iterations, args.warm_cache, args.seed).result()
+        print_results(result)
+        report['results'].append(result)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{(commit or 'working-tree')[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    failed = False
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        failed = compare(report, baseline, args.ratio) > 0
+    n_plus_one = [violation for result in report['results'] for violation in result.get('n_plus_one', [])]
+    if n_plus_one:
+        print(f"\n{len(n_plus_one)} N+1 pattern(s) found by query_debug")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
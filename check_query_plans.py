@@ -0,0 +1,103 @@
+from datetime import datetime
+import sys
+from database import engine
+from models import Room, Appliance, UsageLog, ApplianceLatestReading, ThresholdLevels, ThresholdAlerts
+from models import UsageRollupDaily, UsageRollupMonthly, UserMonthlyUsage
+from sqlalchemy import func, case, and_, or_
+from sqlalchemy.orm import Query
+
+# Representative parameters; SQLite plans the query the same for any value
+SAMPLE_USER_ID = 1
+SAMPLE_ROOM_ID = 1
+SAMPLE_APPLIANCE_ID = 1
+
+def hot_queries():
+    """The read queries app.py issues on every dashboard refresh"""
+    now = datetime.utcnow()
+    today_start = datetime(now.year, now.month, now.day)
+    month_start = datetime(now.year, now.month, 1)
+    year_start = datetime(now.year, 1, 1)
+    user_appliances = Query(Appliance.appliance_id).join(Room).filter(Room.user_id == SAMPLE_USER_ID)
+    return {
+        'rooms for user': Query(Room).filter_by(user_id=SAMPLE_USER_ID),
+        'appliances for room': Query(Appliance).filter_by(room_id=SAMPLE_ROOM_ID),
+        'latest readings for user': Query([Room, Appliance, ApplianceLatestReading])
+            .outerjoin(Appliance, Appliance.room_id == Room.room_id)
+            .outerjoin(ApplianceLatestReading, ApplianceLatestReading.appliance_id == Appliance.appliance_id)
+            .filter(Room.user_id == SAMPLE_USER_ID),
+        # Also run by the appliance_latest_reading delete trigger
+        'latest log for appliance': Query(UsageLog)
+            .filter_by(appliance_id=SAMPLE_APPLIANCE_ID)
+            .order_by(UsageLog.timestamp.desc())
+            .limit(1),
+        # One of the per-appliance keyset seeks behind /api/usage-logs
+        'usage log page for appliance': Query(UsageLog)
+            .filter(
+                UsageLog.appliance_id == SAMPLE_APPLIANCE_ID,
+                UsageLog.timestamp.isnot(None),
+                UsageLog.timestamp <= now,
+                or_(UsageLog.timestamp < now, and_(UsageLog.timestamp == now, UsageLog.log_id < 1))
+            )
+            .order_by(UsageLog.timestamp.desc(), UsageLog.log_id.desc())
+            .limit(101),
+        'month total for user': Query(UserMonthlyUsage.energy_consumed)
+            .filter_by(user_id=SAMPLE_USER_ID, period_start=month_start),
+        # Also run by the threshold evaluation triggers
+        'thresholds for user': Query(ThresholdLevels).filter_by(user_id=SAMPLE_USER_ID),
+        'month rollups for user': Query([
+                func.sum(case((UsageRollupDaily.period_start >= today_start, UsageRollupDaily.energy_consumed), else_=0)),
+                func.sum(UsageRollupDaily.energy_consumed)
+            ])
+            .filter(
+                UsageRollupDaily.appliance_id.in_(user_appliances),
+                UsageRollupDaily.period_start >= month_start
+            ),
+        'recent alerts for user': Query(ThresholdAlerts)
+            .filter_by(user_id=SAMPLE_USER_ID)
+            .order_by(ThresholdAlerts.alert_date.desc())
+            .limit(10),
+        'year rollups for user': Query([UsageRollupMonthly.period_start, func.sum(UsageRollupMonthly.energy_consumed)])
+            .filter(
+                UsageRollupMonthly.appliance_id.in_(user_appliances),
+                UsageRollupMonthly.period_start >= year_start
+            )
+            .group_by(UsageRollupMonthly.period_start),
+    }
+
+def explain(connection, query):
+    """Return the EXPLAIN QUERY PLAN detail lines for an ORM query"""
+    compiled = query.statement.compile(dialect=engine.dialect)
+    params = []
+    for name in compiled.positiontup:
+        value = compiled.params[name]
+        if isinstance(value, datetime):
+            value = value.isoformat(' ')
+        params.append(value)
+    rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled.string}', tuple(params)).fetchall()
+    return [row[-1] for row in rows]
+
+def is_scan(detail):
+    """A full table or full index scan, as opposed to an index SEARCH"""
+    return detail.startswith('SCAN ') and not detail.startswith('SCAN CONSTANT ROW')
+
+def check_query_plans():
+    failures = 0
+    with engine.connect() as connection:
+        for name, query in hot_queries().items():
+            plan = explain(connection, query)
+            scans = [detail for detail in plan if is_scan(detail)]
+            status = 'FAIL' if scans else 'ok'
+            print(f"[{status}] {name}")
+            for detail in plan:
+                print(f"    {detail}")
+            if scans:
+                failures += 1
+
+    if failures:
+        print(f"\n{failures} hot queries fall back to a scan")
+        return False
+    print("\nAll hot queries use an index")
+    return True
+
+if __name__ == '__main__':
+    sys.exit(0 if check_query_plans() else 1)
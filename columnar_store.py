@@ -0,0 +1,176 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import json
+import math
+import os
+import threading
+import numpy as np
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+from sqlalchemy import text
+from database import BASE_DIR
+from retention import ARCHIVE_DIR, iter_usage_logs
+
+# One directory per appliance holding two flat little-endian columns sorted
+# by timestamp, plus meta.json, which is written last and says how many rows
+# of the columns are valid
+STORE_DIR = os.environ.get('COLUMNAR_STORE_DIR') or os.path.join(BASE_DIR, 'columnar_store')
+
+TIMESTAMP_DTYPE = np.dtype('<i8')  # epoch microseconds, UTC
+ENERGY_DTYPE = np.dtype('<f4')  # kWh
+COLUMNS = (('timestamps.i8', TIMESTAMP_DTYPE), ('energy.f4', ENERGY_DTYPE))
+
+EPOCH = datetime(1970, 1, 1)
+EMPTY_META = {'rows': 0, 'synced_log_id': 0, 'last_timestamp': None, 'source_rows': 0, 'source_energy': 0.0}
+
+# Without fcntl, only the threads of one process are kept apart
+_sync_lock = threading.Lock()
+
+def to_epoch_us(moment):
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+class ApplianceSeries:
+    """Read-only memory-mapped readings of one appliance, oldest first"""
+    __slots__ = ('appliance_id', 'timestamps', 'energy')
+
+    def __init__(self, appliance_id, timestamps, energy):
+        self.appliance_id = appliance_id
+        self.timestamps = timestamps
+        self.energy = energy
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def between(self, start=None, end=None):
+        """(timestamps, energy) views of the readings with start <= timestamp < end; nothing is copied"""
+        lo = 0 if start is None else int(np.searchsorted(self.timestamps, to_epoch_us(start)))
+        hi = len(self) if end is None else int(np.searchsorted(self.timestamps, to_epoch_us(end)))
+        return self.timestamps[lo:hi], self.energy[lo:hi]
+
+def appliance_dir(appliance_id, store_dir=STORE_DIR):
+    return os.path.join(store_dir, str(appliance_id))
+
+@contextmanager
+def appliance_lock(directory):
+    """Hold an exclusive flock on an appliance's directory, across worker processes.
+
+    Syncs append to and replace the column files, so one process at a time
+    syncs an appliance and maps its columns; a mapping stays valid afterwards,
+    as appends only add rows past it and rewrites replace the files.
+    """
+    if fcntl is None:
+        with _sync_lock:
+            yield
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+def read_meta(directory):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict(EMPTY_META)
+
+def write_meta(directory, meta):
+    path = os.path.join(directory, 'meta.json')
+    with open(path + '.partial', 'w') as f:
+        json.dump(meta, f)
+    os.replace(path + '.partial', path)
+
+def source_checksum(connection, appliance_id):
+    """Reading count and kWh of an appliance per its monthly rollups, which also cover archived logs"""
+    rows, energy = connection.execute(text("""
+        SELECT COALESCE(SUM(reading_count), 0), COALESCE(SUM(energy_consumed), 0)
+        FROM usage_rollup_monthly WHERE appliance_id = :appliance_id
+    """), {'appliance_id': appliance_id}).one()
+    return rows, energy
+
+def append_columns(directory, meta, timestamps, energy):
+    """Append readings after the meta's valid rows, dropping anything a failed append left behind"""
+    for (name, dtype), values in zip(COLUMNS, (timestamps, energy)):
+        with open(os.path.join(directory, name), 'ab') as f:
+            f.truncate(meta['rows'] * dtype.itemsize)
+            f.write(values.astype(dtype).tobytes())
+
+def rewrite_columns(directory, timestamps, energy):
+    for (name, dtype), values in zip(COLUMNS, (timestamps, energy)):
+        path = os.path.join(directory, name)
+        with open(path + '.partial', 'wb') as f:
+            f.write(values.astype(dtype).tobytes())
+        os.replace(path + '.partial', path)
+
+def sync_appliance(connection, appliance_id, store_dir=STORE_DIR, archive_dir=ARCHIVE_DIR):
+    """Bring an appliance's columns up to date with its usage logs and return its meta.
+
+    The store is in sync while the appliance's rollup count and kWh match the
+    ones recorded at the last sync. New logs that only extend the series are
+    appended; anything else (deletes, edits, backfilled readings) rewrites the
+    appliance's columns from the archives and usage_logs.
+    """
+    directory = appliance_dir(appliance_id, store_dir)
+    meta = read_meta(directory)
+    source_rows, source_energy = source_checksum(connection, appliance_id)
+    if source_rows == meta['source_rows'] and math.isclose(source_energy, meta['source_energy'], abs_tol=1e-6):
+        return meta
+
+    new = connection.execute(text("""
+        SELECT log_id, timestamp, energy_consumed FROM usage_logs
+        WHERE appliance_id = :appliance_id AND log_id > :synced_log_id AND timestamp IS NOT NULL
+        ORDER BY timestamp, log_id
+    """), {'appliance_id': appliance_id, 'synced_log_id': meta['synced_log_id']}).fetchall()
+    if new:
+        log_ids, timestamps, energy = zip(*new)
+        timestamps = np.array(timestamps, dtype='datetime64[us]').astype(TIMESTAMP_DTYPE)
+        energy = np.array(energy, dtype=np.float64)
+    extends = (
+        new and source_rows == meta['source_rows'] + len(new)
+        and math.isclose(source_energy, meta['source_energy'] + energy.sum(), abs_tol=1e-6)
+        and (meta['last_timestamp'] is None or timestamps[0] >= meta['last_timestamp'])
+    )
+    if extends:
+        append_columns(directory, meta, timestamps, energy)
+        rows, synced_log_id = meta['rows'] + len(new), max(meta['synced_log_id'], max(log_ids))
+    else:
+        user_id = connection.execute(text("""
+            SELECT r.user_id FROM appliances a JOIN rooms r ON r.room_id = a.room_id WHERE a.appliance_id = :appliance_id
+        """), {'appliance_id': appliance_id}).scalar()
+        history = list(iter_usage_logs(connection, user_id, archive_dir=archive_dir, appliance_ids=[appliance_id])) \
+            if user_id is not None else []
+        log_ids = np.array([row[0] for row in history], dtype=np.int64)
+        timestamps = np.array([row[2] for row in history], dtype='datetime64[us]').astype(TIMESTAMP_DTYPE)
+        energy = np.array([row[3] for row in history], dtype=np.float64)
+        order = np.lexsort((log_ids, timestamps))
+        timestamps, energy = timestamps[order], energy[order]
+        rewrite_columns(directory, timestamps, energy)
+        rows, synced_log_id = len(history), int(log_ids.max()) if len(history) else 0
+
+    meta = {
+        'rows': rows,
+        'synced_log_id': synced_log_id,
+        'last_timestamp': int(timestamps[-1]) if len(timestamps) else None,
+        'source_rows': source_rows,
+        'source_energy': source_energy,
+    }
+    write_meta(directory, meta)
+    return meta
+
+def load_series(connection, appliance_id, store_dir=STORE_DIR, archive_dir=ARCHIVE_DIR):
+    """Sync an appliance's columns, then memory-map them as an ApplianceSeries"""
+    directory = appliance_dir(appliance_id, store_dir)
+    os.makedirs(directory, exist_ok=True)
+    with appliance_lock(directory):
+        meta = sync_appliance(connection, appliance_id, store_dir, archive_dir)
+        columns = [
+            np.memmap(os.path.join(directory, name), dtype=dtype, mode='r', shape=(meta['rows'],))
+            if meta['rows'] else np.empty(0, dtype=dtype)
+            for name, dtype in COLUMNS
+        ]
+    return ApplianceSeries(appliance_id, *columns)
@@ -1,34 +1,231 @@
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from dotenv import load_dotenv
+import asyncio
+import concurrent.futures
+import contextvars
 import os
+import threading
+import time
 
 # Get the absolute path of the current directory
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-DB_PATH = os.path.join(BASE_DIR, 'smart_home.db')
+load_dotenv(os.path.join(BASE_DIR, '.env'))
 
-# Create engine with proper configuration
-engine = create_engine(
-    f'sqlite:///{DB_PATH}',
-    connect_args={'check_same_thread': False},
-    pool_pre_ping=True,
-    echo=False
-)
+def env_int(name, default):
+    return int(os.environ.get(name, default))
 
-# Create session factory
+DB_PATH = os.environ.get('DATABASE_PATH') or os.path.join(BASE_DIR, 'smart_home.db')
+
+# Applied to every new connection. WAL lets the dashboard's readers run while
+# a write is in progress, busy_timeout makes a blocked writer wait instead of
+# failing with "database is locked", and NORMAL sync is durable under WAL
+# except for the last commits on power loss.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': env_int('SQLITE_BUSY_TIMEOUT_MS', 5000),
+    'mmap_size': env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+    'cache_size': env_int('SQLITE_CACHE_SIZE', -64 * 1024),  # negative means KiB
+    'foreign_keys': 'ON',
+}
+
+# SQLite allows one writer at a time, so the writer pool defaults to a single
+# connection and queues writers in-process; readers get their own pool
+WRITE_POOL_SIZE = env_int('DB_WRITE_POOL_SIZE', 1)
+WRITE_MAX_OVERFLOW = env_int('DB_WRITE_MAX_OVERFLOW', 0)
+READ_POOL_SIZE = env_int('DB_READ_POOL_SIZE', 8)
+READ_MAX_OVERFLOW = env_int('DB_READ_MAX_OVERFLOW', 8)
+POOL_TIMEOUT = env_int('DB_POOL_TIMEOUT', 30)
+
+class PoolStats:
+    """Connection checkouts, overflow checkouts and seconds spent waiting for a connection"""
+    __slots__ = ('checkouts', 'overflow_checkouts', 'wait_seconds')
+
+    def __init__(self):
+        self.checkouts = 0
+        self.overflow_checkouts = 0
+        self.wait_seconds = 0.0
+
+    def record(self, overflow, wait_seconds):
+        self.checkouts += 1
+        self.overflow_checkouts += overflow
+        self.wait_seconds += wait_seconds
+
+    def as_dict(self):
+        return {
+            'checkouts': self.checkouts,
+            'overflow_checkouts': self.overflow_checkouts,
+            'wait_ms': round(self.wait_seconds * 1000, 3),
+        }
+
+# Stats of the current request, if any. A context variable rather than a
+# thread-local, so checkouts an async view makes on the async loop's thread
+# still count against its request.
+_request_stats = contextvars.ContextVar('request_pool_stats', default=None)
+
+def begin_request_pool_stats():
+    """Start counting checkouts made by the current request"""
+    _request_stats.set(PoolStats())
+
+def end_request_pool_stats():
+    """Stop counting for the current request and return what was counted"""
+    stats = _request_stats.get()
+    _request_stats.set(None)
+    return stats
+
+class PoolInstrumentation:
+    """Pool mixin that counts checkouts, overflow use and time spent waiting for a connection.
+
+    The wait includes opening a new connection when the pool has none idle.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.totals = PoolStats()
+        self._totals_lock = threading.Lock()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        connection = super()._do_get()
+        waited = time.perf_counter() - started
+        overflow = self.checkedout() > self.size()
+        with self._totals_lock:
+            self.totals.record(overflow, waited)
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.record(overflow, waited)
+        return connection
+
+class InstrumentedQueuePool(PoolInstrumentation, QueuePool):
+    pass
+
+class InstrumentedAsyncQueuePool(PoolInstrumentation, AsyncAdaptedQueuePool):
+    pass
+
+def create_sqlite_engine(pool_size, max_overflow, read_only=False, db_path=None):
+    """Create a pooled engine whose connections get SQLITE_PRAGMAS"""
+    new_engine = create_engine(
+        f'sqlite:///{db_path or DB_PATH}',
+        connect_args={'check_same_thread': False},
+        poolclass=InstrumentedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=POOL_TIMEOUT,
+        pool_pre_ping=True,
+        echo=False
+    )
+
+    @event.listens_for(new_engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma}={value}')
+        if read_only:
+            cursor.execute('PRAGMA query_only=ON')
+        cursor.close()
+
+    return new_engine
+
+def create_async_read_engine(db_path=None):
+    """Read-only aiosqlite engine for the async dashboard views.
+
+    An aiosqlite connection cannot move between event loops, so the pool is
+    only ever used from the one loop run_async() runs coroutines on.
+    """
+    new_engine = create_async_engine(
+        f'sqlite+aiosqlite:///{db_path or DB_PATH}',
+        poolclass=InstrumentedAsyncQueuePool,
+        pool_size=READ_POOL_SIZE,
+        max_overflow=READ_MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+    )
+
+    @event.listens_for(new_engine.sync_engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma}={value}')
+        cursor.execute('PRAGMA query_only=ON')
+        cursor.close()
+
+    return new_engine
+
+# Writer engine; also used for DDL and scripts
+engine = create_sqlite_engine(WRITE_POOL_SIZE, WRITE_MAX_OVERFLOW)
+read_engine = create_sqlite_engine(READ_POOL_SIZE, READ_MAX_OVERFLOW, read_only=True)
+async_read_engine = create_async_read_engine()
+
+# Create session factories; the scoped sessions give each thread (and so each
+# Flask request) one session per engine until remove_session() is called
 session_factory = sessionmaker(bind=engine)
+read_session_factory = sessionmaker(bind=read_engine)
 Session = scoped_session(session_factory)
+ReadSession = scoped_session(read_session_factory)
+# Not scoped: an async view opens one per query it runs, so they can be gathered
+AsyncReadSession = sessionmaker(bind=async_read_engine, class_=AsyncSession, expire_on_commit=False)
+
+# Event loop for every coroutine that touches async_read_engine, on a daemon
+# thread started on first use (so after a pre-forking server has forked)
+_async_loop = None
+_async_loop_lock = threading.Lock()
+
+def async_loop():
+    global _async_loop
+    with _async_loop_lock:
+        if _async_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='async-read-loop', daemon=True).start()
+            _async_loop = loop
+        return _async_loop
+
+def _copy_outcome(task, future):
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
+
+def run_async(coroutine):
+    """Run `coroutine` on the shared async loop, in a copy of the caller's context, and wait for its result"""
+    loop = async_loop()
+    future = concurrent.futures.Future()
+
+    def start():
+        loop.create_task(coroutine).add_done_callback(lambda task: _copy_outcome(task, future))
+
+    # The task inherits the context start() runs in: the request's, so
+    # Flask's request globals and the per-request instrumentation still work
+    loop.call_soon_threadsafe(start, context=contextvars.copy_context())
+    return future.result()
 
 def get_session():
-    """Get a new database session"""
-    return session_factory()
+    """Get the current thread's database session on the writer engine"""
+    return Session()
 
-def remove_session():
-    """Remove the session"""
-    session = get_session()
-    if session:
-        session.close()
+def get_read_session():
+    """Get the current thread's read-only database session"""
+    return ReadSession()
 
+def remove_session():
+    """Close and discard the current thread's sessions, returning their connections"""
+    Session.remove()
+    ReadSession.remove()
 
+def pool_status():
+    """Lifetime checkout stats and current state of the connection pools"""
+    status = {}
+    for name, pool_engine in (('write', engine), ('read', read_engine), ('async_read', async_read_engine)):
+        pool = pool_engine.pool
+        status[name] = dict(
+            pool.totals.as_dict(),
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            overflow=max(pool.overflow(), 0),
+        )
+    return status
 
 def initialize_database():
     """Initialize the database by creating all tables"""
@@ -0,0 +1,74 @@
+import csv
+import io
+import json
+import zlib
+from sqlalchemy import text
+from retention import iter_usage_logs
+
+# format -> mimetype
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+EXPORT_FIELDS = ('log_id', 'timestamp', 'room_name', 'appliance_id', 'appliance_name', 'energy_consumed', 'duration_hours')
+
+# Encoded rows are buffered up to this many bytes per chunk handed to the
+# WSGI server (and the compressor)
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+def iter_export_rows(connection, user_id, start=None, end=None):
+    """Yield an EXPORT_FIELDS tuple for each of the user's readings, archived ones included, oldest first"""
+    names = {appliance_id: (appliance_name, room_name) for appliance_id, appliance_name, room_name in connection.execute(text("""
+        SELECT a.appliance_id, a.appliance_name, r.room_name
+        FROM rooms r JOIN appliances a ON a.room_id = r.room_id
+        WHERE r.user_id = :user_id
+    """), {'user_id': user_id})}
+    for log_id, appliance_id, timestamp, energy_consumed, duration_hours in iter_usage_logs(connection, user_id, start, end):
+        appliance_name, room_name = names[appliance_id]
+        yield (log_id, timestamp.isoformat(sep=' '), room_name, appliance_id, appliance_name,
+               energy_consumed, duration_hours)
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    yield buffer.getvalue()
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(row)
+        yield buffer.getvalue()
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n'
+
+def chunked(lines, size=EXPORT_CHUNK_BYTES):
+    """Join encoded lines into chunks of about `size` bytes"""
+    parts, length = [], 0
+    for line in lines:
+        data = line.encode()
+        parts.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(parts)
+            parts, length = [], 0
+    if parts:
+        yield b''.join(parts)
+
+def gzip_chunks(chunks):
+    """Compress a byte stream into a gzip member chunk by chunk"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_usage_logs(connection, user_id, export_format, start=None, end=None, compress=False):
+    """Generate the body of a usage export without holding more than a chunk of it in memory"""
+    rows = iter_export_rows(connection, user_id, start, end)
+    lines = csv_lines(rows) if export_format == 'csv' else ndjson_lines(rows)
+    chunks = chunked(lines)
+    return gzip_chunks(chunks) if compress else chunks
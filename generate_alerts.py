@@ -1,22 +1,156 @@
-from models import db, User, Threshold_Levels
-from app import app
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+from sqlalchemy import event, text
+from database import DB_PATH, create_sqlite_engine
+from models import DEFAULT_WARNING_KWH, DEFAULT_CRITICAL_KWH
 
-def generate_alerts():
-    with app.app_context():
-        # Get yesterday's date
-        yesterday = datetime.date.today() - datetime.timedelta(days=1)
-        start_ts = datetime.datetime(yesterday.year, yesterday.month, yesterday.day, 0, 0, 0)
-        end_ts = datetime.datetime(yesterday.year, yesterday.month, yesterday.day, 23, 59, 59)
-        
-        # Get all users
-        users = User.query.all()
-        
+# Users per shard; each shard is one grouped query and one short write transaction
+SHARD_SIZE = 500
+
+LEVEL_RANK = {'Normal': 0, 'Warning': 1, 'Critical': 2}
+
+# Every user in the shard with their month total (from the monthly rollups),
+# thresholds and last recorded alert level, in one pass
+SHARD_TOTALS_SQL = '''
+    SELECT u.user_id,
+           COALESCE(SUM(m.energy_consumed), 0) AS total,
+           t.warning_kwh, t.critical_kwh,
+           s.level, s.period_start
+    FROM users u
+    LEFT JOIN rooms r ON r.user_id = u.user_id
+    LEFT JOIN appliances a ON a.room_id = r.room_id
+    LEFT JOIN usage_rollup_monthly m ON m.appliance_id = a.appliance_id AND m.period_start = :period_start
+    LEFT JOIN threshold_levels t ON t.level_id = (
+        SELECT MIN(level_id) FROM threshold_levels WHERE user_id = u.user_id
+    )
+    LEFT JOIN user_alert_state s ON s.user_id = u.user_id
+    WHERE u.user_id BETWEEN :first_user AND :last_user
+    GROUP BY u.user_id
+'''
+
+INSERT_ALERTS_SQL = '''
+    INSERT INTO threshold_alerts (user_id, level_id, alert_date, current_kwh)
+    VALUES (:user_id, :level, :alert_date, :total)
+'''
+
+UPSERT_STATE_SQL = '''
+    INSERT INTO user_alert_state (user_id, period_start, level, changed_at)
+    VALUES (:user_id, :period_start, :level, :alert_date)
+    ON CONFLICT (user_id) DO UPDATE SET
+        period_start = excluded.period_start,
+        level = excluded.level,
+        changed_at = excluded.changed_at
+'''
+
+# One engine per worker process, created after the fork
+worker_engine = None
+
+def init_worker(db_path):
+    global worker_engine
+    worker_engine = create_sqlite_engine(1, 0, db_path=db_path)
+
+    @event.listens_for(worker_engine, 'connect')
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        # pysqlite would only open the transaction at the first INSERT
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(worker_engine, 'begin')
+    def begin_immediate(connection):
+        # Take the write lock before a shard reads the alert states, so an
+        # ingest trigger cannot raise a level between that read and the writes
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+def level_for(total, warning_kwh, critical_kwh):
+    if total >= (critical_kwh if critical_kwh is not None else DEFAULT_CRITICAL_KWH):
+        return 'Critical'
+    if total >= (warning_kwh if warning_kwh is not None else DEFAULT_WARNING_KWH):
+        return 'Warning'
+    return 'Normal'
+
+def evaluate_shard(first_user, last_user, period_start):
+    """Evaluate one user-id range; return (users, alerts written, seconds)"""
+    started = time.perf_counter()
+    period_text = period_start.strftime('%Y-%m-%d %H:%M:%S.%f')
+    alert_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
+    with worker_engine.begin() as connection:
+        rows = connection.execute(text(SHARD_TOTALS_SQL), {
+            'period_start': period_text, 'first_user': first_user, 'last_user': last_user
+        }).fetchall()
+
+        alerts, states = [], []
+        for user_id, total, warning_kwh, critical_kwh, previous_level, previous_period in rows:
+            if previous_period is not None and previous_period > period_text:
+                # Re-running an older month must not rewind the live alert state
+                continue
+            level = level_for(total, warning_kwh, critical_kwh)
+            if previous_period != period_text:
+                previous_level = 'Normal'
+            if level == previous_level:
+                continue
+            change = {'user_id': user_id, 'level': level, 'total': total,
+                      'period_start': period_text, 'alert_date': alert_date}
+            states.append(change)
+            # Same edge-triggered rule as the database triggers: alert only when the level rises
+            if LEVEL_RANK[level] > LEVEL_RANK[previous_level or 'Normal']:
+                alerts.append(change)
+
+        if alerts:
+            connection.execute(text(INSERT_ALERTS_SQL), alerts)
+        if states:
+            connection.execute(text(UPSERT_STATE_SQL), states)
+    return len(rows), len(alerts), time.perf_counter() - started
+
+def user_shards(db_path, shard_size):
+    """Split the users table into contiguous (first_user_id, last_user_id) ranges of shard_size users"""
+    engine = create_sqlite_engine(1, 0, read_only=True, db_path=db_path)
+    try:
+        with engine.connect() as connection:
+            user_ids = [user_id for user_id, in connection.execute(text('SELECT user_id FROM users ORDER BY user_id'))]
+    finally:
+        engine.dispose()
+    return [(user_ids[i], user_ids[min(i + shard_size, len(user_ids)) - 1])
+            for i in range(0, len(user_ids), shard_size)]
+
+def generate_alerts(db_path=DB_PATH, period_start=None, workers=None, shard_size=SHARD_SIZE):
+    """Evaluate every user's month-to-date usage against their thresholds across a process pool"""
+    if period_start is None:
+        now = datetime.utcnow()
+        period_start = datetime(now.year, now.month, 1)
+    shards = user_shards(db_path, shard_size)
+    print(f"Evaluating {period_start:%Y-%m} for {len(shards)} shards of up to {shard_size} users: {db_path}")
+
+    started = time.perf_counter()
+    total_users = total_alerts = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(db_path,)) as pool:
+        futures = {pool.submit(evaluate_shard, first, last, period_start): (first, last) for first, last in shards}
+        for done, future in enumerate(as_completed(futures), start=1):
+            first, last = futures[future]
+            users, alerts, seconds = future.result()
+            total_users += users
+            total_alerts += alerts
+            elapsed = time.perf_counter() - started
+            print(f"  [{done}/{len(shards)}] users {first}-{last}: {users} users, {alerts} alerts "
+                  f"in {seconds:.2f}s ({total_users / elapsed:.0f} users/s overall)")
+
+    elapsed = time.perf_counter() - started
+    rate = total_users / elapsed if elapsed else 0
+    print(f"Done: {total_users} users, {total_alerts} alerts in {elapsed:.2f}s ({rate:.0f} users/s)")
+    return {'users': total_users, 'alerts': total_alerts, 'seconds': elapsed, 'users_per_second': rate}
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print("Usage: python generate_alerts.py <user_id>")
+    parser = argparse.ArgumentParser(description='Raise threshold alerts for every user from the monthly usage rollups')
+    parser.add_argument('--db', default=DB_PATH, help='SQLite database path')
+    parser.add_argument('--month', help='billing month as YYYY-MM (default: current UTC month)')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE, help='users per shard')
+    args = parser.parse_args()
+
+    month = datetime.strptime(args.month, '%Y-%m') if args.month else None
+    try:
+        generate_alerts(args.db, month, args.workers, args.shard_size)
+    except Exception as e:
+        print(f"Error generating alerts: {e}")
         sys.exit(1)
-    
-    user_id = int(sys.argv[1])
-    generate_alerts(user_id)
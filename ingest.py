@@ -0,0 +1,170 @@
+import json
+import math
+from datetime import datetime, timezone
+from sqlalchemy import text
+from models import UsageLog, UsageArchiveWatermark
+from rollups import triggers_paused, refresh_rollups, refresh_user_totals, refresh_latest_readings, evaluate_thresholds
+
+# Rows per executemany() call; each chunk is committed on its own so the
+# SQLite write lock is never held for a whole batch
+INGEST_CHUNK_SIZE = 1000
+
+# Rejected records reported back in full; the rest are only counted
+MAX_REPORTED_ERRORS = 50
+
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+# INSERT OR IGNORE against the unique (appliance_id, timestamp) index makes
+# re-sending a batch a no-op for the readings that already landed
+insert_usage_logs_stmt = UsageLog.__table__.insert().prefix_with('OR IGNORE')
+
+BULK_INSERT_SQL = (
+    'INSERT OR IGNORE INTO usage_logs (appliance_id, timestamp, energy_consumed, duration_hours) '
+    'VALUES (?, ?, ?, ?)'
+)
+
+class InvalidReading(ValueError):
+    pass
+
+def parse_timestamp(value):
+    """Accept ISO 8601 strings or epoch seconds; return a naive UTC datetime"""
+    if isinstance(value, bool) or value is None:
+        raise InvalidReading('timestamp is required')
+    if isinstance(value, (int, float)):
+        if not math.isfinite(value):
+            raise InvalidReading('timestamp must be finite')
+        try:
+            return datetime.fromtimestamp(value, tz=timezone.utc).replace(tzinfo=None)
+        except (OverflowError, OSError, ValueError):
+            raise InvalidReading(f'timestamp out of range: {value!r}')
+    if isinstance(value, str):
+        text = value.strip()
+        if text.endswith('Z'):
+            text = text[:-1] + '+00:00'
+        try:
+            parsed = datetime.fromisoformat(text)
+        except ValueError:
+            raise InvalidReading(f'invalid timestamp: {value!r}')
+        if parsed.tzinfo is not None:
+            try:
+                parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+            except OverflowError:
+                raise InvalidReading(f'timestamp out of range: {value!r}')
+        return parsed
+    raise InvalidReading('timestamp must be an ISO 8601 string or epoch seconds')
+
+def parse_number(record, field, required):
+    value = record.get(field)
+    if value is None:
+        if required:
+            raise InvalidReading(f'{field} is required')
+        return None
+    if isinstance(value, bool):
+        raise InvalidReading(f'{field} must be a number')
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise InvalidReading(f'{field} must be a number')
+    if not math.isfinite(number) or number < 0:
+        raise InvalidReading(f'{field} must be a non-negative number')
+    return number
+
+def parse_reading(record, appliance_ids, archived_before=None):
+    """Validate one reading against the user's appliances and return a usage_logs row"""
+    if not isinstance(record, dict):
+        raise InvalidReading('reading must be a JSON object')
+    value = record.get('appliance_id')
+    # int() would truncate 1.9 to appliance 1
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise InvalidReading('appliance_id must be an integer')
+    try:
+        appliance_id = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise InvalidReading('appliance_id must be an integer')
+    if appliance_id not in appliance_ids:
+        raise InvalidReading(f'appliance {appliance_id} not found')
+    timestamp = parse_timestamp(record.get('timestamp'))
+    if archived_before is not None and timestamp < archived_before:
+        raise InvalidReading(f'timestamp is before {archived_before:%Y-%m-%d}, which has been archived')
+    return {
+        'appliance_id': appliance_id,
+        'timestamp': timestamp,
+        'energy_consumed': parse_number(record, 'energy_consumed', required=True),
+        'duration_hours': parse_number(record, 'duration_hours', required=False),
+    }
+
+def iter_ndjson(stream):
+    """Yield (line_number, record) from a newline-delimited JSON stream without buffering it"""
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, InvalidReading('invalid JSON')
+
+def insert_usage_logs(session, rows):
+    """Bulk insert usage_logs rows through Core; return how many were new"""
+    if not rows:
+        return 0
+    result = session.execute(insert_usage_logs_stmt, rows)
+    session.commit()
+    return max(result.rowcount, 0)
+
+def ingest_readings(session, records, appliance_ids, chunk_size=INGEST_CHUNK_SIZE):
+    """Validate and insert (position, record) pairs in chunks; return a summary dict"""
+    summary = {'received': 0, 'inserted': 0, 'duplicates': 0, 'rejected': 0, 'errors': []}
+    chunk = []
+    archived_before = session.query(UsageArchiveWatermark.archived_before).scalar()
+
+    def flush():
+        inserted = insert_usage_logs(session, chunk)
+        summary['inserted'] += inserted
+        summary['duplicates'] += len(chunk) - inserted
+        chunk.clear()
+
+    for position, record in records:
+        summary['received'] += 1
+        try:
+            if isinstance(record, InvalidReading):
+                raise record
+            chunk.append(parse_reading(record, appliance_ids, archived_before))
+        except InvalidReading as e:
+            summary['rejected'] += 1
+            if len(summary['errors']) < MAX_REPORTED_ERRORS:
+                summary['errors'].append({'position': position, 'error': str(e)})
+            continue
+        if len(chunk) >= chunk_size:
+            flush()
+    flush()
+    return summary
+
+def bulk_load_usage_logs(session, rows, appliance_ids, since):
+    """Load generated (appliance_id, timestamp_text, energy, duration) tuples in one transaction.
+
+    Meant for large synthetic loads: the usage_logs triggers are paused, the
+    rows go straight to the driver's executemany(), and the rollups and latest
+    readings of `appliance_ids` are refreshed from `since` in a few set-based
+    statements, followed by one threshold evaluation for their owners.
+    Rows older than the archive watermark are dropped.
+    Timestamps must already be in SQLAlchemy's DateTime text form.
+    """
+    if not rows:
+        return 0
+    connection = session.connection()
+    watermark = connection.execute(text('SELECT archived_before FROM usage_archive_watermark')).scalar()
+    if watermark is not None:
+        # Archived months are closed; the unique index no longer sees their rows
+        rows = [row for row in rows if row[1] >= watermark]
+        if not rows:
+            return 0
+    with triggers_paused(connection):
+        result = connection.exec_driver_sql(BULK_INSERT_SQL, rows)
+        refresh_rollups(connection, appliance_ids, since)
+        user_ids = refresh_user_totals(connection, appliance_ids, since)
+        refresh_latest_readings(connection, appliance_ids)
+    # The paused triggers skipped threshold evaluation; run it once for all owners
+    evaluate_thresholds(connection, user_ids)
+    session.commit()
+    return max(result.rowcount, 0)
@@ -0,0 +1,145 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+import threading
+import time
+from sqlalchemy import event
+
+# Upper bounds of the histogram buckets; +Inf is implied
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class Histogram:
+    """Non-cumulative bucket counts plus sum and count; guarded by the owner's lock"""
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class RequestState:
+    """What the current request has done so far"""
+    __slots__ = ('started', 'queries', 'sql_seconds')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+
+# State of the current request, if any. A context variable rather than a
+# thread-local, so the SQL of async views, which run on an event loop
+# thread, is still counted against their request.
+_current = ContextVar('request_metrics', default=None)
+
+class RequestMetrics:
+    """Per-route request latency, status counts, in-flight requests and SQL use, in Prometheus text format.
+
+    The hot path only touches a context variable while a request runs; the
+    shared histograms are updated under one lock acquisition when it finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self._durations = {}
+        self._responses = {}
+        self._queries = {}
+        self._sql_seconds = {}
+
+    def begin(self):
+        _current.set(RequestState())
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self, route, method, status):
+        """Record the current request; a no-op if it was already recorded"""
+        state = _current.get()
+        if state is None:
+            return
+        _current.set(None)
+        duration = time.perf_counter() - state.started
+        with self._lock:
+            self.in_flight -= 1
+            key = (route, method)
+            histogram = self._durations.get(key)
+            if histogram is None:
+                histogram = self._durations[key] = Histogram(LATENCY_BUCKETS)
+                self._queries[key] = Histogram(QUERY_COUNT_BUCKETS)
+                self._sql_seconds[key] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(duration)
+            self._queries[key].observe(state.queries)
+            self._sql_seconds[key].observe(state.sql_seconds)
+            status_key = (route, method, str(status))
+            self._responses[status_key] = self._responses.get(status_key, 0) + 1
+
+    def render(self, extra_lines=()):
+        """The metrics in Prometheus text exposition format"""
+        with self._lock:
+            lines = [
+                '# HELP smart_home_http_requests_in_flight Requests being handled by this process.',
+                '# TYPE smart_home_http_requests_in_flight gauge',
+                f'smart_home_http_requests_in_flight {self.in_flight}',
+                '# HELP smart_home_http_responses_total Responses by route, method and status.',
+                '# TYPE smart_home_http_responses_total counter',
+            ]
+            for (route, method, status), count in sorted(self._responses.items()):
+                lines.append(f'smart_home_http_responses_total{{{labels(route=route, method=method, status=status)}}} {count}')
+            for name, help_text, histograms in (
+                ('smart_home_http_request_duration_seconds', 'Time from the start of a request to its response.', self._durations),
+                ('smart_home_db_queries_per_request', 'SQL statements executed per request.', self._queries),
+                ('smart_home_db_query_seconds_per_request', 'Time spent executing SQL per request.', self._sql_seconds),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (route, method), histogram in sorted(histograms.items()):
+                    lines.extend(histogram_lines(name, labels(route=route, method=method), histogram))
+        lines.extend(extra_lines)
+        return '\n'.join(lines) + '\n'
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def labels(**values):
+    return ','.join(f'{name}="{escape_label(value)}"' for name, value in values.items())
+
+def histogram_lines(name, label_text, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.bounds + ('+Inf',), histogram.counts):
+        cumulative += count
+        yield f'{name}_bucket{{{label_text},le="{bound}"}} {cumulative}'
+    yield f'{name}_sum{{{label_text}}} {histogram.sum:.6f}'
+    yield f'{name}_count{{{label_text}}} {histogram.count}'
+
+def metric_lines(name, metric_type, help_text, samples):
+    """HELP/TYPE header and one line per (label dict, value) sample"""
+    yield f'# HELP {name} {help_text}'
+    yield f'# TYPE {name} {metric_type}'
+    for label_values, value in samples:
+        yield f'{name}{{{labels(**label_values)}}} {value}' if label_values else f'{name} {value}'
+
+# Start times are kept per connection, as an async view's gathered queries
+# run at the same time on different connections
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info['metrics_started'] = time.perf_counter()
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    state = _current.get()
+    if state is not None:
+        state.queries += 1
+        state.sql_seconds += time.perf_counter() - conn.info.pop('metrics_started', time.perf_counter())
+
+def instrument_engine(engine):
+    """Count and time the SQL the current request runs on `engine`"""
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,88 @@
+import os
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from sqlalchemy import create_engine, event
+from models import Base
+
+# Tables whose foreign keys gained ON DELETE CASCADE, parents first. SQLite
+# cannot alter a foreign key, so each one is rebuilt and its rows copied over.
+REBUILT_TABLES = [
+    'appliances',
+    'usage_logs',
+    'appliance_latest_reading',
+    'usage_rollup_hourly',
+    'usage_rollup_daily',
+    'usage_rollup_monthly',
+]
+
+def create_migration_engine(db_path):
+    """An engine whose transactions cover DDL too, with foreign keys off for the rebuild"""
+    engine = create_engine(f'sqlite:///{db_path}')
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        # Stop pysqlite from managing transactions, which it only opens before DML
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        # Both pragmas are no-ops inside a transaction
+        cursor.execute('PRAGMA foreign_keys = OFF')
+        # Keep RENAME from rewriting other tables' references to the renamed ones
+        cursor.execute('PRAGMA legacy_alter_table = ON')
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def do_begin(connection):
+        connection.exec_driver_sql('BEGIN')
+
+    return engine
+
+def migrate(db_path):
+    """Rebuild the appliance tables with ON DELETE CASCADE foreign keys, dropping orphaned rows"""
+    print(f"Adding cascading deletes to: {db_path}")
+    engine = create_migration_engine(db_path)
+    try:
+        with engine.begin() as connection:
+            # create_all only adds missing tables, such as the trigger pause
+            Base.metadata.create_all(connection)
+            for table in REBUILT_TABLES:
+                # Index names are global, so the old tables' indexes have to go first
+                indexes = connection.exec_driver_sql(
+                    "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                    (table,)).fetchall()
+                for name, in indexes:
+                    connection.exec_driver_sql(f'DROP INDEX {name}')
+                connection.exec_driver_sql(f'ALTER TABLE {table} RENAME TO _old_{table}')
+
+            # Recreates the tables, their indexes and every trigger
+            Base.metadata.create_all(connection, tables=[Base.metadata.tables[table] for table in REBUILT_TABLES])
+            connection.exec_driver_sql('INSERT INTO usage_log_trigger_pause DEFAULT VALUES')
+            for table in REBUILT_TABLES:
+                columns = ', '.join(column.name for column in Base.metadata.tables[table].columns)
+                key, parent = ('room_id', 'rooms') if table == 'appliances' else ('appliance_id', 'appliances')
+                result = connection.exec_driver_sql(f"""
+                    INSERT INTO {table} ({columns}) SELECT {columns} FROM _old_{table}
+                    WHERE {key} IN (SELECT {key} FROM {parent})
+                """)
+                print(f"  {table}: {result.rowcount} rows")
+            connection.exec_driver_sql('DELETE FROM usage_log_trigger_pause')
+            for table in reversed(REBUILT_TABLES):
+                connection.exec_driver_sql(f'DROP TABLE _old_{table}')
+
+            violations = connection.exec_driver_sql('PRAGMA foreign_key_check').fetchall()
+            if violations:
+                raise RuntimeError(f'{len(violations)} foreign key violations, first: {violations[0]}')
+        print("Migration completed successfully!")
+        return True
+    except Exception as e:
+        print(f"Error during migration: {e}")
+        return False
+    finally:
+        engine.dispose()
+
+if __name__ == '__main__':
+    paths = sys.argv[1:] or [os.path.join(PROJECT_DIR, 'smart_home.db')]
+    ok = all([migrate(path) for path in paths])
+    sys.exit(0 if ok else 1)
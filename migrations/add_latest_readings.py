@@ -0,0 +1,43 @@
+import os
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+from sqlalchemy import create_engine, text
+from models import Base
+
+BACKFILL_SQL = """
+    INSERT OR REPLACE INTO appliance_latest_reading (appliance_id, log_id, energy_consumed, timestamp)
+    SELECT u.appliance_id, u.log_id, u.energy_consumed, u.timestamp
+    FROM appliances a
+    JOIN usage_logs u ON u.log_id = (
+        SELECT log_id FROM usage_logs
+        WHERE appliance_id = a.appliance_id
+        ORDER BY timestamp DESC, log_id DESC LIMIT 1
+    )
+"""
+
+def migrate(db_path):
+    """Create appliance_latest_reading and its triggers, then backfill it"""
+    print(f"Adding latest readings to: {db_path}")
+    engine = create_engine(f'sqlite:///{db_path}')
+    try:
+        # create_all only adds missing tables, and reinstalls the triggers
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(text('DELETE FROM appliance_latest_reading'))
+            result = connection.execute(text(BACKFILL_SQL))
+        print(f"Backfilled {result.rowcount} appliances")
+        print("Migration completed successfully!")
+        return True
+    except Exception as e:
+        print(f"Error during migration: {e}")
+        return False
+    finally:
+        engine.dispose()
+
+if __name__ == '__main__':
+    paths = sys.argv[1:] or [os.path.join(PROJECT_DIR, 'smart_home.db')]
+    ok = all([migrate(path) for path in paths])
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,63 @@
+import sqlite3
+import os
+import sys
+
+# Index names match the ones declared on the models so create_all() and this
+# migration never build the same index twice.
+INDEXES = [
+    ('uq_usage_logs_appliance_timestamp', 'usage_logs', 'appliance_id, timestamp', True),
+    ('ix_usage_logs_timestamp', 'usage_logs', 'timestamp', False),
+    ('ix_appliances_room_id', 'appliances', 'room_id', False),
+    ('ix_rooms_user_id', 'rooms', 'user_id', False),
+    ('ix_threshold_alerts_user_date', 'threshold_alerts', 'user_id, alert_date', False),
+    ('ix_threshold_levels_user_id', 'threshold_levels', 'user_id', False),
+]
+
+# Replaced by uq_usage_logs_appliance_timestamp
+SUPERSEDED_INDEXES = ['ix_usage_logs_appliance_timestamp']
+
+# The unique index cannot be built while duplicate readings exist; keep the
+# oldest row for each (appliance_id, timestamp)
+DEDUPLICATE_SQL = '''
+    DELETE FROM usage_logs
+    WHERE log_id NOT IN (
+        SELECT MIN(log_id) FROM usage_logs GROUP BY appliance_id, timestamp
+    )
+'''
+
+def default_db_path():
+    project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(project_dir, 'smart_home.db')
+
+def migrate(db_path):
+    print(f"Adding indexes to: {db_path}")
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute(DEDUPLICATE_SQL)
+        if cursor.rowcount > 0:
+            print(f"  removed {cursor.rowcount} duplicate usage logs")
+
+        for name in SUPERSEDED_INDEXES:
+            cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+        for name, table, columns, unique in INDEXES:
+            kind = 'UNIQUE INDEX' if unique else 'INDEX'
+            cursor.execute(f'CREATE {kind} IF NOT EXISTS {name} ON {table} ({columns})')
+            print(f"  {name} ready")
+
+        conn.commit()
+        print("Migration completed successfully!")
+    except sqlite3.Error as e:
+        print(f"Error during migration: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+    return True
+
+if __name__ == '__main__':
+    paths = sys.argv[1:] or [default_db_path()]
+    ok = all([migrate(path) for path in paths])
+    sys.exit(0 if ok else 1)
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Index, PrimaryKeyConstraint, DDL, event
+from sqlalchemy.orm import declarative_base, declared_attr, relationship
 from datetime import datetime
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -54,10 +54,10 @@ class Room(Base):
     __tablename__ = 'rooms'
     room_id = Column(Integer, primary_key=True)
     room_name = Column(String(50), nullable=False)
-    user_id = Column(Integer, ForeignKey('users.user_id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.user_id'), nullable=False, index=True)
     
     user = relationship('User', back_populates='rooms')
-    appliances = relationship('Appliance', back_populates='room', cascade='all, delete-orphan')
+    appliances = relationship('Appliance', back_populates='room', cascade='all, delete-orphan', passive_deletes=True)
 
 class Appliance(Base):
     __tablename__ = 'appliances'
@@ -66,25 +66,79 @@ class Appliance(Base):
     min_power_rating_watt = Column(Float, default=0)
     max_power_rating_watt = Column(Float, nullable=False)
     quantity = Column(Integer, default=1)
-    room_id = Column(Integer, ForeignKey('rooms.room_id'), nullable=False)
+    room_id = Column(Integer, ForeignKey('rooms.room_id', ondelete='CASCADE'), nullable=False, index=True)
     
     room = relationship('Room', back_populates='appliances')
-    usage_logs = relationship('UsageLog', back_populates='appliance', cascade='all, delete-orphan')
+    # Children go by ON DELETE CASCADE instead of being loaded and deleted one by one
+    usage_logs = relationship('UsageLog', back_populates='appliance', cascade='all, delete-orphan', passive_deletes=True)
+    latest_reading = relationship('ApplianceLatestReading', back_populates='appliance', uselist=False, cascade='all, delete-orphan', passive_deletes=True)
 
 class UsageLog(Base):
     __tablename__ = 'usage_logs'
     log_id = Column(Integer, primary_key=True)
-    appliance_id = Column(Integer, ForeignKey('appliances.appliance_id'), nullable=False)
+    appliance_id = Column(Integer, ForeignKey('appliances.appliance_id', ondelete='CASCADE'), nullable=False)
     energy_consumed = Column(Float, nullable=False)
     duration_hours = Column(Float)
     timestamp = Column(DateTime, default=datetime.utcnow)
     
     appliance = relationship('Appliance', back_populates='usage_logs')
 
+    # Every dashboard read filters by appliance and ranges/orders by timestamp.
+    # One reading per appliance and instant also makes batch ingest idempotent.
+    __table_args__ = (
+        Index('uq_usage_logs_appliance_timestamp', 'appliance_id', 'timestamp', unique=True),
+        Index('ix_usage_logs_timestamp', 'timestamp'),
+    )
+
+class ApplianceLatestReading(Base):
+    """Most recent usage log per appliance, kept current by the triggers below"""
+    __tablename__ = 'appliance_latest_reading'
+    appliance_id = Column(Integer, ForeignKey('appliances.appliance_id', ondelete='CASCADE'), primary_key=True)
+    log_id = Column(Integer, nullable=False)
+    energy_consumed = Column(Float, nullable=False)
+    timestamp = Column(DateTime)
+
+    appliance = relationship('Appliance', back_populates='latest_reading')
+
+class UsageRollup:
+    """Pre-summed usage per appliance and period; see ROLLUP_TRIGGERS below"""
+    @declared_attr
+    def appliance_id(cls):
+        return Column(Integer, ForeignKey('appliances.appliance_id', ondelete='CASCADE'), nullable=False)
+
+    period_start = Column(DateTime, nullable=False)
+    energy_consumed = Column(Float, nullable=False, default=0)
+    duration_hours = Column(Float, nullable=False, default=0)
+    reading_count = Column(Integer, nullable=False, default=0)
+
+    # Appliance first, so per-appliance period ranges are a single index seek
+    __table_args__ = (
+        PrimaryKeyConstraint('appliance_id', 'period_start'),
+    )
+
+class UsageRollupHourly(UsageRollup, Base):
+    __tablename__ = 'usage_rollup_hourly'
+
+class UsageRollupDaily(UsageRollup, Base):
+    __tablename__ = 'usage_rollup_daily'
+
+class UsageRollupMonthly(UsageRollup, Base):
+    __tablename__ = 'usage_rollup_monthly'
+
+class UsageLogTriggerPause(Base):
+    """While a row exists the usage_logs triggers are skipped.
+
+    Bulk loaders insert one inside their own write transaction, load rows
+    set-wise, refresh the derived tables in one pass and delete it again
+    before committing, so other connections never see it.
+    """
+    __tablename__ = 'usage_log_trigger_pause'
+    pause_id = Column(Integer, primary_key=True)
+
 class ThresholdLevels(Base):
     __tablename__ = 'threshold_levels'
     level_id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.user_id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.user_id'), nullable=False, index=True)
     warning_kwh = Column(Float, nullable=False)
     critical_kwh = Column(Float, nullable=False)
     
@@ -99,3 +153,192 @@ class ThresholdAlerts(Base):
     current_kwh = Column(Float, nullable=False)
     
     user = relationship('User', back_populates='threshold_alerts')
+
+    # Alerts are always read newest-first for one user
+    __table_args__ = (
+        Index('ix_threshold_alerts_user_date', 'user_id', 'alert_date'),
+    )
+
+class UserMonthlyUsage(Base):
+    """Running kWh total per user and calendar month (UTC), kept by the usage_logs triggers"""
+    __tablename__ = 'user_monthly_usage'
+    user_id = Column(Integer, ForeignKey('users.user_id'), primary_key=True)
+    period_start = Column(DateTime, primary_key=True)
+    energy_consumed = Column(Float, nullable=False, default=0)
+
+class UserAlertState(Base):
+    """Threshold level a user's current month last reached; alerts are only written when it rises"""
+    __tablename__ = 'user_alert_state'
+    user_id = Column(Integer, ForeignKey('users.user_id'), primary_key=True)
+    period_start = Column(DateTime, nullable=False)
+    level = Column(String(20), nullable=False)  # 'Normal', 'Warning' or 'Critical'
+    changed_at = Column(DateTime, nullable=False)
+
+class UsageArchiveWatermark(Base):
+    """Single row; usage logs older than `archived_before` (a month start) live in the archive files"""
+    __tablename__ = 'usage_archive_watermark'
+    watermark_id = Column(Integer, primary_key=True)
+    archived_before = Column(DateTime, nullable=False)
+
+# Triggers keep the derived tables (appliance_latest_reading, the usage
+# rollups and the per-user monthly totals) in step with usage_logs no matter
+# how rows are written: ORM, bulk query.delete() or Core inserts. Every
+# create_all() drops and recreates them, so existing databases pick up the
+# current definitions. The threshold triggers further down share the pause.
+TRIGGERS_ACTIVE = 'NOT EXISTS (SELECT 1 FROM usage_log_trigger_pause)'
+
+def usage_log_trigger(name, timing, condition, body, table='usage_logs'):
+    when = f'{TRIGGERS_ACTIVE} AND ({condition})' if condition else TRIGGERS_ACTIVE
+    sql = f"""
+    CREATE TRIGGER {name}
+    {timing} ON {table}
+    WHEN {when}
+    BEGIN
+    {body}
+    END
+    """
+    event.listen(Base.metadata, 'after_create', DDL(f'DROP TRIGGER IF EXISTS {name}'))
+    # DDL() applies %-formatting, so the strftime() patterns need escaping
+    event.listen(Base.metadata, 'after_create', DDL(sql.replace('%', '%%')))
+
+def _latest_reading_recompute(appliance_id):
+    return f"""
+    DELETE FROM appliance_latest_reading WHERE appliance_id = {appliance_id};
+    INSERT INTO appliance_latest_reading (appliance_id, log_id, energy_consumed, timestamp)
+    SELECT appliance_id, log_id, energy_consumed, timestamp FROM usage_logs
+    WHERE appliance_id = {appliance_id}
+    ORDER BY timestamp DESC, log_id DESC LIMIT 1;
+    """
+
+usage_log_trigger('trg_usage_logs_latest_insert', 'AFTER INSERT', None, """
+    INSERT INTO appliance_latest_reading (appliance_id, log_id, energy_consumed, timestamp)
+    VALUES (NEW.appliance_id, NEW.log_id, NEW.energy_consumed, NEW.timestamp)
+    ON CONFLICT (appliance_id) DO UPDATE SET
+        log_id = excluded.log_id,
+        energy_consumed = excluded.energy_consumed,
+        timestamp = excluded.timestamp
+    WHERE appliance_latest_reading.timestamp IS NULL
+       OR excluded.timestamp >= appliance_latest_reading.timestamp;
+""")
+usage_log_trigger('trg_usage_logs_latest_delete', 'AFTER DELETE',
+    'OLD.log_id = (SELECT log_id FROM appliance_latest_reading WHERE appliance_id = OLD.appliance_id)',
+    _latest_reading_recompute('OLD.appliance_id'))
+usage_log_trigger('trg_usage_logs_latest_update', 'AFTER UPDATE OF appliance_id, energy_consumed, timestamp', None,
+    _latest_reading_recompute('OLD.appliance_id') + _latest_reading_recompute('NEW.appliance_id'))
+
+# strftime() formats that truncate a usage_logs.timestamp to the start of its
+# period. They produce the same text SQLAlchemy stores for a DateTime, so
+# rollup periods compare correctly against datetime parameters.
+ROLLUP_GRAINS = [
+    ('usage_rollup_hourly', '%Y-%m-%d %H:00:00.000000'),
+    ('usage_rollup_daily', '%Y-%m-%d 00:00:00.000000'),
+    ('usage_rollup_monthly', '%Y-%m-01 00:00:00.000000'),
+]
+
+MONTH_FORMAT = ROLLUP_GRAINS[-1][1]
+
+# The appliance's owner, for the per-user running totals
+def _owner_of(row):
+    return f"""(SELECT r.user_id FROM appliances a JOIN rooms r ON r.room_id = a.room_id
+              WHERE a.appliance_id = {row}.appliance_id)"""
+
+def _rollup_add(row):
+    statements = [f"""
+        INSERT INTO user_monthly_usage (user_id, period_start, energy_consumed)
+        SELECT {_owner_of(row)}, strftime('{MONTH_FORMAT}', {row}.timestamp), {row}.energy_consumed
+        WHERE {_owner_of(row)} IS NOT NULL
+        ON CONFLICT (user_id, period_start) DO UPDATE SET
+            energy_consumed = energy_consumed + excluded.energy_consumed;
+    """]
+    for table, period_format in ROLLUP_GRAINS:
+        statements.append(f"""
+        INSERT INTO {table} (appliance_id, period_start, energy_consumed, duration_hours, reading_count)
+        VALUES ({row}.appliance_id, strftime('{period_format}', {row}.timestamp),
+                {row}.energy_consumed, COALESCE({row}.duration_hours, 0), 1)
+        ON CONFLICT (appliance_id, period_start) DO UPDATE SET
+            energy_consumed = energy_consumed + excluded.energy_consumed,
+            duration_hours = duration_hours + excluded.duration_hours,
+            reading_count = reading_count + 1;
+        """)
+    return ''.join(statements)
+
+def _rollup_subtract(row):
+    statements = [f"""
+        UPDATE user_monthly_usage SET energy_consumed = energy_consumed - {row}.energy_consumed
+        WHERE user_id = {_owner_of(row)} AND period_start = strftime('{MONTH_FORMAT}', {row}.timestamp);
+    """]
+    for table, period_format in ROLLUP_GRAINS:
+        period = f"strftime('{period_format}', {row}.timestamp)"
+        statements.append(f"""
+        UPDATE {table} SET
+            energy_consumed = energy_consumed - {row}.energy_consumed,
+            duration_hours = duration_hours - COALESCE({row}.duration_hours, 0),
+            reading_count = reading_count - 1
+        WHERE appliance_id = {row}.appliance_id AND period_start = {period};
+        DELETE FROM {table}
+        WHERE appliance_id = {row}.appliance_id AND period_start = {period} AND reading_count <= 0;
+        """)
+    return ''.join(statements)
+
+ROLLUP_COLUMNS = 'appliance_id, energy_consumed, duration_hours, timestamp'
+
+usage_log_trigger('trg_usage_logs_rollup_insert', 'AFTER INSERT',
+    'NEW.timestamp IS NOT NULL', _rollup_add('NEW'))
+usage_log_trigger('trg_usage_logs_rollup_delete', 'AFTER DELETE',
+    'OLD.timestamp IS NOT NULL', _rollup_subtract('OLD'))
+usage_log_trigger('trg_usage_logs_rollup_update_old', f'AFTER UPDATE OF {ROLLUP_COLUMNS}',
+    'OLD.timestamp IS NOT NULL', _rollup_subtract('OLD'))
+usage_log_trigger('trg_usage_logs_rollup_update_new', f'AFTER UPDATE OF {ROLLUP_COLUMNS}',
+    'NEW.timestamp IS NOT NULL', _rollup_add('NEW'))
+
+# Threshold alerts are edge-triggered: a user's current-month total is
+# compared with their thresholds whenever it (or the thresholds) change, and
+# an alert is only written when the level rises above the one recorded in
+# user_alert_state. Falling back (after deletes) just updates the state.
+DEFAULT_WARNING_KWH = 30
+DEFAULT_CRITICAL_KWH = 35
+CURRENT_MONTH = f"strftime('{MONTH_FORMAT}', 'now')"
+NOW = "strftime('%Y-%m-%d %H:%M:%S.000000', 'now')"
+
+def _level_rank(level):
+    return f"CASE {level} WHEN 'Critical' THEN 2 WHEN 'Warning' THEN 1 ELSE 0 END"
+
+def threshold_evaluation_sql(user_filter):
+    """Statements that raise alerts and record the new level for users matching `user_filter` on `u`"""
+    evaluation = f"""
+        SELECT u.user_id, u.period_start, u.energy_consumed AS total,
+               CASE WHEN u.energy_consumed >= COALESCE(t.critical_kwh, {DEFAULT_CRITICAL_KWH}) THEN 'Critical'
+                    WHEN u.energy_consumed >= COALESCE(t.warning_kwh, {DEFAULT_WARNING_KWH}) THEN 'Warning'
+                    ELSE 'Normal' END AS level,
+               CASE WHEN s.period_start = u.period_start THEN s.level ELSE 'Normal' END AS previous_level
+        FROM user_monthly_usage u
+        LEFT JOIN threshold_levels t ON t.level_id = (
+            SELECT MIN(level_id) FROM threshold_levels WHERE user_id = u.user_id
+        )
+        LEFT JOIN user_alert_state s ON s.user_id = u.user_id
+        WHERE u.period_start = {CURRENT_MONTH} AND {user_filter}
+    """
+    return [f"""
+        INSERT INTO threshold_alerts (user_id, level_id, alert_date, current_kwh)
+        SELECT user_id, level, {NOW}, total FROM ({evaluation})
+        WHERE {_level_rank('level')} > {_level_rank('previous_level')};
+    """, f"""
+        INSERT INTO user_alert_state (user_id, period_start, level, changed_at)
+        SELECT user_id, period_start, level, {NOW} FROM ({evaluation})
+        WHERE level != previous_level
+        ON CONFLICT (user_id) DO UPDATE SET
+            period_start = excluded.period_start,
+            level = excluded.level,
+            changed_at = excluded.changed_at;
+    """]
+
+_evaluate_new_user = ''.join(threshold_evaluation_sql('u.user_id = NEW.user_id'))
+
+usage_log_trigger('trg_user_monthly_usage_evaluate_insert', 'AFTER INSERT',
+    f'NEW.period_start = {CURRENT_MONTH}', _evaluate_new_user, table='user_monthly_usage')
+usage_log_trigger('trg_user_monthly_usage_evaluate_update', 'AFTER UPDATE OF energy_consumed',
+    f'NEW.period_start = {CURRENT_MONTH}', _evaluate_new_user, table='user_monthly_usage')
+usage_log_trigger('trg_threshold_levels_evaluate_insert', 'AFTER INSERT',
+    None, _evaluate_new_user, table='threshold_levels')
+usage_log_trigger('trg_threshold_levels_evaluate_update', 'AFTER UPDATE OF warning_kwh, critical_kwh',
+    None, _evaluate_new_user, table='threshold_levels')
@@ -0,0 +1,245 @@
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from flask import request, jsonify
+from flask_login import current_user
+from sqlalchemy import event
+from database import BASE_DIR, env_int
+
+# Admins, by login email, may profile their own requests with an
+# `X-Profile: 1` header or `?profile=1`, and arm profiling of another user's
+# next requests. Everyone else's requests pay for one header and one query
+# string lookup.
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()}
+PROFILE_DIR = os.environ.get('PROFILE_DIR') or os.path.join(BASE_DIR, 'profiles')
+PROFILE_INTERVAL_MS = env_int('PROFILE_INTERVAL_MS', 2)
+# A profile stops sampling after this long, even if its request has not finished
+PROFILE_MAX_SECONDS = env_int('PROFILE_MAX_SECONDS', 60)
+# Upper bound on requests armed per user
+PROFILE_MAX_ARMED = 100
+
+# Profile of the current request, if any; a context variable so async views' SQL is recorded too
+_current = ContextVar('request_profile', default=None)
+
+# user id -> how many of their next requests to profile
+_armed = {}
+_armed_lock = threading.Lock()
+
+def is_admin(user):
+    return bool(ADMIN_EMAILS) and user.is_authenticated and (user.email or '').lower() in ADMIN_EMAILS
+
+def admin_required(view):
+    """Like login_required, but for ADMIN_EMAILS only; others get a 404 so the route stays hidden"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin(current_user):
+            return jsonify({'error': 'Not found'}), 404
+        return view(*args, **kwargs)
+    return wrapper
+
+def arm(user_id, requests):
+    """Profile the user's next `requests` requests in this process"""
+    with _armed_lock:
+        _armed[user_id] = min(requests, PROFILE_MAX_ARMED)
+
+def take_armed(user_id):
+    with _armed_lock:
+        remaining = _armed.get(user_id)
+        if not remaining:
+            return False
+        if remaining == 1:
+            del _armed[user_id]
+        else:
+            _armed[user_id] = remaining - 1
+        return True
+
+def frame_label(frame):
+    module = frame.f_globals.get('__name__') or os.path.basename(frame.f_code.co_filename)
+    return f'{module}:{frame.f_code.co_name}'
+
+def thread_stack(frame, stop=None):
+    """Labels from `frame` outwards up to, not including, `stop`; outermost first"""
+    stack = []
+    while frame is not None and frame is not stop:
+        stack.append(frame_label(frame))
+        frame = frame.f_back
+    return stack[::-1]
+
+def task_stack(task, thread_frame):
+    """An async view task's await chain, outermost first.
+
+    A suspended coroutine's frames are on no thread's stack, so the chain is
+    followed through cr_await. If the innermost coroutine is running, the
+    event loop thread's frames below it (or the SQLAlchemy greenlet's) follow.
+    """
+    stack = []
+    coroutine, frame = task.get_coro(), None
+    while coroutine is not None:
+        frame = getattr(coroutine, 'cr_frame', None) or getattr(coroutine, 'gi_frame', None)
+        if frame is None:
+            break
+        stack.append(frame_label(frame))
+        if getattr(coroutine, 'cr_running', False) or getattr(coroutine, 'gi_running', False):
+            return stack + thread_stack(thread_frame, stop=frame)
+        coroutine = getattr(coroutine, 'cr_await', None) or getattr(coroutine, 'gi_yieldfrom', None)
+    return stack
+
+class RequestProfile:
+    """Stack samples of one request's thread and async view tasks, taken by a sampler thread, and the request's SQL timeline"""
+
+    def __init__(self, thread_id, interval):
+        self.profile_id = f'{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}'
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        # Event loop thread and tasks of the request's async view, if any
+        self.loop_thread_id = None
+        self.tasks = []
+        self.sql = []
+        self.started = time.perf_counter()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name=f'profiler-{self.profile_id}', daemon=True)
+
+    def start(self):
+        self._sampler.start()
+
+    def _sample(self):
+        deadline = self.started + PROFILE_MAX_SECONDS
+        while not self._stop.wait(self.interval) and time.perf_counter() < deadline:
+            frames = sys._current_frames()
+            stacks = [thread_stack(frames.get(self.thread_id))]
+            for task in self.tasks:
+                if not task.done():
+                    stacks.append(['asyncio:task'] + task_stack(task, frames.get(self.loop_thread_id)))
+            for stack in stacks:
+                if stack:
+                    self.stacks[';'.join(stack)] += 1
+                    self.samples += 1
+
+    def follow(self, task):
+        self.loop_thread_id = threading.get_ident()
+        # Replaced rather than appended to, as the sampler iterates it
+        self.tasks = self.tasks + [task]
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        return time.perf_counter() - self.started
+
+    def collapsed(self):
+        """Folded stacks, one `frame;frame;frame count` line each, for flamegraph.pl or speedscope"""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info['profile_started'] = time.perf_counter()
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current.get()
+    if profile is not None:
+        finished = time.perf_counter()
+        started = conn.info.pop('profile_started', finished)
+        profile.sql.append({
+            'offset_ms': round((started - profile.started) * 1000, 3),
+            'duration_ms': round((finished - started) * 1000, 3),
+            'statement': ' '.join(statement.split()),
+            'executemany': executemany,
+        })
+
+def profiled_task_factory(loop, coroutine, **kwargs):
+    """Task factory that adds tasks created by a profiled request, such as gather()'s, to its profile"""
+    task = asyncio.Task(coroutine, loop=loop, **kwargs)
+    profile = _current.get()
+    if profile is not None:
+        profile.follow(task)
+    return task
+
+async def followed(coroutine):
+    """Await an async view's coroutine, sampling it and the tasks it starts if the request is profiled"""
+    profile = _current.get()
+    if profile is None:
+        return await coroutine
+    loop = asyncio.get_running_loop()
+    if loop.get_task_factory() is None:
+        loop.set_task_factory(profiled_task_factory)
+    profile.follow(asyncio.current_task())
+    return await coroutine
+
+def profile_requested():
+    """Whether the current request is flagged by an admin or armed for its user"""
+    flagged = request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1'
+    if not flagged and not _armed:
+        return False
+    if not current_user.is_authenticated:
+        return False
+    if flagged and is_admin(current_user):
+        return True
+    return bool(_armed) and take_armed(current_user.user_id)
+
+def start_request_profile():
+    if profile_requested():
+        profile = RequestProfile(threading.get_ident(), PROFILE_INTERVAL_MS / 1000)
+        _current.set(profile)
+        profile.start()
+
+def finish_request_profile(response):
+    """Stop the sampler, store the profile under PROFILE_DIR and name it in X-Profile-Id"""
+    profile = _current.get()
+    if profile is None:
+        return response
+    _current.set(None)
+    duration = profile.stop()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    report = {
+        'profile_id': profile.profile_id,
+        'user_id': current_user.user_id if current_user.is_authenticated else None,
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 3),
+        'interval_ms': PROFILE_INTERVAL_MS,
+        'samples': profile.samples,
+        'sql': profile.sql,
+    }
+    with open(os.path.join(PROFILE_DIR, f'{profile.profile_id}.json'), 'w') as f:
+        json.dump(report, f, indent=1)
+    with open(os.path.join(PROFILE_DIR, f'{profile.profile_id}.collapsed'), 'w') as f:
+        f.write(profile.collapsed())
+    response.headers['X-Profile-Id'] = profile.profile_id
+    return response
+
+def discard_request_profile(exception=None):
+    # Only still set if the view raised and after_request never ran
+    profile = _current.get()
+    if profile is not None:
+        _current.set(None)
+        profile.stop()
+
+def load_profile(profile_id, collapsed=False):
+    """A stored profile's report dict, or its folded stacks; None if there is no such profile"""
+    if not all(c.isalnum() or c == '-' for c in profile_id):
+        return None
+    path = os.path.join(PROFILE_DIR, f'{profile_id}.{"collapsed" if collapsed else "json"}')
+    try:
+        with open(path) as f:
+            return f.read() if collapsed else json.load(f)
+    except FileNotFoundError:
+        return None
+
+def init_app(app, engines):
+    """Install the request hooks and the SQL timeline listeners"""
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    app.before_request(start_request_profile)
+    app.after_request(finish_request_profile)
+    app.teardown_request(discard_request_profile)
@@ -0,0 +1,110 @@
+import shutil
+import threading
+import time
+from sqlalchemy import text, bindparam
+from database import engine, env_int
+from rollups import triggers_paused, evaluate_thresholds
+from retention import scrub_archives
+from columnar_store import appliance_dir
+
+# Deletes touching more usage_logs rows than this run in the background, in
+# chunks of PURGE_CHUNK_SIZE rows, each in its own short write transaction
+PURGE_SYNC_LIMIT = env_int('PURGE_SYNC_LIMIT', 20000)
+PURGE_CHUNK_SIZE = env_int('PURGE_CHUNK_SIZE', 5000)
+
+# Appliance ids with a background purge in progress in this process
+_pending = set()
+_pending_lock = threading.Lock()
+
+def purge_pending(appliance_ids):
+    with _pending_lock:
+        return not _pending.isdisjoint(appliance_ids)
+
+def exceeds_sync_limit(connection, appliance_ids):
+    """Whether the appliances have more than PURGE_SYNC_LIMIT usage logs, counting no further than that"""
+    count = connection.execute(text("""
+        SELECT COUNT(*) FROM (SELECT 1 FROM usage_logs WHERE appliance_id IN :ids LIMIT :limit)
+    """).bindparams(bindparam('ids', expanding=True)), {'ids': list(appliance_ids), 'limit': PURGE_SYNC_LIMIT + 1}).scalar()
+    return count > PURGE_SYNC_LIMIT
+
+def delete_appliances(connection, user_id, appliance_ids, room_id=None):
+    """Delete appliances, or a whole room, with everything hanging off them in a few set-based statements.
+
+    The owner's monthly totals are reduced by the appliances' monthly
+    rollups, then usage_logs, the rollups and the latest readings go by ON
+    DELETE CASCADE with the usage_logs triggers paused. Runs in the caller's
+    transaction.
+    """
+    params = {'ids': list(appliance_ids), 'user_id': user_id}
+    with triggers_paused(connection):
+        connection.execute(text("""
+            UPDATE user_monthly_usage SET energy_consumed = energy_consumed - (
+                SELECT SUM(m.energy_consumed) FROM usage_rollup_monthly m
+                WHERE m.appliance_id IN :ids AND m.period_start = user_monthly_usage.period_start
+            )
+            WHERE user_id = :user_id AND period_start IN (
+                SELECT period_start FROM usage_rollup_monthly WHERE appliance_id IN :ids
+            )
+        """).bindparams(bindparam('ids', expanding=True)), params)
+        if room_id is not None:
+            connection.execute(text('DELETE FROM rooms WHERE room_id = :room_id'), {'room_id': room_id})
+        else:
+            connection.execute(text('DELETE FROM appliances WHERE appliance_id IN :ids')
+                               .bindparams(bindparam('ids', expanding=True)), params)
+    # Lower totals can drop the user's alert level
+    evaluate_thresholds(connection, [user_id])
+
+def delete_logs_in_chunks(appliance_ids, chunk_size=PURGE_CHUNK_SIZE):
+    """Delete the appliances' usage logs a chunk per transaction; the rollups keep them until delete_appliances()"""
+    deleted = 0
+    delete_chunk = text("""
+        DELETE FROM usage_logs WHERE log_id IN (
+            SELECT log_id FROM usage_logs WHERE appliance_id IN :ids LIMIT :chunk_size
+        )
+    """).bindparams(bindparam('ids', expanding=True))
+    while True:
+        with engine.begin() as connection:
+            with triggers_paused(connection):
+                result = connection.execute(delete_chunk, {'ids': list(appliance_ids), 'chunk_size': chunk_size})
+        deleted += result.rowcount
+        if result.rowcount < chunk_size:
+            return deleted
+        # Give queued writers a turn at the writer connection
+        time.sleep(0.01)
+
+def purge_files(user_id, appliance_ids):
+    """Drop the appliances' readings from the archive files and the columnar store"""
+    scrub_archives(user_id, appliance_ids)
+    for appliance_id in appliance_ids:
+        shutil.rmtree(appliance_dir(appliance_id), ignore_errors=True)
+
+def start_purge(user_id, appliance_ids, room_id=None, chunked=False, on_done=None):
+    """Finish deleting appliances on a background thread.
+
+    With `chunked`, the usage logs are deleted chunk by chunk and then the
+    rows themselves via delete_appliances(); otherwise the caller has
+    already done that and only the files are left. `on_done` runs after the
+    database part.
+    """
+    appliance_ids = list(appliance_ids)
+
+    def run():
+        try:
+            if chunked:
+                delete_logs_in_chunks(appliance_ids)
+                with engine.begin() as connection:
+                    delete_appliances(connection, user_id, appliance_ids, room_id)
+                if on_done is not None:
+                    on_done()
+            purge_files(user_id, appliance_ids)
+        except Exception as e:
+            print(f"Error purging appliances {appliance_ids}: {e}")
+        finally:
+            with _pending_lock:
+                _pending.difference_update(appliance_ids)
+
+    with _pending_lock:
+        _pending.update(appliance_ids)
+    thread = threading.Thread(target=run, name=f'purge-{user_id}', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,98 @@
+from collections import Counter
+from contextvars import ContextVar
+import os
+import re
+import time
+from flask import request
+from sqlalchemy import event
+from database import env_int
+
+# Development and test aid, off unless QUERY_DEBUG is set: flags a request
+# that runs the same normalized statement more than QUERY_DEBUG_REPEAT_LIMIT
+# times (an N+1 loop), and logs statements slower than SLOW_QUERY_MS with
+# their query plan. With QUERY_DEBUG_STRICT an N+1 fails the request, so a
+# test client run stops at it.
+def env_flag(name):
+    return os.environ.get(name, '').lower() in ('1', 'true', 'yes', 'on')
+
+QUERY_DEBUG = env_flag('QUERY_DEBUG')
+QUERY_DEBUG_STRICT = env_flag('QUERY_DEBUG_STRICT')
+QUERY_DEBUG_REPEAT_LIMIT = env_int('QUERY_DEBUG_REPEAT_LIMIT', 5)
+SLOW_QUERY_MS = env_int('SLOW_QUERY_MS', 100)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+class NPlusOneError(Exception):
+    """A request repeated a statement more than QUERY_DEBUG_REPEAT_LIMIT times"""
+
+def fingerprint(statement):
+    """The statement with literals and IN lists collapsed, so one query shape is one key"""
+    statement = _STRING_LITERAL.sub('?', statement)
+    statement = _NUMBER_LITERAL.sub('?', statement)
+    statement = _PLACEHOLDER_LIST.sub('(?)', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+# Statement counts of the current request, if any; a context variable so async views' SQL counts too
+_current = ContextVar('query_debug', default=None)
+
+# Every N+1 found since the process started (or reset()), for test runs to check
+violations = []
+
+def reset():
+    violations.clear()
+
+def query_plan(cursor, statement, parameters):
+    """EXPLAIN QUERY PLAN lines, run on the raw DB-API connection so no events fire"""
+    try:
+        rows = cursor.connection.execute(f'EXPLAIN QUERY PLAN {statement}', parameters or ()).fetchall()
+    except Exception as e:
+        return [f'(no plan: {e})']
+    return [row[-1] for row in rows]
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info['query_debug_started'] = time.perf_counter()
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    counts = _current.get()
+    if counts is None:
+        return
+    elapsed_ms = (time.perf_counter() - conn.info.pop('query_debug_started', time.perf_counter())) * 1000
+    counts[fingerprint(statement)] += 1
+    if elapsed_ms >= SLOW_QUERY_MS:
+        print(f"Slow query ({elapsed_ms:.1f} ms) in {request.method} {request.path}: {_WHITESPACE.sub(' ', statement).strip()}")
+        if not executemany:
+            for line in query_plan(cursor, statement, parameters):
+                print(f"    {line}")
+
+def begin_request():
+    _current.set(Counter())
+
+def end_request(response):
+    """Report statements the request repeated too often; raise NPlusOneError in strict mode"""
+    counts = _current.get()
+    _current.set(None)
+    if counts is None:
+        return response
+    repeated = [(statement, count) for statement, count in counts.items() if count > QUERY_DEBUG_REPEAT_LIMIT]
+    for statement, count in repeated:
+        violation = {'method': request.method, 'path': request.path, 'count': count, 'statement': statement}
+        violations.append(violation)
+        print(f"N+1: {request.method} {request.path} ran {count}x: {statement}")
+    if repeated and QUERY_DEBUG_STRICT:
+        raise NPlusOneError(f'{request.method} {request.path} repeated {len(repeated)} statement(s) more than '
+                            f'{QUERY_DEBUG_REPEAT_LIMIT} times')
+    return response
+
+def init_app(app, engines):
+    """Install the request hooks and SQL listeners when QUERY_DEBUG is set"""
+    if not QUERY_DEBUG:
+        return
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    app.before_request(begin_request)
+    app.after_request(end_request)
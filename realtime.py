@@ -0,0 +1,19 @@
+from flask_login import current_user
+from flask_socketio import SocketIO, join_room
+
+# Pushes dashboard deltas to each user's open tabs; app.py calls init_app()
+socketio = SocketIO()
+
+def user_room(user_id):
+    return f'user:{user_id}'
+
+@socketio.on('connect')
+def join_user_room(auth=None):
+    """Put an authenticated socket in its user's room; refuse anonymous ones"""
+    if not current_user.is_authenticated:
+        return False
+    join_room(user_room(current_user.user_id))
+
+def push_to_user(user_id, event, payload):
+    """Emit an event to every socket the user has open"""
+    socketio.emit(event, payload, to=user_room(user_id))
@@ -0,0 +1,31 @@
+import os
+import sys
+from sqlalchemy import create_engine
+from models import Base
+from rollups import rebuild_rollups
+
+BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+
+def rebuild(db_path):
+    """Create the rollup tables and triggers if missing, then rebuild them"""
+    print(f"Rebuilding usage rollups in: {db_path}")
+    engine = create_engine(f'sqlite:///{db_path}')
+    try:
+        # create_all only adds missing tables, and reinstalls the triggers
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            counts = rebuild_rollups(connection)
+        for table, count in counts.items():
+            print(f"  {table}: {count} rows")
+        print("Rebuild completed successfully!")
+        return True
+    except Exception as e:
+        print(f"Error rebuilding rollups: {e}")
+        return False
+    finally:
+        engine.dispose()
+
+if __name__ == '__main__':
+    paths = sys.argv[1:] or [os.path.join(BASE_DIR, 'smart_home.db')]
+    ok = all([rebuild(path) for path in paths])
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,150 @@
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+import hashlib
+import os
+import threading
+import time
+import uuid
+from flask import current_app, request, make_response
+from flask_login import current_user
+
+# Cached response bodies are evicted least recently used first once their
+# total size passes this many bytes
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+# Upper bound on how stale a response can be when the data was changed
+# outside this process (generate_alerts.py, another worker)
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+
+class ResponseCache:
+    """Per-user cache of GET response bodies, invalidated by bumping the user's data version.
+
+    ETags are derived from the version rather than the body, so a poll whose
+    ETag still matches is answered without running the view at all.
+    """
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # Changes on every start, so ETags handed out by an earlier process never match
+        self.instance = uuid.uuid4().hex[:8]
+        self._versions = {}
+        self._entries = OrderedDict()
+        self._user_keys = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def version(self, user_id):
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    def etag(self, user_id, version, key):
+        window = int(time.time() // self.ttl)
+        digest = hashlib.sha1(repr((key, date.today().isoformat())).encode()).hexdigest()[:16]
+        return f'{self.instance}-{user_id}-{version}-{window}-{digest}'
+
+    def get(self, user_id, key, etag):
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((user_id, key))
+            self.hits += 1
+            return entry
+
+    def put(self, user_id, key, etag, body, mimetype):
+        with self._lock:
+            if not etag.startswith(f'{self.instance}-{user_id}-{self._versions.get(user_id, 0)}-'):
+                # The user's data changed while the response was being built
+                return
+            self._discard((user_id, key))
+            self._entries[(user_id, key)] = (etag, body, mimetype)
+            self._user_keys.setdefault(user_id, set()).add(key)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes and self._entries:
+                (old_user, old_key), _ = next(iter(self._entries.items()))
+                self._discard((old_user, old_key))
+                self.evictions += 1
+
+    def _discard(self, entry_key):
+        entry = self._entries.pop(entry_key, None)
+        if entry is None:
+            return
+        self._bytes -= len(entry[1])
+        keys = self._user_keys.get(entry_key[0])
+        if keys is not None:
+            keys.discard(entry_key[1])
+            if not keys:
+                del self._user_keys[entry_key[0]]
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def invalidate_user(self, user_id):
+        """Bump the user's data version and drop their cached responses"""
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            for key in list(self._user_keys.get(user_id, ())):
+                self._discard((user_id, key))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'evictions': self.evictions,
+            }
+
+response_cache = ResponseCache()
+
+def cached_response(view):
+    """Serve a GET view from the current user's response cache, with ETag/304 support"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user_id = current_user.user_id
+        key = (request.endpoint, request.query_string, tuple(sorted(kwargs.items())))
+        etag = response_cache.etag(user_id, response_cache.version(user_id), key)
+        if request.if_none_match.contains(etag):
+            response_cache.record_not_modified()
+            response = make_response('', 304)
+        else:
+            entry = response_cache.get(user_id, key, etag)
+            if entry is not None:
+                response = make_response(entry[1])
+                response.mimetype = entry[2]
+            else:
+                # ensure_sync() runs async views to completion
+                response = make_response(current_app.ensure_sync(view)(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed or response.cache_control.no_store:
+                    return response
+                response_cache.put(user_id, key, etag, response.get_data(), response.mimetype)
+        response.set_etag(etag)
+        # Let the browser keep the body but revalidate it on every poll
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
+
+def uncacheable(response):
+    """Mark a view's fallback body, such as the empty list it answers with after a DB error, so it is neither cached nor ETagged"""
+    response.cache_control.no_store = True
+    return response
+
+def invalidates_response_cache(view):
+    """Invalidate the current user's cached responses once a write view has run"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            return view(*args, **kwargs)
+        finally:
+            response_cache.invalidate_user(current_user.user_id)
+    return wrapper
@@ -0,0 +1,244 @@
+from datetime import datetime, timedelta
+import os
+import time
+import numpy as np
+from sqlalchemy import text, bindparam, select
+from database import BASE_DIR, env_int
+from models import UsageLog, UsageArchiveWatermark, MONTH_FORMAT
+from rollups import triggers_paused
+
+# Retention tiers: raw usage_logs are kept RETENTION_RAW_DAYS (rounded down
+# to a month start), hourly rollups RETENTION_HOURLY_DAYS; the daily and
+# monthly rollups and the per-user totals are kept forever
+RETENTION_RAW_DAYS = env_int('RETENTION_RAW_DAYS', 90)
+RETENTION_HOURLY_DAYS = env_int('RETENTION_HOURLY_DAYS', 365)
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR') or os.path.join(BASE_DIR, 'archives')
+# Archived rows are deleted from usage_logs this many per transaction, so
+# the write lock is only held briefly
+ARCHIVE_DELETE_BATCH = env_int('ARCHIVE_DELETE_BATCH', 500)
+
+# Rows fetched per round trip when iter_usage_logs() reads usage_logs
+ITER_BATCH_SIZE = 1000
+
+DATETIME_TEXT = '%Y-%m-%d %H:%M:%S.%f'
+
+# One array per usage_logs column; a missing duration is stored as NaN
+ARCHIVE_COLUMNS = ('log_id', 'appliance_id', 'timestamp', 'energy_consumed', 'duration_hours')
+
+MONTH_LOGS_SQL = """
+    SELECT u.log_id, u.appliance_id, u.timestamp, u.energy_consumed, u.duration_hours
+    FROM rooms r
+    JOIN appliances a ON a.room_id = r.room_id
+    JOIN usage_logs u ON u.appliance_id = a.appliance_id
+    WHERE r.user_id = :user_id AND u.timestamp >= :start AND u.timestamp < :end
+"""
+
+def month_start(moment):
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def next_month(period_start):
+    return (period_start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def archive_path(user_id, period_start, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, str(user_id), f'{period_start:%Y-%m}.npz')
+
+def archived_before(connection):
+    """The archive watermark, or None if nothing has been archived"""
+    return connection.execute(select(UsageArchiveWatermark.archived_before)).scalar()
+
+def read_archive(path):
+    with np.load(path) as archive:
+        return {name: archive[name] for name in ARCHIVE_COLUMNS}
+
+def save_archive(path, columns):
+    """Write columns to path atomically"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + '.partial'
+    with open(partial, 'wb') as f:
+        np.savez_compressed(f, **columns)
+    os.replace(partial, path)
+
+def write_archive(path, columns):
+    """Merge columns into the archive at path, keeping one copy of each log_id"""
+    if os.path.exists(path):
+        existing = read_archive(path)
+        columns = {name: np.concatenate([existing[name], columns[name]]) for name in ARCHIVE_COLUMNS}
+    _, first = np.unique(columns['log_id'], return_index=True)
+    order = first[np.lexsort((columns['log_id'][first], columns['timestamp'][first]))]
+    save_archive(path, {name: columns[name][order] for name in ARCHIVE_COLUMNS})
+
+def scrub_archives(user_id, appliance_ids, archive_dir=ARCHIVE_DIR):
+    """Remove some appliances' readings from a user's archive files; return how many were removed"""
+    user_dir = os.path.join(archive_dir, str(user_id))
+    if not os.path.isdir(user_dir):
+        return 0
+    removed = 0
+    for name in sorted(os.listdir(user_dir)):
+        if not name.endswith('.npz'):
+            continue
+        path = os.path.join(user_dir, name)
+        columns = read_archive(path)
+        keep = ~np.isin(columns['appliance_id'], list(appliance_ids))
+        if keep.all():
+            continue
+        removed += int((~keep).sum())
+        if keep.any():
+            save_archive(path, {column: values[keep] for column, values in columns.items()})
+        else:
+            os.remove(path)
+    return removed
+
+def month_columns(connection, user_id, period_start):
+    """A user's raw logs for one month as archive columns, or None if there are none"""
+    rows = connection.execute(text(MONTH_LOGS_SQL), {
+        'user_id': user_id,
+        'start': period_start.strftime(DATETIME_TEXT),
+        'end': next_month(period_start).strftime(DATETIME_TEXT),
+    }).fetchall()
+    if not rows:
+        return None
+    log_ids, appliance_ids, timestamps, energy, duration = zip(*rows)
+    return {
+        'log_id': np.array(log_ids, dtype=np.int64),
+        'appliance_id': np.array(appliance_ids, dtype=np.int64),
+        'timestamp': np.array(timestamps, dtype='datetime64[us]'),
+        'energy_consumed': np.array(energy, dtype=np.float64),
+        'duration_hours': np.array(duration, dtype=np.float64),
+    }
+
+def archive_month(engine, user_id, period_start, archive_dir=ARCHIVE_DIR):
+    """Write a user's month of raw logs to its archive file, then delete them from usage_logs.
+
+    The file is written before anything is deleted, so a failed run only
+    leaves rows that the next run archives again. The deletes pause the
+    usage_logs triggers: the rollups, totals and latest readings keep
+    counting the archived rows. Returns the number of rows archived.
+    """
+    with engine.connect() as connection:
+        columns = month_columns(connection, user_id, period_start)
+    if columns is None:
+        return 0
+    write_archive(archive_path(user_id, period_start, archive_dir), columns)
+    log_ids = columns['log_id'].tolist()
+    delete_logs = text('DELETE FROM usage_logs WHERE log_id IN :ids').bindparams(bindparam('ids', expanding=True))
+    for i in range(0, len(log_ids), ARCHIVE_DELETE_BATCH):
+        with engine.begin() as connection:
+            with triggers_paused(connection):
+                connection.execute(delete_logs, {'ids': log_ids[i:i + ARCHIVE_DELETE_BATCH]})
+    return len(log_ids)
+
+def drop_hourly_rollups(engine, cutoff):
+    """Delete hourly rollup rows before cutoff, one appliance per transaction"""
+    with engine.connect() as connection:
+        appliance_ids = [appliance_id for appliance_id, in connection.execute(text(
+            'SELECT DISTINCT appliance_id FROM usage_rollup_hourly'))]
+    dropped = 0
+    for appliance_id in appliance_ids:
+        with engine.begin() as connection:
+            result = connection.execute(text("""
+                DELETE FROM usage_rollup_hourly WHERE appliance_id = :appliance_id AND period_start < :cutoff
+            """), {'appliance_id': appliance_id, 'cutoff': cutoff.strftime(DATETIME_TEXT)})
+        dropped += max(result.rowcount, 0)
+    return dropped
+
+def apply_retention(engine, now=None, raw_days=RETENTION_RAW_DAYS, hourly_days=RETENTION_HOURLY_DAYS,
+                    archive_dir=ARCHIVE_DIR):
+    """Archive raw logs older than the raw tier, per user and month, and trim the hourly rollups"""
+    started = time.perf_counter()
+    now = now or datetime.utcnow()
+    with engine.begin() as connection:
+        # The watermark only moves forward; it goes up before archiving so
+        # bulk loads stop recomputing rollups for months about to leave usage_logs
+        connection.execute(text("""
+            INSERT INTO usage_archive_watermark (watermark_id, archived_before) VALUES (1, :cutoff)
+            ON CONFLICT (watermark_id) DO UPDATE SET
+                archived_before = MAX(archived_before, excluded.archived_before)
+        """), {'cutoff': month_start(now - timedelta(days=raw_days)).strftime(DATETIME_TEXT)})
+        cutoff = archived_before(connection)
+        months = [(user_id, datetime.strptime(period_start, DATETIME_TEXT)) for user_id, period_start in connection.execute(text("""
+            SELECT r.user_id, strftime(:month_format, u.timestamp) AS period_start
+            FROM usage_logs u
+            JOIN appliances a ON a.appliance_id = u.appliance_id
+            JOIN rooms r ON r.room_id = a.room_id
+            WHERE u.timestamp < :cutoff
+            GROUP BY r.user_id, period_start
+            ORDER BY period_start, r.user_id
+        """), {'month_format': MONTH_FORMAT, 'cutoff': cutoff.strftime(DATETIME_TEXT)})]
+    print(f"Archiving usage logs before {cutoff:%Y-%m-%d}: {len(months)} user-months")
+
+    archived = 0
+    for done, (user_id, period_start) in enumerate(months, start=1):
+        rows = archive_month(engine, user_id, period_start, archive_dir)
+        archived += rows
+        print(f"  [{done}/{len(months)}] user {user_id} {period_start:%Y-%m}: {rows} rows")
+
+    # Hourly rollups are never dropped for periods that still have raw logs
+    hourly_cutoff = min(cutoff, now - timedelta(days=hourly_days))
+    dropped = drop_hourly_rollups(engine, hourly_cutoff)
+    print(f"Dropped {dropped} hourly rollups before {hourly_cutoff:%Y-%m-%d %H:00}")
+    return {
+        'archived_before': cutoff,
+        'months': len(months),
+        'archived_rows': archived,
+        'dropped_hourly_rollups': dropped,
+        'seconds': time.perf_counter() - started,
+    }
+
+def iter_usage_logs(connection, user_id, start=None, end=None, archive_dir=ARCHIVE_DIR, appliance_ids=None):
+    """Yield (log_id, appliance_id, timestamp, energy_consumed, duration_hours) for a user's appliances.
+
+    Archived months are read from their files first, then usage_logs, each
+    oldest first, so callers see one history whichever tier holds it.
+    `appliance_ids` narrows it to some of the user's appliances. `connection`
+    can be a Connection or a Session.
+    """
+    owned = [appliance_id for appliance_id, in connection.execute(text("""
+        SELECT a.appliance_id FROM appliances a JOIN rooms r ON r.room_id = a.room_id WHERE r.user_id = :user_id
+    """), {'user_id': user_id})]
+    appliance_ids = owned if appliance_ids is None else sorted(set(owned) & set(appliance_ids))
+    if not appliance_ids:
+        return
+
+    watermark = archived_before(connection)
+    user_dir = os.path.join(archive_dir, str(user_id))
+    if watermark is not None and os.path.isdir(user_dir):
+        for name in sorted(os.listdir(user_dir)):
+            if not name.endswith('.npz'):
+                continue
+            period_start = datetime.strptime(name[:-len('.npz')], '%Y-%m')
+            if (end is not None and period_start >= end) or (start is not None and next_month(period_start) <= start):
+                continue
+            columns = read_archive(os.path.join(user_dir, name))
+            keep = np.isin(columns['appliance_id'], appliance_ids)
+            if start is not None:
+                keep &= columns['timestamp'] >= np.datetime64(start, 'us')
+            if end is not None:
+                keep &= columns['timestamp'] < np.datetime64(end, 'us')
+            log_ids = columns['log_id'][keep].tolist()
+            duration = columns['duration_hours'][keep].astype(object)
+            duration[np.isnan(columns['duration_hours'][keep])] = None
+            yield from zip(log_ids, columns['appliance_id'][keep].tolist(), columns['timestamp'][keep].tolist(),
+                           columns['energy_consumed'][keep].tolist(), duration.tolist())
+
+    logs = UsageLog.__table__
+    query = select(logs.c.log_id, logs.c.appliance_id, logs.c.timestamp, logs.c.energy_consumed, logs.c.duration_hours)\
+        .where(logs.c.appliance_id.in_(appliance_ids))\
+        .order_by(logs.c.timestamp, logs.c.log_id)
+    if start is not None:
+        query = query.where(logs.c.timestamp >= start)
+    if end is not None:
+        query = query.where(logs.c.timestamp < end)
+    month, month_ids = None, ()
+    for row in connection.execute(query.execution_options(stream_results=True)).yield_per(ITER_BATCH_SIZE):
+        if watermark is not None and row.timestamp < watermark:
+            # Only an archive run that has not deleted its rows yet leaves any
+            # behind the watermark; skip those already yielded from the file,
+            # holding one month's archived ids at a time
+            period_start = datetime(row.timestamp.year, row.timestamp.month, 1)
+            if period_start != month:
+                month = period_start
+                path = archive_path(user_id, month, archive_dir)
+                month_ids = set(read_archive(path)['log_id'].tolist()) if os.path.exists(path) else ()
+            if row.log_id in month_ids:
+                continue
+        yield tuple(row)
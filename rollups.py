@@ -0,0 +1,121 @@
+from contextlib import contextmanager
+from sqlalchemy import text, bindparam, DateTime
+from models import ROLLUP_GRAINS, MONTH_FORMAT, threshold_evaluation_sql
+
+# The archive watermark as DateTime text, or '' (before every timestamp) if
+# nothing has been archived; see retention.py
+ARCHIVED_BEFORE = "COALESCE((SELECT archived_before FROM usage_archive_watermark), '')"
+
+@contextmanager
+def triggers_paused(connection):
+    """Skip the usage_logs triggers inside the caller's transaction.
+
+    The pause row is deleted again on success; if the block raises, the
+    caller's rollback discards it along with everything else.
+    """
+    connection.execute(text('INSERT INTO usage_log_trigger_pause DEFAULT VALUES'))
+    yield
+    connection.execute(text('DELETE FROM usage_log_trigger_pause'))
+
+def refresh_rollups(connection, appliance_ids, since):
+    """Recompute every rollup period from the one containing `since` onwards for some appliances.
+
+    Periods before the archive watermark are left alone: their raw logs are
+    no longer in usage_logs.
+    """
+    params = {'ids': list(appliance_ids), 'since': since}
+    for table, period_format in ROLLUP_GRAINS:
+        params['period_format'] = period_format
+        connection.execute(text(f"""
+            DELETE FROM {table}
+            WHERE appliance_id IN :ids AND period_start >= MAX(strftime(:period_format, :since), {ARCHIVED_BEFORE})
+        """).bindparams(bindparam('ids', expanding=True), bindparam('since', type_=DateTime)), params)
+        connection.execute(text(f"""
+            INSERT INTO {table} (appliance_id, period_start, energy_consumed, duration_hours, reading_count)
+            SELECT appliance_id, strftime(:period_format, timestamp),
+                   SUM(energy_consumed), SUM(COALESCE(duration_hours, 0)), COUNT(*)
+            FROM usage_logs
+            WHERE appliance_id IN :ids AND timestamp >= MAX(strftime(:period_format, :since), {ARCHIVED_BEFORE})
+            GROUP BY appliance_id, strftime(:period_format, timestamp)
+        """).bindparams(bindparam('ids', expanding=True), bindparam('since', type_=DateTime)), params)
+
+def refresh_user_totals(connection, appliance_ids, since):
+    """Recompute the monthly totals of the appliances' owners from the month containing `since`.
+
+    Reads usage_rollup_monthly, so it runs after refresh_rollups(). Returns
+    the owners' user ids.
+    """
+    user_ids = [user_id for user_id, in connection.execute(text("""
+        SELECT DISTINCT r.user_id FROM appliances a JOIN rooms r ON r.room_id = a.room_id
+        WHERE a.appliance_id IN :ids
+    """).bindparams(bindparam('ids', expanding=True)), {'ids': list(appliance_ids)})]
+    params = {'users': user_ids, 'since': since, 'month_format': MONTH_FORMAT}
+    connection.execute(text("""
+        DELETE FROM user_monthly_usage
+        WHERE user_id IN :users AND period_start >= strftime(:month_format, :since)
+    """).bindparams(bindparam('users', expanding=True), bindparam('since', type_=DateTime)), params)
+    connection.execute(text("""
+        INSERT INTO user_monthly_usage (user_id, period_start, energy_consumed)
+        SELECT r.user_id, m.period_start, SUM(m.energy_consumed)
+        FROM usage_rollup_monthly m
+        JOIN appliances a ON a.appliance_id = m.appliance_id
+        JOIN rooms r ON r.room_id = a.room_id
+        WHERE r.user_id IN :users AND m.period_start >= strftime(:month_format, :since)
+        GROUP BY r.user_id, m.period_start
+    """).bindparams(bindparam('users', expanding=True), bindparam('since', type_=DateTime)), params)
+    return user_ids
+
+def evaluate_thresholds(connection, user_ids):
+    """Raise alerts for users whose current-month total crossed a threshold; see models.threshold_evaluation_sql"""
+    for statement in threshold_evaluation_sql('u.user_id IN :users'):
+        connection.execute(text(statement).bindparams(bindparam('users', expanding=True)),
+                           {'users': list(user_ids)})
+
+def refresh_latest_readings(connection, appliance_ids):
+    """Recompute appliance_latest_reading for some appliances"""
+    params = {'ids': list(appliance_ids)}
+    connection.execute(text("""
+        DELETE FROM appliance_latest_reading WHERE appliance_id IN :ids
+    """).bindparams(bindparam('ids', expanding=True)), params)
+    connection.execute(text("""
+        INSERT INTO appliance_latest_reading (appliance_id, log_id, energy_consumed, timestamp)
+        SELECT u.appliance_id, u.log_id, u.energy_consumed, u.timestamp
+        FROM appliances a
+        JOIN usage_logs u ON u.log_id = (
+            SELECT log_id FROM usage_logs
+            WHERE appliance_id = a.appliance_id
+            ORDER BY timestamp DESC, log_id DESC LIMIT 1
+        )
+        WHERE a.appliance_id IN :ids
+    """).bindparams(bindparam('ids', expanding=True)), params)
+
+def rebuild_rollups(connection):
+    """Recompute every rollup table and the per-user monthly totals from usage_logs inside the caller's transaction.
+
+    Rollup periods before the archive watermark are kept as they are.
+    """
+    counts = {}
+    for table, period_format in ROLLUP_GRAINS:
+        connection.execute(text(f'DELETE FROM {table} WHERE period_start >= {ARCHIVED_BEFORE}'))
+        result = connection.execute(text(f"""
+            INSERT INTO {table} (appliance_id, period_start, energy_consumed, duration_hours, reading_count)
+            SELECT appliance_id, strftime(:period_format, timestamp),
+                   SUM(energy_consumed), SUM(COALESCE(duration_hours, 0)), COUNT(*)
+            FROM usage_logs
+            WHERE timestamp >= {ARCHIVED_BEFORE}
+            GROUP BY appliance_id, strftime(:period_format, timestamp)
+        """), {'period_format': period_format})
+        counts[table] = result.rowcount
+    # Inserting the totals re-evaluates every user's thresholds; a level that
+    # did not change writes nothing
+    connection.execute(text('DELETE FROM user_monthly_usage'))
+    result = connection.execute(text("""
+        INSERT INTO user_monthly_usage (user_id, period_start, energy_consumed)
+        SELECT r.user_id, m.period_start, SUM(m.energy_consumed)
+        FROM usage_rollup_monthly m
+        JOIN appliances a ON a.appliance_id = m.appliance_id
+        JOIN rooms r ON r.room_id = a.room_id
+        GROUP BY r.user_id, m.period_start
+    """))
+    counts['user_monthly_usage'] = result.rowcount
+    return counts
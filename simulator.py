@@ -1,62 +1,206 @@
-import random
 import datetime
-from datetime import timedelta
-import json
-import os
+import numpy as np
+
+# Reading spacing accepted by simulate_usage_arrays()
+RESOLUTIONS = {'15min': 900, 'hourly': 3600, 'daily': 86400}
+
+# 'peaks' is the original morning/afternoon/evening model; 'constant', 'daily'
+# and 'weekly' are the EnergySimulator usage patterns; 'pattern' picks one per
+# appliance from the catalog by name and falls back to 'peaks'
+PROFILES = ('peaks', 'constant', 'daily', 'weekly', 'pattern')
+
+# (first hour, end hour, low, high): each day an appliance uses between low
+# and high times its max rating in kWh, spread evenly over the window
+PEAK_WINDOWS = [
+    (7, 10, 0.5, 1.5),
+    (12, 15, 0.3, 0.8),
+    (18, 23, 0.7, 2.0),
+]
+
+MAX_SIMULATION_DAYS = 3660
+# Upper bound on appliances x slots in one simulation, idle slots included
+MAX_SIMULATION_SLOTS = 2_000_000
+# Appliances are simulated and loaded in groups of about this many slots
+SIMULATION_CHUNK_SLOTS = 200_000
+
+def simulation_slots(days, resolution):
+    """Slots per appliance in a `days`-day simulation, counting the current day in full"""
+    return days * 86400 // RESOLUTIONS[resolution]
+
+def appliance_chunks(appliances, days, resolution):
+    """Split `appliances` into groups of about SIMULATION_CHUNK_SLOTS slots, at least one appliance each"""
+    size = max(1, SIMULATION_CHUNK_SLOTS // simulation_slots(days, resolution))
+    return [appliances[i:i + size] for i in range(0, len(appliances), size)]
+
+def _peaks_profile(rng, n, hours, days, n_days):
+    """Return (power fraction of max rating, duty cycle) matrices of shape (n, slots)"""
+    power = np.zeros((n, hours.size))
+    duty = np.zeros((n, hours.size))
+    for first, end, low, high in PEAK_WINDOWS:
+        in_window = (hours >= first) & (hours < end)
+        factors = rng.uniform(low, high, size=(n, n_days)) / (end - first)
+        power[:, in_window] = factors[:, days[in_window]]
+        duty[:, in_window] = 1.0
+    return power, duty
+
+def _pattern_profile(pattern, rng, n, hours, weekdays, min_fraction):
+    """Power drawn between the min and max rating, on for part of each active slot"""
+    shape = (n, hours.size)
+    power = rng.uniform(0, 1, size=shape) * (1 - min_fraction[:, None]) + min_fraction[:, None]
+    if pattern == 'constant':
+        duty = rng.uniform(0.35, 0.6, size=shape)
+    elif pattern == 'daily':
+        active = (hours >= 8) & (hours < 23)
+        duty = rng.uniform(0.5, 1.0, size=shape) * (rng.random(shape) < 0.35) * active
+    else:  # weekly: laundry on Wednesday and Saturday mornings
+        active = np.isin(weekdays, (2, 5)) & (hours >= 9) & (hours < 12)
+        duty = rng.uniform(0.6, 1.0, size=shape) * active
+    return power, duty
+
+def appliance_pattern(name):
+    """Catalog usage pattern whose key appears in an appliance name, or 'peaks'"""
+    normalized = (name or '').lower().replace(' ', '_')
+    for entry in simulator.catalog:
+        if entry['name'] in normalized:
+            return str(entry['usage_pattern'])
+    return 'peaks'
+
+def simulate_usage_arrays(appliances, end, days=7, resolution='hourly', profile='peaks', seed=None):
+    """Generate usage readings for many appliances at once.
+
+    `appliances` is a sequence of (appliance_id, name, min_watt, max_watt).
+    Returns (appliance_ids, timestamps, energy_kwh, duration_hours) arrays
+    covering the `days` calendar days up to the slot containing `end`,
+    with idle slots dropped. `seed` may also be a numpy Generator, to draw
+    several groups of appliances from one stream.
+    """
+    step = RESOLUTIONS[resolution]
+    base_step = min(step, 3600)
+    rng = np.random.default_rng(seed)
+
+    end = np.datetime64(end, 's')
+    start_day = end.astype('datetime64[D]') - np.timedelta64(days - 1, 'D')
+    start = start_day.astype('datetime64[s]')
+    n_slots = int((end - start) // np.timedelta64(base_step, 's')) + 1
+    offsets = np.arange(n_slots, dtype=np.int64) * base_step
+    hours = (offsets // 3600) % 24
+    days_index = offsets // 86400
+    weekdays = (days_index + (start_day.astype(np.int64) + 3) % 7) % 7  # 1970-01-01 was a Thursday
+
+    ids = np.array([a[0] for a in appliances], dtype=np.int64)
+    min_watt = np.array([a[2] or 0 for a in appliances], dtype=np.float64)
+    max_watt = np.array([a[3] or 0 for a in appliances], dtype=np.float64)
+    min_fraction = np.divide(min_watt, max_watt, out=np.zeros_like(max_watt), where=max_watt > 0).clip(0, 1)
+    if profile == 'pattern':
+        patterns = np.array([appliance_pattern(a[1]) for a in appliances])
+    else:
+        patterns = np.full(len(appliances), profile)
+
+    power = np.zeros((len(appliances), n_slots))
+    duty = np.zeros((len(appliances), n_slots))
+    for pattern in np.unique(patterns):
+        rows = np.flatnonzero(patterns == pattern)
+        if pattern == 'peaks':
+            p, d = _peaks_profile(rng, rows.size, hours, days_index, days)
+        else:
+            p, d = _pattern_profile(pattern, rng, rows.size, hours, weekdays, min_fraction[rows])
+        power[rows] = p
+        duty[rows] = d
+
+    slot_hours = base_step / 3600
+    energy = power * duty * (max_watt[:, None] / 1000) * slot_hours
+    duration = duty * slot_hours
+    slot_times = start + offsets.astype('timedelta64[s]')
+    if step != base_step:
+        # Daily readings: pad the current partial day, then sum each day's hours
+        per_slot = step // base_step
+        pad = ((0, 0), (0, -n_slots % per_slot))
+        energy = np.pad(energy, pad).reshape(len(appliances), -1, per_slot).sum(axis=2)
+        duration = np.pad(duration, pad).reshape(len(appliances), -1, per_slot).sum(axis=2)
+        slot_times = slot_times[::per_slot]
+
+    app_index, slot_index = np.nonzero(energy > 0)
+    return ids[app_index], slot_times[slot_index], energy[app_index, slot_index], duration[app_index, slot_index]
+
+def format_timestamps(timestamps):
+    """Render datetime64 values in the text form SQLAlchemy stores for DateTime columns"""
+    if timestamps.size == 0:
+        # np.char.replace() cannot size its output for an empty array
+        return np.array([], dtype='U26')
+    return np.char.replace(np.datetime_as_string(timestamps.astype('datetime64[us]'), unit='us'), 'T', ' ')
+
+# One row per catalog appliance; readings refer to rows by index instead of
+# copying the appliance's details into every reading
+CATALOG_DTYPE = np.dtype([
+    ('name', 'U32'),
+    ('min_power', 'f4'),  # watts
+    ('max_power', 'f4'),
+    ('usage_pattern', 'U8'),
+    ('description', 'U48'),
+])
+
+class UsageBatch:
+    """Columnar block of simulated readings.
+
+    `appliance_index` points into the simulator catalog; `timestamps` are
+    datetime64[s] and `power_watt` is float32, all of equal length.
+    """
+    __slots__ = ('room_name', 'appliance_index', 'timestamps', 'power_watt')
+
+    def __init__(self, room_name, appliance_index, timestamps, power_watt):
+        self.room_name = room_name
+        self.appliance_index = appliance_index
+        self.timestamps = timestamps
+        self.power_watt = power_watt
+
+    def __len__(self):
+        return len(self.power_watt)
+
+    @classmethod
+    def concatenate(cls, batches):
+        batches = list(batches)
+        return cls(
+            batches[0].room_name if batches else None,
+            np.concatenate([b.appliance_index for b in batches]) if batches else np.empty(0, np.int16),
+            np.concatenate([b.timestamps for b in batches]) if batches else np.empty(0, 'datetime64[s]'),
+            np.concatenate([b.power_watt for b in batches]) if batches else np.empty(0, np.float32),
+        )
 
 class EnergySimulator:
-    def __init__(self):
-        # Load appliance data from JSON
-        self.appliances = self._load_appliance_data()
+    def __init__(self, seed=None):
+        # Load appliance data into a structured array
+        self.catalog = self._load_appliance_data()
+        self.catalog_index = {name: i for i, name in enumerate(self.catalog['name'])}
+        self.rng = np.random.default_rng(seed)
         self.current_time = datetime.datetime.now()
         
     def _load_appliance_data(self):
         """Load appliance data with typical power ratings and usage patterns"""
-        return {
-            'refrigerator': {
-                'min_power': 100,  # watts
-                'max_power': 200,
-                'usage_pattern': 'constant',
-                'description': 'Runs continuously'
-            },
-            'air_conditioner': {
-                'min_power': 1000,
-                'max_power': 2000,
-                'usage_pattern': 'daily',
-                'description': 'High usage during hot hours'
-            },
-            'washing_machine': {
-                'min_power': 500,
-                'max_power': 1000,
-                'usage_pattern': 'weekly',
-                'description': 'High usage during laundry days'
-            },
-            'television': {
-                'min_power': 50,
-                'max_power': 200,
-                'usage_pattern': 'daily',
-                'description': 'Evening usage'
-            },
-            'computer': {
-                'min_power': 100,
-                'max_power': 300,
-                'usage_pattern': 'daily',
-                'description': 'Work hours usage'
-            }
-        }
+        return np.array([
+            ('refrigerator', 100, 200, 'constant', 'Runs continuously'),
+            ('air_conditioner', 1000, 2000, 'daily', 'High usage during hot hours'),
+            ('washing_machine', 500, 1000, 'weekly', 'High usage during laundry days'),
+            ('television', 50, 200, 'daily', 'Evening usage'),
+            ('computer', 100, 300, 'daily', 'Work hours usage'),
+        ], dtype=CATALOG_DTYPE)
+
+    def _catalog_indices(self, appliances):
+        """Catalog rows for the known appliance names; unknown names are skipped"""
+        return np.array([self.catalog_index[name] for name in appliances if name in self.catalog_index], dtype=np.int16)
     
     def generate_energy_reading(self, appliance_name):
         """Generate a simulated energy reading for an appliance"""
-        if appliance_name not in self.appliances:
+        index = self.catalog_index.get(appliance_name)
+        if index is None:
             return None
             
-        appliance = self.appliances[appliance_name]
-        power = random.uniform(appliance['min_power'], appliance['max_power'])
+        appliance = self.catalog[index]
+        power = self.rng.uniform(appliance['min_power'], appliance['max_power'])
         return {
-            'power_watt': power,
+            'power_watt': float(power),
             'timestamp': self.current_time.strftime('%Y-%m-%d %H:%M:%S'),
             'appliance_name': appliance_name,
-            'description': appliance['description']
+            'description': str(appliance['description'])
         }
     
     def generate_room_data(self, room_name, appliances):
@@ -70,24 +214,30 @@ class EnergySimulator:
                     'appliance': reading
                 })
         return readings
+
+    def _day_batch(self, room_name, indices, day_start):
+        """24 hourly readings for each catalog row in `indices`, hour-major"""
+        hours = day_start + np.arange(24).astype('timedelta64[h]')
+        appliance_index = np.tile(indices, 24)
+        low = self.catalog['min_power'][appliance_index]
+        high = self.catalog['max_power'][appliance_index]
+        power = (low + self.rng.random(appliance_index.size, dtype=np.float32) * (high - low)).astype(np.float32)
+        return UsageBatch(room_name, appliance_index, np.repeat(hours, indices.size).astype('datetime64[s]'), power)
+
+    def iter_daily_usage(self, room_name, appliances, days, start=None):
+        """Yield one UsageBatch per day, so long simulations run in constant memory"""
+        indices = self._catalog_indices(appliances)
+        day = np.datetime64(start or datetime.date.today(), 'D')
+        for offset in range(days):
+            yield self._day_batch(room_name, indices, day + np.timedelta64(offset, 'D'))
     
-    def generate_daily_usage(self, room_name, appliances):
-        """Generate a day's worth of simulated readings"""
-        readings = []
-        for hour in range(24):
-            self.current_time = datetime.datetime.now().replace(hour=hour, minute=0, second=0)
-            room_data = self.generate_room_data(room_name, appliances)
-            readings.extend(room_data)
-        return readings
+    def generate_daily_usage(self, room_name, appliances, start=None):
+        """Generate a day's worth of simulated readings as one UsageBatch"""
+        return next(self.iter_daily_usage(room_name, appliances, 1, start))
     
-    def generate_monthly_usage(self, room_name, appliances):
-        """Generate a month's worth of simulated readings"""
-        readings = []
-        for day in range(30):
-            self.current_time = datetime.datetime.now() + timedelta(days=day)
-            daily_readings = self.generate_daily_usage(room_name, appliances)
-            readings.extend(daily_readings)
-        return readings
+    def generate_monthly_usage(self, room_name, appliances, start=None):
+        """Generate a month's worth of simulated readings as one UsageBatch"""
+        return UsageBatch.concatenate(self.iter_daily_usage(room_name, appliances, 30, start))
 
 # Initialize simulator
 simulator = EnergySimulator()
@@ -1,6 +1,7 @@
 // Global variables
 let isAuthenticated = true; // Track authentication state
 let updateInterval = null;  // Track the interval for data updates
+let socket = null;          // Live updates; polling only runs while it is disconnected
 
 // Helper functions
 async function handleApiResponse(response, errorMessage) {
@@ -60,31 +61,7 @@ function updateEnergyReadings() {
     
     fetch('/api/energy-readings')
         .then(response => handleApiResponse(response, 'Failed to fetch energy readings'))
-        .then(data => {
-            const readingsContainer = document.getElementById('usageHistory');
-            if (!readingsContainer) return;
-
-            if (!data) {
-                showAuthMessage(readingsContainer);
-                return;
-            }
-
-            if (!data.length) {
-                readingsContainer.innerHTML = '<div class="alert alert-info">No energy readings available</div>';
-                return;
-            }
-
-            readingsContainer.innerHTML = data.map(reading => `
-                <div class="reading-item">
-                    <div class="reading-details">
-                        <span class="appliance-name">${reading.appliance_name}</span>
-                        <span class="current-power">${Number(reading.current_power).toFixed(2)} kWh</span>
-                        <span class="status badge ${reading.status === 'Active' ? 'bg-success' : 'bg-secondary'}">${reading.status}</span>
-                        <span class="timestamp text-muted">${reading.timestamp}</span>
-                    </div>
-                </div>
-            `).join('');
-        })
+        .then(renderEnergyReadings)
         .catch(error => {
             console.error('Error fetching energy readings:', error);
             const readingsContainer = document.getElementById('usageHistory');
@@ -94,6 +71,36 @@ function updateEnergyReadings() {
         });
 }
 
+function renderEnergyReadings(data) {
+    const readingsContainer = document.getElementById('usageHistory');
+    if (!readingsContainer) return;
+
+    if (!data) {
+        showAuthMessage(readingsContainer);
+        return;
+    }
+
+    if (!data.length) {
+        readingsContainer.innerHTML = '<div class="alert alert-info">No energy readings available</div>';
+        return;
+    }
+
+    readingsContainer.innerHTML = data.map(renderReading).join('');
+}
+
+function renderReading(reading) {
+    return `
+        <div class="reading-item" data-appliance-id="${reading.appliance_id}">
+            <div class="reading-details">
+                <span class="appliance-name">${reading.appliance_name}</span>
+                <span class="current-power">${Number(reading.current_power).toFixed(2)} kWh</span>
+                <span class="status badge ${reading.status === 'Active' ? 'bg-success' : 'bg-secondary'}">${reading.status}</span>
+                <span class="timestamp text-muted">${reading.timestamp}</span>
+            </div>
+        </div>
+    `;
+}
+
 function updateUsageHistory() {
     if (!isAuthenticated) return;
     
@@ -181,60 +188,68 @@ function updateRoomWiseUsage() {
         return response.json();
     })
     .then(data => {
-        // Handle empty or invalid data
-        if (!data || !Array.isArray(data) || !data.length) {
-            roomUsageContainer.innerHTML = '<div class="alert alert-info">No rooms found</div>';
-            if (editRoomBtn) editRoomBtn.style.display = 'none';
-            return;
-        }
+        if (data) renderRoomUsage(data);
+    })
+    .catch(error => {
+        console.error('Error updating room usage:', error);
+        roomUsageContainer.innerHTML = '<div class="alert alert-danger">Failed to load room usage data: ' + error.message + '</div>';
+    });
+}
 
-        if (editRoomBtn) editRoomBtn.style.display = 'block';
-
-        const roomCards = data.map(room => {
-            const totalPower = room.total_power || 0;
-            const applianceItems = (room.appliances || []).map(appliance => {
-                const statusClass = (appliance.status || 'Inactive').toLowerCase() === 'active' ? 'active' : 'inactive';
-                return `
-                    <div class="appliance-item" data-appliance-id="${appliance.appliance_id}">
-                        <div class="appliance-name">${appliance.appliance_name || 'Unknown'}</div>
-                        <div class="appliance-details">
-                            <span>Qty: ${appliance.quantity || 1}</span>
-                            <span>Power: ${appliance.min_power_rating_watt || 0}W - ${appliance.max_power_rating_watt || 0}W</span>
-                            <span>Usage: ${(appliance.current_usage || 0).toFixed(2)} kWh</span>
-                            <span class="status-badge ${statusClass}">${appliance.status || 'Inactive'}</span>
-                            <button type="button" class="btn btn-sm btn-outline-primary ms-2 edit-appliance-btn" data-appliance-id="${appliance.appliance_id}">Edit</button>
-                            <button type="button" class="btn btn-sm btn-outline-danger ms-1 delete-appliance-btn" data-appliance-id="${appliance.appliance_id}">Delete</button>
-                        </div>
-                    </div>
-                `;
-            }).join('');
+function renderRoomUsage(data) {
+    const roomUsageContainer = document.getElementById('roomUsage');
+    const editRoomBtn = document.getElementById('editRoomBtn');
+    if (!roomUsageContainer) return;
+
+    // Handle empty or invalid data
+    if (!data || !Array.isArray(data) || !data.length) {
+        roomUsageContainer.innerHTML = '<div class="alert alert-info">No rooms found</div>';
+        if (editRoomBtn) editRoomBtn.style.display = 'none';
+        return;
+    }
+
+    if (editRoomBtn) editRoomBtn.style.display = 'block';
+
+    const roomCards = data.map(room => {
+        const totalPower = room.total_power || 0;
+        const applianceItems = (room.appliances || []).map(appliance => {
+            const statusClass = (appliance.status || 'Inactive').toLowerCase() === 'active' ? 'active' : 'inactive';
             return `
-                <div class="card mb-3 room-card" data-room-id="${room.room_id}">
-                    <div class="card-body">
-                        <h5 class="card-title d-flex justify-content-between align-items-center">
-                            <span>${room.room_name}</span>
-                            <div>
-                                <button type="button" class="btn btn-sm btn-outline-primary edit-room-btn" data-room-id="${room.room_id}">Edit</button>
-                                <button type="button" class="btn btn-sm btn-outline-danger delete-room-btn" data-room-id="${room.room_id}">Delete</button>
-                            </div>
-                        </h5>
-                        <p class="card-text">Total Power: ${totalPower.toFixed(2)} W</p>
-                        <div class="appliances-list">
-                            <h6>Appliances:</h6>
-                            ${applianceItems}
-                        </div>
+                <div class="appliance-item" data-appliance-id="${appliance.appliance_id}">
+                    <div class="appliance-name">${appliance.appliance_name || 'Unknown'}</div>
+                    <div class="appliance-details">
+                        <span>Qty: ${appliance.quantity || 1}</span>
+                        <span>Power: ${appliance.min_power_rating_watt || 0}W - ${appliance.max_power_rating_watt || 0}W</span>
+                        <span class="appliance-usage">Usage: ${(appliance.current_usage || 0).toFixed(2)} kWh</span>
+                        <span class="status-badge ${statusClass}">${appliance.status || 'Inactive'}</span>
+                        <button type="button" class="btn btn-sm btn-outline-primary ms-2 edit-appliance-btn" data-appliance-id="${appliance.appliance_id}">Edit</button>
+                        <button type="button" class="btn btn-sm btn-outline-danger ms-1 delete-appliance-btn" data-appliance-id="${appliance.appliance_id}">Delete</button>
                     </div>
                 </div>
             `;
         }).join('');
+        return `
+            <div class="card mb-3 room-card" data-room-id="${room.room_id}">
+                <div class="card-body">
+                    <h5 class="card-title d-flex justify-content-between align-items-center">
+                        <span>${room.room_name}</span>
+                        <div>
+                            <button type="button" class="btn btn-sm btn-outline-primary edit-room-btn" data-room-id="${room.room_id}">Edit</button>
+                            <button type="button" class="btn btn-sm btn-outline-danger delete-room-btn" data-room-id="${room.room_id}">Delete</button>
+                        </div>
+                    </h5>
+                    <p class="card-text">Total Power: ${totalPower.toFixed(2)} W</p>
+                    <div class="appliances-list">
+                        <h6>Appliances:</h6>
+                        ${applianceItems}
+                    </div>
+                </div>
+            </div>
+        `;
+    }).join('');
 
-        // Update container
-        roomUsageContainer.innerHTML = roomCards;
-    })
-    .catch(error => {
-        console.error('Error updating room usage:', error);
-        roomUsageContainer.innerHTML = '<div class="alert alert-danger">Failed to load room usage data: ' + error.message + '</div>';
-    });
+    // Update container
+    roomUsageContainer.innerHTML = roomCards;
 }
 
 // Event delegation for room/appliance buttons (they are dynamically added)
@@ -261,9 +276,7 @@ document.addEventListener('click', function(e) {
 // DOMContentLoaded event handler
 document.addEventListener('DOMContentLoaded', function() {
     initializeContainers();
-    updateRoomWiseUsage();
-    updateEnergyAlerts();
-    updateUsageHistory();
+    loadDashboardBundle();
     startDataUpdates();
 });
 
@@ -273,28 +286,7 @@ function updateEnergyAlerts() {
     
     fetch('/api/alerts')
         .then(response => handleApiResponse(response, 'Failed to fetch alerts'))
-        .then(data => {
-            const alertsContainer = document.getElementById('alertsContainer');
-            if (!alertsContainer) return;
-
-            if (!data) {
-                showAuthMessage(alertsContainer);
-                return;
-            }
-
-            if (!data.length) {
-                alertsContainer.innerHTML = '<div class="alert alert-info">No alerts</div>';
-                return;
-            }
-
-            alertsContainer.innerHTML = data.map(alert => `
-                <div class="alert alert-${alert.type}">
-                    <i class="fas fa-exclamation-triangle me-2"></i>
-                    <span class="alert-message">${alert.message}</span>
-                    <small class="d-block text-muted">${alert.timestamp}</small>
-                </div>
-            `).join('');
-        })
+        .then(renderAlerts)
         .catch(error => {
             console.error('Error fetching alerts:', error);
             const alertsContainer = document.getElementById('alertsContainer');
@@ -318,14 +310,10 @@ function updateUsageChart() {
 function startDataUpdates() {
     if (updateInterval) {
         clearInterval(updateInterval);
+        updateInterval = null;
     }
-    updateInterval = setInterval(() => {
-        updateEnergyReadings();
-        updateRoomWiseUsage();
-        updateEnergyAlerts();
-        updateDashboardStats();
-        updateUsageChart();
-    }, 5000);
+    if (socket && socket.connected) return;
+    updateInterval = setInterval(loadDashboardBundle, 5000);
 }
 
 // Generate Simulation Data Function
@@ -350,11 +338,7 @@ function generateSimulationData() {
             showAlert(data.success ? 'success' : 'error', data.success ? 'Simulation data generated successfully' : (data.message || 'Failed to generate data'));
         }
         if (data.success) {
-            updateEnergyReadings();
-            updateRoomWiseUsage();
-            updateEnergyAlerts();
-            updateDashboardStats();
-            updateUsageChart();
+            loadDashboardBundle();
         }
     })
     .catch(error => {
@@ -525,28 +509,7 @@ function updateEnergyAlerts() {
     
     fetch('/api/alerts')
         .then(response => handleApiResponse(response, 'Failed to fetch alerts'))
-        .then(data => {
-            const alertsContainer = document.getElementById('alertsContainer');
-            if (!alertsContainer) return;
-
-            if (!data) {
-                showAuthMessage(alertsContainer);
-                return;
-            }
-
-            if (!data.length) {
-                alertsContainer.innerHTML = '<div class="alert alert-info">No alerts</div>';
-                return;
-            }
-
-            alertsContainer.innerHTML = data.map(alert => `
-                <div class="alert alert-${alert.type}">
-                    <i class="fas fa-exclamation-triangle me-2"></i>
-                    <span class="alert-message">${alert.message}</span>
-                    <small class="d-block text-muted">${alert.timestamp}</small>
-                </div>
-            `).join('');
-        })
+        .then(renderAlerts)
         .catch(error => {
             console.error('Error fetching alerts:', error);
             const alertsContainer = document.getElementById('alertsContainer');
@@ -610,17 +573,7 @@ document.addEventListener('DOMContentLoaded', function() {
         populateRoomDropdown();
     });
 
-    // Initialize data updates
-    startDataUpdates();
-    updateUsageChart();
-
-    // Update initial data
-    updateEnergyReadings();
-    updateRoomWiseUsage();
-    updateEnergyAlerts();
-    updateDashboardStats();
-
-    // Start initial updates
+    // Initial data arrives through the bundle loaded above; keep polling as a fallback
     startDataUpdates();
 
     // Room form submission
@@ -776,24 +729,7 @@ function updateDashboardStats() {
                 return;
             }
 
-            const today = typeof data.current_usage === 'number' ? data.current_usage.toFixed(2) : '0.00';
-            const monthly = typeof data.monthly_usage === 'number' ? data.monthly_usage.toFixed(2) : '0.00';
-            statsContainer.innerHTML = `
-                <div class="row g-3">
-                    <div class="col-md-6">
-                        <div class="usage-stats">
-                            <h6>Today's Usage</h6>
-                            <h3>${today} kWh</h3>
-                        </div>
-                    </div>
-                    <div class="col-md-6">
-                        <div class="usage-stats">
-                            <h6>Monthly Usage</h6>
-                            <h3>${monthly} kWh</h3>
-                        </div>
-                    </div>
-                </div>
-            `;
+            renderDashboardStats(statsContainer, data);
         })
         .catch(error => {
             console.error('Error fetching dashboard stats:', error);
@@ -812,14 +748,54 @@ const labels = [];
 function startDataUpdates() {
     if (updateInterval) {
         clearInterval(updateInterval);
+        updateInterval = null;
     }
-    updateInterval = setInterval(() => {
-        updateEnergyReadings();
-        updateRoomWiseUsage();
-        updateEnergyAlerts();
-        updateDashboardStats();
-        updateUsageChart();
-    }, 5000);
+    if (socket && socket.connected) return;
+    updateInterval = setInterval(loadDashboardBundle, 5000);
+}
+
+function renderUsageChart(data) {
+    if (!data) return;
+
+    // Initialize data arrays
+    const labels = [];
+    const values = [];
+
+    // Process monthly data
+    data.forEach(entry => {
+        labels.push(entry.month);
+        values.push(entry.energy_consumed);
+    });
+
+    // Update chart
+    if (window.usageChart) {
+        window.usageChart.data.labels = labels;
+        window.usageChart.data.datasets[0].data = values;
+        window.usageChart.update();
+    }
+}
+
+// Fetch all five dashboard panels in one request
+function loadDashboardBundle() {
+    if (!isAuthenticated) return;
+
+    fetch('/api/dashboard-bundle')
+        .then(response => handleApiResponse(response, 'Failed to fetch dashboard'))
+        .then(bundle => {
+            if (!bundle) {
+                renderEnergyReadings(null);
+                renderAlerts(null);
+                showAuthMessage(document.getElementById('dashboardStats'));
+                return;
+            }
+            renderEnergyReadings(bundle.energy_readings);
+            renderRoomUsage(bundle.room_usage);
+            renderAlerts(bundle.alerts);
+            const statsContainer = document.getElementById('dashboardStats');
+            if (statsContainer) renderDashboardStats(statsContainer, bundle.dashboard_stats);
+            renderUsageChart(bundle.usage_history);
+        })
+        .catch(error => console.error('Error fetching dashboard:', error));
 }
 
 // Function to update usage chart
@@ -828,27 +804,129 @@ function updateUsageChart() {
     
     fetch('/api/usage-history')
         .then(response => handleApiResponse(response, 'Failed to fetch usage history'))
-        .then(data => {
-            if (!data) return;
+        .then(renderUsageChart)
+        .catch(error => {
+            console.error('Error updating usage chart:', error);
+        });
+}
 
-            // Initialize data arrays
-            const labels = [];
-            const values = [];
+function renderDashboardStats(statsContainer, data) {
+    const today = typeof data.current_usage === 'number' ? data.current_usage.toFixed(2) : '0.00';
+    const monthly = typeof data.monthly_usage === 'number' ? data.monthly_usage.toFixed(2) : '0.00';
+    statsContainer.innerHTML = `
+        <div class="row g-3">
+            <div class="col-md-6">
+                <div class="usage-stats">
+                    <h6>Today's Usage</h6>
+                    <h3>${today} kWh</h3>
+                </div>
+            </div>
+            <div class="col-md-6">
+                <div class="usage-stats">
+                    <h6>Monthly Usage</h6>
+                    <h3>${monthly} kWh</h3>
+                </div>
+            </div>
+        </div>
+    `;
+}
 
-            // Process monthly data
-            data.forEach(entry => {
-                labels.push(entry.month);
-                values.push(entry.energy_consumed);
-            });
+function renderAlerts(data) {
+    const alertsContainer = document.getElementById('alertsContainer');
+    if (!alertsContainer) return;
+
+    if (!data) {
+        showAuthMessage(alertsContainer);
+        return;
+    }
+
+    if (!data.length) {
+        alertsContainer.innerHTML = '<div class="alert alert-info">No alerts</div>';
+        return;
+    }
 
-            // Update chart
-            if (window.usageChart) {
-                window.usageChart.data.labels = labels;
-                window.usageChart.data.datasets[0].data = values;
-                window.usageChart.update();
+    alertsContainer.innerHTML = data.map(renderAlert).join('');
+}
+
+function renderAlert(alert) {
+    return `
+        <div class="alert alert-${alert.type}">
+            <i class="fas fa-exclamation-triangle me-2"></i>
+            <span class="alert-message">${alert.message}</span>
+            <small class="d-block text-muted">${alert.timestamp}</small>
+        </div>
+    `;
+}
+
+// Live updates: the server pushes deltas to this user's socket room
+const MAX_ALERTS_SHOWN = 10;
+
+function applyReadings(readings) {
+    const readingsContainer = document.getElementById('usageHistory');
+    readings.forEach(reading => {
+        if (readingsContainer) {
+            const item = readingsContainer.querySelector(`.reading-item[data-appliance-id="${reading.appliance_id}"]`);
+            if (item) {
+                item.outerHTML = renderReading(reading);
+            } else {
+                readingsContainer.querySelector('.alert')?.remove();
+                readingsContainer.insertAdjacentHTML('beforeend', renderReading(reading));
             }
-        })
-        .catch(error => {
-            console.error('Error updating usage chart:', error);
-        });
+        }
+        const appliance = document.querySelector(`.appliance-item[data-appliance-id="${reading.appliance_id}"]`);
+        if (appliance) {
+            const usage = appliance.querySelector('.appliance-usage');
+            if (usage) usage.textContent = `Usage: ${Number(reading.current_power).toFixed(2)} kWh`;
+            const badge = appliance.querySelector('.status-badge');
+            if (badge) {
+                badge.textContent = reading.status;
+                badge.classList.toggle('active', reading.status === 'Active');
+                badge.classList.toggle('inactive', reading.status !== 'Active');
+            }
+        }
+    });
+}
+
+function applyTotals(totals) {
+    const statsContainer = document.getElementById('dashboardStats');
+    if (statsContainer) renderDashboardStats(statsContainer, totals);
+    const chart = window.usageChart;
+    if (!chart) return;
+    const labels = chart.data.labels;
+    const values = chart.data.datasets[0].data;
+    if (labels.length && labels[labels.length - 1] === totals.month) {
+        values[values.length - 1] = totals.monthly_usage;
+    } else {
+        labels.push(totals.month);
+        values.push(totals.monthly_usage);
+    }
+    chart.update();
 }
+
+function applyAlerts(alerts) {
+    const alertsContainer = document.getElementById('alertsContainer');
+    if (!alertsContainer) return;
+    alertsContainer.querySelector('.alert-info')?.remove();
+    alerts.forEach(alert => alertsContainer.insertAdjacentHTML('afterbegin', renderAlert(alert)));
+    while (alertsContainer.children.length > MAX_ALERTS_SHOWN) {
+        alertsContainer.lastElementChild.remove();
+    }
+}
+
+function connectLiveUpdates() {
+    if (typeof io === 'undefined' || socket) return;
+    socket = io();
+    socket.on('connect', () => {
+        // Pushed deltas replace the polling timer while connected
+        if (updateInterval) {
+            clearInterval(updateInterval);
+            updateInterval = null;
+        }
+    });
+    socket.on('disconnect', startDataUpdates);
+    socket.on('readings', applyReadings);
+    socket.on('totals', applyTotals);
+    socket.on('alerts', applyAlerts);
+}
+
+document.addEventListener('DOMContentLoaded', connectLiveUpdates);
@@ -0,0 +1,80 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+from flask_login import UserMixin
+
+# Bounded LRU with a TTL; the TTL caps how long another worker process can
+# serve a record that this process did not invalidate
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 300))
+
+class UserRecord(UserMixin):
+    """The fields request handling needs from a user, detached from any session"""
+    __slots__ = ('user_id', 'email', 'first_name', 'last_name')
+
+    def __init__(self, user_id, email, first_name, last_name):
+        self.user_id = user_id
+        self.email = email
+        self.first_name = first_name
+        self.last_name = last_name
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.user_id, user.email, user.first_name, user.last_name)
+
+    def get_id(self):
+        return str(self.user_id)
+
+class UserCache:
+    """Thread-safe LRU/TTL cache of UserRecords keyed by user_id"""
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._records.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._records.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._records[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, record):
+        with self._lock:
+            self._records[record.user_id] = (record, time.monotonic() + self.ttl)
+            self._records.move_to_end(record.user_id)
+            while len(self._records) > self.maxsize:
+                self._records.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._records.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._records),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+user_cache = UserCache()